@@ -1,17 +1,40 @@
 import sys
+import math
 import time
-from datetime import datetime
+import calendar
+from datetime import datetime, timedelta
 import threading
-import numpy
+from numpy.lib.recfunctions import structured_to_unstructured
+from Libraries.ringbuffer import RingBuffer
+from Libraries.filewatcher import FileWatcher
+from Libraries import valuesparser
+from Libraries.windowstats import WindowStats
+from Libraries import metrics
+from Libraries import sources
 
 debug = True
+writer = None  # logwriter.LogWriter shared with the controller, the file is written directly without it
+
+
+INGEST = metrics.histogram('td2c_ingest_seconds', 'Reading of a values file and storage of its new measures')
+MEASURES = metrics.counter('td2c_measures_total', 'Measures stored in the buffer')
+MALFORMED = metrics.counter('td2c_malformed_lines_total', 'Lines of the values files ignored', ['reason'])
+LAST_MEASURE = metrics.gauge('td2c_last_measure_timestamp', 'Timestamp (SmartPi local time) of the newest measure')
 
 
 def log(line):
+    line = str(datetime.now()) + ': ' + str(line)
+    if writer is not None:
+        writer.write('log_Smartpi.log', line, echo=False)  # not printed, like before
+        return
     f = open('log_Smartpi.log', 'a')
-    f.write(str(datetime.now()) + ': ' + str(line) + '\n')
+    f.write(line + '\n')
     f.close()
-    # print(str(datetime.now()) + ': ' + str(line))
+
+
+def todatetime(timestamp):
+    """Convert an epoch of the buffer back to the local time written by the SmartPi"""
+    return datetime(1970, 1, 1) + timedelta(seconds=int(timestamp))
 
 
 class SmartPi(threading.Thread):
@@ -19,41 +42,102 @@ class SmartPi(threading.Thread):
     """Read consumption information and store it in the variable 'value' """
 
     # Initialisation of the used variables in the thread
-    def __init__(self, interval, buffer_size):
+    def __init__(self, interval, buffer_size, watch=False, spans=None):
 
         """
         Store measurement from SmartPi board and serve them when asked
         :param interval: Loop frequency in second (min 5 with SmartPi)
         :param buffer_size: Number of measure to keep in buffer
+        :param watch: Read the values file as soon as the SmartPi rewrites it instead of every 'interval'
+        :param spans: Windows in second of the statistics kept in self.stats (see windowstats), None for none
         """
 
         threading.Thread.__init__(self)
         self.interval = interval
+        self.watch = watch
+        self.watcher = None
+        self.timer = None
         self.buffer_size = buffer_size
         self.file_to_watch = "/var/tmp/smartpi/values"
-        self.items = ["timestamp", "I1", "I2", "I3", "I4", "V1", "V2", "V3", "P1", "P2", "P3", "Cos1", "Cos2",
-                      "Cos3", "F1", "F2", "F3", "Balanced"]
-        self.buffer = [[] for i in range(5)]  # buffer format = [[timestamp],[I1],[I2],[I3],[I4]]
-        self.last_measure = 0
+        self.items = valuesparser.ITEMS
+        # buffer format = timestamp (epoch of the SmartPi local time) + one column per channel of self.items[1:]
+        self.buffer = RingBuffer(buffer_size, len(self.items) - 1)
+        self.last_measure = 0  # timestamp of the newest stored measure, older or equal ones are duplicates
+        self.stats = WindowStats(self.items[1:], spans) if spans else None
+        self.on_measure = None  # function called with the number of new measures once they are stored
+        self.source = None  # where ingest() takes the measures, see sources.py (the values file by default)
         self.enabled = True
 
     def run(self):
+        if self.watch:
+            # inotify (or mtime/size polling) on the values file, no thread created per reading
+            self.watcher = FileWatcher(self.file_to_watch, self.readmeasure, min(self.interval, 0.5))
+            self.watcher.run()
+            self.watcher.close()
+            return
         while self.enabled:
             self.timer = threading.Timer(self.interval, self.readmeasure)
-            self.timer.setDaemon(True)
+            self.timer.daemon = True
             self.timer.start()
             self.timer.join()
 
+    async def ingest(self):
+        """Asyncio counterpart of run() in watch mode, the measures of self.source are stored in the event loop"""
+        if self.source is None:
+            self.source = sources.FileSource(self.file_to_watch, min(self.interval, 0.5))
+        await self.source.run(self)
+
     def stop(self):
         self.enabled = False
-        if self.timer.isAlive():
+        if self.watcher is not None:
+            self.watcher.stop()
+        if self.source is not None:
+            self.source.stop()
+        if self.timer is not None and self.timer.is_alive():
                 self.timer.cancel()
 
     # Get the current measure from the SmartPi program
     def readmeasure(self):
-            with open(self.file_to_watch, "r") as f:
-                for line in f:
-                    self.process(line)
+        self.load(self.file_to_watch)
+
+    def load(self, path):
+        """
+        Store in the buffer all the measures of a values file (live or archived) newer than the last one stored
+        :param path: File written by the SmartPi daemon, one measure per line
+        :return: The parsing report : lines read, parsed and malformed per reason
+        """
+        start = time.perf_counter()
+        measures, report = valuesparser.parse_file(path)
+        self.store(measures, report, path)
+        INGEST.observe(time.perf_counter() - start)
+        return report
+
+    def store(self, measures, report=None, source=None):
+        """
+        Store the measures newer than the last one stored, whatever their source
+        :param measures: numpy structured array of valuesparser.DTYPE, in chronological order
+        :param report: parsing report of the measures, its malformed lines are counted and logged
+        :param source: name of the source for the messages
+        :return: number of measures stored
+        """
+        measures = measures[measures['timestamp'] > self.last_measure]
+        if len(measures):
+            self.last_measure = int(measures['timestamp'][-1])
+            data = structured_to_unstructured(measures[self.items[1:]])
+            self.buffer.extend(measures['timestamp'], data)
+            if self.stats is not None:
+                self.stats.extend(measures['timestamp'], data)
+            MEASURES.inc(len(measures))
+            LAST_MEASURE.set(self.last_measure)
+        if report is not None and sum(report['malformed'].values()):
+            for reason, count in report['malformed'].items():
+                if count:
+                    MALFORMED.labels(reason).inc(count)
+            log("Malformed lines ignored in {} : {}".format(source, report['malformed']))
+        if debug: print("{} new measures read in {}".format(len(measures), source))
+        if len(measures) and self.on_measure is not None:
+            self.on_measure(len(measures))
+        return len(measures)
 
     # transform the line to have usable values and store them
     def process(self, line):
@@ -65,64 +149,77 @@ class SmartPi(threading.Thread):
         if debug: print("{} received values, expected {} :".format(str(len(values)), str(len(self.items))))
 
         # format the table
-        if len(values) == len(self.items):
-            # convert a string to a date
-            values[0] = datetime.strptime(values[0], '%Y-%m-%d %H:%M:%S')
-            # round values ni the line
-            for i in range(1, len(self.items)-2):
-                values[i] = round(float(values[i]), 2)
-                # if debug: log(self.items[i] + " = " + str(values[i]))
+        if len(values) != len(self.items):
+            log("Malformed line ignored : " + line.strip())
+            return
+        try:
+            # convert a string to a date, kept as an epoch of the SmartPi local time
+            timestamp = calendar.timegm(time.strptime(values[0], '%Y-%m-%d %H:%M:%S'))
+            measure = [float(value) for value in values[1:]]
+        except ValueError:
+            log("Malformed line ignored : " + line.strip())
+            return
+        if not all(math.isfinite(value) for value in measure):
+            log("Malformed line ignored : " + line.strip())  # "nan" or "inf" for float()
+            return
+        if timestamp <= self.last_measure:
+            # the file has not been rewritten since the last reading, the record is already in the buffer
+            return
+        self.last_measure = timestamp
+        MEASURES.inc()
+        LAST_MEASURE.set(timestamp)
         log(str(values))
-        print(values[:8])
-
-        # Store the value in the Buffer
-        for i in range(0, 4):
-            self.buffer[i].append(values[i])
-
-        # If buffer is full, remove the oldest value
-        if len(self.buffer[0]) > self.buffer_size:
-            for i in range(0, 4):
-                del self.buffer[i][0]
+        if debug: print(values[:8])
+
+        # Store the value in the Buffer, the oldest one is overwritten when it is full
+        self.buffer.append(timestamp, measure)
+        if self.stats is not None:
+            self.stats.add(timestamp, measure)
+        if self.on_measure is not None:
+            self.on_measure(1)
+
+    def restore(self, timestamps, data, last_measure):
+        """Put back measures saved before a restart (see snapshot.py), only the ones newer than the buffer"""
+        keep = timestamps > self.last_measure
+        if keep.any():
+            self.buffer.extend(timestamps[keep], data[keep])
+            if self.stats is not None:
+                self.stats.extend(timestamps[keep], data[keep])
+        self.last_measure = max(self.last_measure, int(last_measure))
 
     def getbuffer(self):
-        return self.buffer
+        """Return the chronological content of the buffer : [[timestamp],[I1],[I2],[I3],[I4]]"""
+        return self.getrange(None, None)
 
     def getrange(self, first, last):
-        answer = []
+        """Same as getbuffer, sliced like a list with 'first' and 'last'"""
+        timestamps, data = self.buffer.get(first, last)
+        answer = [[todatetime(t) for t in timestamps.tolist()]]
         for i in range(0, 4):
-            answer[i] = self.buffer[i][first:last]
+            answer.append(data[:, i].tolist())
         return answer
 
     def getmean(self, length=None, reference="begin"):
         """
         return a moving average on condition that the 'length' param is smaller than the buffer size
         if the length param is equal to the buffer size, then it's a non-moving average
+        The running sums of the buffer make it O(1) whatever the length
         :param length: length of the array to compute
-        :param reference: position of the timestamp in the average.
-            'begin' = beginning of the average range
-            'end' = end of the average range
-        :return: Returns a list with the average of the last 'length' elements of I1 to I4 : [[timestamp],[I1],[I2],[I3],[I4]]
+        :param reference: which timestamp of the average range is returned.
+            'begin' = newest sample of the range (the moment the average is valid from)
+            'end' = oldest sample of the range
+        :return: Returns a list with the average of the last 'length' elements of I1 to I4 : [timestamp, I1, I2, I3, I4]
         """
-        answer = [[] for i in range(5)]
-        if debug: print("buffer len = {}".format(len(self.buffer[0])))
+        if debug: print("buffer len = {}".format(len(self.buffer)))
         if length is None:
-            if len(self.buffer[0]) == 0:
+            if len(self.buffer) == 0:
                 print("The buffer is empty")
                 return -1
-            else:
-                length = len(self.buffer[0])
-        elif length > len(self.buffer[0]):
+        elif length > len(self.buffer) or length < 1:
             print("Frame size too big !")
             return -1
 
-        if reference == "begin":
-            if debug: print("buffer : " + str(buffer))
-            answer[0] = self.buffer[0][length-1]
-            for i in range(1, 4):
-                answer[i] = numpy.mean(self.buffer[i][:length])
-            return answer
-        else:  # reference == "end"
-            answer[0] = self.buffer[0][0]
-            for i in range(1, 4):
-                answer[i] = numpy.mean(self.buffer[i][:length])
-            return answer
+        first, last, means = self.buffer.mean(length)
+        answer = [todatetime(last if reference == "begin" else first)]
+        answer.extend(means[:4].tolist())
+        return answer
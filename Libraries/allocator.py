@@ -0,0 +1,191 @@
+# Sharing of the current available on the site between the ChargeBoxes of several EV-Box modems,
+# and scheduling of the bus exchanges with these modems
+import time
+from Libraries import maxprotocol
+
+PHASES = 3
+IDLE = 1.0  # a ChargeBox drawing less than this (A) on every phase has no car charging
+RESOLUTION = 0.1  # the currents are sent in dA
+
+
+class Connector:
+
+    """One ChargeBox as seen by the allocator, currents in A"""
+
+    __slots__ = ('address', 'index', 'min_current', 'max_current', 'priority', 'phases', 'active')
+
+    def __init__(self, address, index, min_current, max_current, priority=0, phases=(0, 1, 2), active=True):
+
+        """
+        :param address: Modem address the ChargeBox answers behind
+        :param index: Position of the ChargeBox in the answers of its modem
+        :param min_current: Current below which the car does not charge : the connector gets this or nothing
+        :param max_current: Current the connector can use at most per phase
+        :param priority: Connectors with a higher priority are served first
+        :param phases: Phases (0 = L1) the car draws on
+        :param active: A car is charging. An idle connector only gets its minimum, so that a car plugged
+            in can start, the rest goes to the active ones
+        """
+
+        self.address = address
+        self.index = index
+        self.min_current = min_current
+        self.max_current = max(max_current, min_current)
+        self.priority = priority
+        self.phases = tuple(phases)
+        self.active = active
+
+    def __repr__(self):
+        return "{:02X}:{} min={}A max={}A prio={} phases={}{}".format(
+            self.address, self.index, self.min_current, self.max_current, self.priority, self.phases,
+            "" if self.active else " idle")
+
+
+def connectors(addresses, responses, min_current, max_current, priorities=None):
+    """
+    Connectors of the modems from their last answers
+    :param addresses: Modem addresses in the order of the configuration
+    :param responses: dict address -> last maxprotocol.StationResponse of the modem, if it has answered once
+    :param min_current: Minimum current used when the answer gives none (poleMin)
+    :param max_current: Max current of a connector (poleMax), lowered to the station max current
+    :param priorities: dict "80" (every box of the modem) or "80:1" (one box) -> priority
+    :return: list of Connector. A modem that never answered counts as one active connector
+    """
+    priorities = priorities or {}
+    answer = []
+    for address in addresses:
+        response = responses.get(address)
+        default = priorities.get("{:02X}".format(address), 0)
+        if response is None or not response.boxes:
+            answer.append(Connector(address, 0, min_current, max_current, default))
+            continue
+        limit = min(max_current, response.max_current) if response.max_current else max_current
+        for i, box in enumerate(response.boxes):
+            drawn = [box.l1, box.l2, box.l3]
+            used = tuple(p for p in range(PHASES) if drawn[p] >= IDLE)
+            answer.append(Connector(address, i, box.min_current or min_current, limit,
+                                    priorities.get("{:02X}:{}".format(address, i), default),
+                                    used or (0, 1, 2), bool(used)))
+    return answer
+
+
+def fill(grants, limits, amount):
+    """
+    Max-min fair share of 'amount' : the lowest grants are raised first, each one up to its limit
+    :return: the new grants
+    """
+    if not grants or amount <= 0:
+        return list(grants)
+    if sum(limits) - sum(grants) <= amount:
+        return list(limits)
+    # water level reached by the grants : what they take grows linearly with the level between two grants or
+    # limits, the level is found on the segment where 'amount' is crossed
+    previous, given = None, 0.0
+    for level in sorted(set(grants) | set(limits)):
+        taken = sum(min(max(level, g), l) - g for g, l in zip(grants, limits))
+        if taken > amount:
+            break
+        previous, given = level, taken
+    rising = sum(1 for g, l in zip(grants, limits) if g <= previous < l)
+    level = previous + (amount - given) / rising
+    return [min(max(level, g), l) for g, l in zip(grants, limits)]
+
+
+def allocate(available, connectors, policy="fair"):
+    """
+    Share the current available on each phase between the connectors
+    1. Minimum currents, by priority (active connectors first) : a connector is admitted only if its minimum fits
+       on every phase it uses, else it gets nothing (0 pauses the charge)
+    2. What remains on each phase goes to the admitted active connectors using it :
+       'fair' = max-min fair share inside each priority level, 'priority' = in order, each one up to its max
+    :param available: Current in A available per phase [L1, L2, L3]
+    :param connectors: list of Connector
+    :param policy: 'fair' or 'priority'
+    :return: dict (address, index) -> [L1, L2, L3] granted in A, rounded down to RESOLUTION
+    """
+    remaining = [max(value, 0) for value in available]
+    grants = {(c.address, c.index): [0.0] * PHASES for c in connectors}
+    ranking = sorted(connectors, key=lambda c: (-c.priority, not c.active, c.address, c.index))
+    admitted = []
+    for c in ranking:
+        if all(remaining[p] >= c.min_current for p in c.phases):
+            for p in c.phases:
+                remaining[p] -= c.min_current
+                grants[c.address, c.index][p] = c.min_current
+            admitted.append(c)
+
+    for p in range(PHASES):
+        users = [c for c in admitted if c.active and p in c.phases]
+        levels = sorted(set(c.priority for c in users), reverse=True)
+        if policy == "priority":
+            groups = [[c] for c in users]  # already in priority order
+        else:
+            groups = [[c for c in users if c.priority == level] for level in levels]
+        for group in groups:
+            before = [grants[c.address, c.index][p] for c in group]
+            after = fill(before, [c.max_current for c in group], remaining[p])
+            for c, value in zip(group, after):
+                grants[c.address, c.index][p] = value
+            remaining[p] -= sum(after) - sum(before)
+
+    for key, values in grants.items():
+        grants[key] = [int(value / RESOLUTION + 1e-6) * RESOLUTION for value in values]
+    return grants
+
+
+def station_limits(addresses, grants):
+    """
+    Limits per phase to send to each modem : a modem gets the sum of the currents of its ChargeBoxes
+    and shares it between them itself
+    :return: dict address -> [L1, L2, L3] in A
+    """
+    limits = {address: [0.0] * PHASES for address in addresses}
+    for (address, index), values in grants.items():
+        if address in limits:
+            limits[address] = [round(a + b, 1) for a, b in zip(limits[address], values)]
+    return limits
+
+
+class BusScheduler:
+
+    """Order of the exchanges with the modems on the shared RS485 bus : round robin, a modem that does not answer
+    is skipped during a backoff (so that it does not cost the answer deadline every cycle), and a modem is not
+    called again before the minimum interval it announced"""
+
+    def __init__(self, addresses, max_skip=16):
+
+        """
+        :param addresses: Modem addresses on the bus
+        :param max_skip: Most cycles a failing modem is skipped (the number doubles at each failure)
+        """
+
+        self.addresses = list(addresses)
+        self.max_skip = max_skip
+        self.first = 0  # the round starts after the modem that was first in the previous one
+        self.failures = dict((address, 0) for address in self.addresses)
+        self.skip = dict((address, 0) for address in self.addresses)
+        self.not_before = dict((address, 0) for address in self.addresses)
+
+    def due(self, now=None):
+        """Modems to call for this cycle, in order"""
+        now = time.monotonic() if now is None else now
+        count = len(self.addresses)
+        ordered = [self.addresses[(self.first + i) % count] for i in range(count)]
+        self.first = (self.first + 1) % max(count, 1)
+        answer = []
+        for address in ordered:
+            if self.skip[address] > 0:
+                self.skip[address] -= 1
+            elif now >= self.not_before[address]:
+                answer.append(address)
+        return answer
+
+    def done(self, address, response, now=None):
+        """Record the result of an exchange : StationResponse or error string"""
+        now = time.monotonic() if now is None else now
+        if isinstance(response, maxprotocol.StationResponse):
+            self.failures[address] = 0
+            self.not_before[address] = now + response.min_interval
+        else:
+            self.failures[address] += 1
+            self.skip[address] = min(2 ** (self.failures[address] - 1), self.max_skip) - 1
@@ -0,0 +1,224 @@
+# Offline evaluation of the control laws over historical measures, for every combination of settings :
+#   python -m Libraries.backtest [--store store] [--poleMin 6,8] [--poleMax 16,32] [--MaxConsoCurrent 25,32]
+#                                [--period 60] [--modes Peak-shaving,PV_Low-priority] [--phase 1] [values files...]
+#
+# Model of the site, one phase, currents in A :
+# - the history is the site WITHOUT the charge : iConso is the house alone (the station current of the
+#   history is removed from it when it is known, see load_store)
+# - the controller computes an order every 'period' seconds from the mean of the measures of the previous
+#   period (like SmartPi.getmean), the station then draws it until the next command :
+#   nothing below poleMin, at most poleMax, a car always plugged in and accepting the charge
+# - grid current = house + charge - PV - battery (iBatt > 0 is a discharge, a supply of the house)
+# As the laws add back the current of the station to the measured consumption, the orders do not depend
+# on the previous charges : every period is computed at once, with arrays
+import sys
+import itertools
+import numpy
+from Libraries import policies
+from Libraries import valuesparser
+from Libraries import tsstore
+from Libraries.allocator import PHASES
+
+MAX_GAP = 60  # s, a longer hole in the measures counts as this long (no energy for a stopped meter)
+
+
+class History:
+
+    """Measures of a site in chronological order, one row per measure"""
+
+    def __init__(self, timestamps, iBatt, iPV, iConso, max_gap=MAX_GAP):
+        order = numpy.argsort(timestamps, kind='stable')
+        self.timestamps = numpy.asarray(timestamps, dtype=numpy.int64)[order]
+        self.iBatt = numpy.asarray(iBatt, dtype=numpy.float64)[order]
+        self.iPV = numpy.abs(numpy.asarray(iPV, dtype=numpy.float64)[order])
+        self.iConso = numpy.abs(numpy.asarray(iConso, dtype=numpy.float64)[order])
+        # duration of each measure : until the next one, the last one as long as the one before
+        if len(self.timestamps) > 1:
+            steps = numpy.diff(self.timestamps)
+            self.durations = numpy.minimum(numpy.append(steps, steps[-1]), max_gap).astype(numpy.float64)
+        else:
+            self.durations = numpy.ones(len(self.timestamps))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+def load_values(paths, max_gap=MAX_GAP):
+    """History of SmartPi values files (live file or archives), wired like the Smatch Box"""
+    parts = [valuesparser.parse_file(path)[0] for path in paths]
+    measures = numpy.concatenate(parts) if parts else numpy.zeros(0, dtype=valuesparser.DTYPE)
+    timestamps, first = numpy.unique(measures['timestamp'], return_index=True)  # files may overlap
+    measures = measures[first]
+    return History(timestamps, measures['I1'], measures['I2'], measures['I3'], max_gap)
+
+
+def load_store(path, start=None, end=None, max_gap=None, phase=0):
+    """
+    History of the cycles kept by the controller (one mean per cycle), the current drawn by the stations
+    at each cycle being removed from iConso
+    :param max_gap: default : three times the usual time between two cycles
+    :param phase: phase of the consumption clamp (EVBox.measuredPhase - 1), see policies.station_current
+    """
+    store = tsstore.TimeSeriesStore(path)
+    measures = store.query('measures', start, end)
+    connectors = store.query('connectors', start, end)
+    timestamps = numpy.array(measures['timestamp'])
+    station = numpy.zeros(len(timestamps))
+    if len(connectors['timestamp']):
+        # current of every connector reading on the phase of the clamp, summed per cycle
+        current = numpy.asarray(connectors['l{}'.format(phase + 1)], dtype=numpy.float64)
+        index = numpy.searchsorted(timestamps, connectors['timestamp'])
+        found = index < len(timestamps)
+        found[found] = timestamps[index[found]] == connectors['timestamp'][found]
+        station = numpy.bincount(index[found], current[found], len(timestamps))
+    if max_gap is None:
+        max_gap = 3 * numpy.median(numpy.diff(timestamps)) if len(timestamps) > 1 else MAX_GAP
+    return History(timestamps, measures['iBatt'], measures['iPV'],
+                   numpy.maximum(numpy.abs(measures['iConso']) - station, 0), max_gap)
+
+
+class Periods:
+
+    """
+    What the simulation needs of each control period, computed once for all the settings : the charge is
+    constant over a period, so a period is summed up by its durations and the distribution of its grid current
+    without the charge (sorted, with cumulated sums), and a run only costs a search per period
+    """
+
+    def __init__(self, history, period):
+        self.period = period
+        if len(history):
+            self.index = (history.timestamps - history.timestamps[0]) // period
+        else:
+            self.index = numpy.zeros(0, dtype=numpy.int64)
+        count = numpy.bincount(self.index)
+        durations = history.durations
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            # mean of the measures of each period, NaN for a period without measure
+            self.means = [numpy.bincount(self.index, values) / count
+                          for values in (history.iBatt, history.iPV, history.iConso)]
+        self.durations = numpy.bincount(self.index, durations)
+        self.total = durations.sum()
+        base = history.iConso - history.iPV - history.iBatt  # grid current without the charge
+        self.base = numpy.bincount(self.index, base * durations)
+
+        # highest currents of each period, -inf for a period without measure
+        self.ends = numpy.cumsum(count)
+        starts = self.ends - count
+        filled = count > 0
+        self.peak_house = numpy.full(len(count), -numpy.inf)
+        self.peak_grid = numpy.full(len(count), -numpy.inf)
+        if len(history):
+            self.peak_house[filled] = numpy.maximum.reduceat(history.iConso, starts[filled])
+            self.peak_grid[filled] = numpy.maximum.reduceat(base, starts[filled])
+
+        # grid currents sorted inside each period, shifted by period so that one search finds them
+        self.low = base.min() if len(base) else 0.0
+        self.high = base.max() if len(base) else 0.0
+        self.span = self.high - self.low + 2
+        order = numpy.lexsort((base, self.index))
+        self.keys = base[order] - self.low + 1 + self.index[order] * self.span
+        self.cumulated = numpy.concatenate(([0.0], numpy.cumsum((base * durations)[order])))
+        self.cumulated_durations = numpy.concatenate(([0.0], numpy.cumsum(durations[order])))
+
+    def imported(self, charges):
+        """Current x time taken from the grid in each period (A.s) with these charges"""
+        # measures with base + charge > 0, searched at -charge (kept inside the range of the period)
+        threshold = numpy.clip(-charges, self.low - 1, self.high)
+        first = numpy.searchsorted(self.keys, threshold - self.low + 1 + numpy.arange(len(charges)) * self.span,
+                                   side='right')
+        return self.cumulated[self.ends] - self.cumulated[first] + \
+            charges * (self.cumulated_durations[self.ends] - self.cumulated_durations[first])
+
+
+def simulate(history, mode, poleMin, poleMax, MaxConsoCurrent, period=60, periods=None,
+             voltage=policies.VOLTAGE):
+    """
+    Run one law with one set of settings over the whole history
+    :param periods: Periods(history, period), computed once for a sweep
+    :return: dict with the energies in kWh (three phases, balanced), the currents in A :
+        'charged' given to the car, 'imported' from the grid, 'exported' to it, 'peak' highest current of the
+        house with the charge, 'peak_import' highest current taken from the grid, 'charging' share of the time
+        with the car charging
+    """
+    if periods is None:
+        periods = Periods(history, period)
+    if not len(history):
+        return dict.fromkeys(('charged', 'imported', 'exported', 'peak', 'peak_import', 'charging'), 0.0)
+    iBatt, iPV, iConso = periods.means
+    orders = policies.order(mode, iBatt, iPV, iConso, 0.0, MaxConsoCurrent)
+    with numpy.errstate(invalid='ignore'):
+        # a period is controlled by the measures of the previous one, nothing before the first command
+        commands = numpy.where(orders >= poleMin, numpy.minimum(orders, poleMax), 0.0)
+    charges = numpy.concatenate(([0.0], commands[:-1]))
+    imported = periods.imported(charges).sum()
+    grid = periods.base.sum() + numpy.dot(charges, periods.durations)
+    to_kwh = voltage * PHASES / 3.6e6
+    return {
+        'charged': float(numpy.dot(charges, periods.durations)) * to_kwh,
+        'imported': float(imported) * to_kwh,
+        'exported': float(imported - grid) * to_kwh,
+        'peak': float((periods.peak_house + charges).max()),
+        'peak_import': float((periods.peak_grid + charges).max()),
+        'charging': float(periods.durations[charges > 0].sum() / periods.total),
+    }
+
+
+def sweep(history, modes=tuple(policies.POLICIES), poleMin=(6,), poleMax=(16,), MaxConsoCurrent=(32,), period=60):
+    """
+    Every combination of the laws and settings
+    :return: list of dict, the settings and the result of simulate()
+    """
+    periods = Periods(history, period)
+    rows = []
+    for mode, low, high, house in itertools.product(modes, poleMin, poleMax, MaxConsoCurrent):
+        if low > high:
+            continue  # rejected by the settings too
+        row = {'mode': mode, 'poleMin': low, 'poleMax': high, 'MaxConsoCurrent': house}
+        row.update(simulate(history, mode, low, high, house, period, periods))
+        rows.append(row)
+    return rows
+
+
+# Columns of the table : name, width, format
+COLUMNS = (('mode', 16, ''), ('poleMin', 7, ''), ('poleMax', 7, ''), ('MaxConsoCurrent', 15, ''),
+           ('charged', 9, '.2f'), ('imported', 9, '.2f'), ('exported', 9, '.2f'), ('peak', 7, '.1f'),
+           ('peak_import', 11, '.1f'), ('charging', 8, '.1%'))
+
+
+def table(rows):
+    lines = [' '.join('{:>{}}'.format(name, width) for name, width, fmt in COLUMNS)]
+    for row in rows:
+        lines.append(' '.join('{:>{}{}}'.format(row[name], width, fmt) for name, width, fmt in COLUMNS))
+    return '\n'.join(lines)
+
+
+def number(text):
+    return float(text) if '.' in text else int(text)
+
+
+def values(arguments, name, convert, default):
+    """Comma separated values of an option, removed from the arguments"""
+    if name not in arguments:
+        return default
+    i = arguments.index(name)
+    answer = [convert(item) for item in arguments[i + 1].split(',')]
+    del arguments[i:i + 2]
+    return answer
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    store_path = values(arguments, "--store", str, None)
+    poleMin = values(arguments, "--poleMin", number, [6])
+    poleMax = values(arguments, "--poleMax", number, [16])
+    MaxConsoCurrent = values(arguments, "--MaxConsoCurrent", number, [32])
+    period = values(arguments, "--period", int, [60])[0]
+    modes = values(arguments, "--modes", str, list(policies.POLICIES))
+    phase = values(arguments, "--phase", int, [1])[0] - 1
+    history = load_store(store_path[0], phase=phase) if store_path else load_values(arguments)
+    if not len(history):
+        print("No measure : give values files, or --store with the store directory of the controller")
+        sys.exit(1)
+    print("{} measures, {:.1f} h".format(len(history), history.durations.sum() / 3600))
+    print(table(sweep(history, modes, poleMin, poleMax, MaxConsoCurrent, period)))
@@ -0,0 +1,243 @@
+# Microbenchmarks of the measurement and protocol hot paths, compared to stored baselines
+# Usage : python -m Libraries.benchmark [--save] [--threshold 0.2] [--only name,name]
+#   --save : run and store the results as the baselines of this host (do it on the target, a Raspberry Pi).
+#            They only mean something on the host that measured them : the file is not versioned
+#   without --save : run, compare with the baselines and exit with 1 if one is slower than its baseline by more
+#            than the threshold plus the noise seen on both runs. A benchmark found slower is measured again before
+#            it is reported, and the baselines of another host are only shown, never a failure
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import tempfile
+import contextlib
+import numpy
+from Libraries import SmartPi
+from Libraries import evbox
+from Libraries import maxprotocol
+from Libraries import logwriter
+from Libraries import harness
+from Libraries import windowstats
+from Libraries import backtest
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+THRESHOLD = 0.2  # 20 % slower than the baseline, beyond the noise, is a regression
+REPEAT = 11  # measures of each benchmark, its time is the best one and its noise the gap to the median one
+RETRIES = 2  # new runs of a benchmark found slower, before it is reported as a regression
+EPOCH = 1500000000  # first timestamp of the generated measures
+LINE = "2019-03-29 10:20:05;1.5;2.25;3.75;0.5;230.1;229.8;231.2;345.1;517.6;862.3;0.98;0.97;0.99;50.0;50.0;50.0;0;\n"
+# Answer of a modem with 2 ChargeBoxes
+ANSWER = b"\x02A080690001015E02007800000000000003E803E803E800000028007800000000000003E803E803E80000001EC47A\x03"
+
+
+def host():
+    """What the baselines depend on"""
+    return {'node': socket.gethostname(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'python': platform.python_version(), 'numpy': numpy.__version__}
+
+
+def timeit(function, repeat=REPEAT, duration=0.1):
+    """
+    Time a function without argument
+    :param duration: Minimum time in second of one measure, the number of calls is calibrated to reach it
+    :return: dict 'best' : best time of one call in microsecond over 'repeat' measures,
+        'noise' : relative gap between the median measure and the best one
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for i in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration / 10:
+            break
+        number *= 10
+    number = max(1, int(number * duration / max(elapsed, 1e-9)))
+    times = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        for i in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    best, median = min(times), float(numpy.median(times))
+    return {'best': best * 1e6, 'noise': median / best - 1}
+
+
+def bench_process():
+    measure = SmartPi.SmartPi(5, 720)
+    clock = [EPOCH]
+
+    def process():
+        # a new timestamp each call, else the line is dropped as a duplicate
+        clock[0] += 1
+        measure.process(time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(clock[0])) + LINE[19:])
+    return process
+
+
+def bench_getmean(size):
+    measure = SmartPi.SmartPi(5, size)
+    for i in range(size):
+        measure.buffer.append(EPOCH + i, [float(i % 50)] * (len(measure.items) - 1))
+    return lambda: measure.getmean(size)
+
+
+def bench_windowstats():
+    # one sample added to the 30 s, 2 min and 10 min windows, filled like in production (a sample every 5 s)
+    stats = windowstats.WindowStats(SmartPi.valuesparser.ITEMS[1:])
+    values = [float(value) for value in LINE.split(";")[1:-1]]
+    clock = [EPOCH]
+
+    def add():
+        clock[0] += 5
+        stats.add(clock[0], values)
+    for i in range(200):
+        add()
+    return add
+
+
+def bench_chksum():
+    station = evbox.EVBox()
+    payload = ANSWER[1:-5].decode()
+    return lambda: station.chksum(payload)
+
+
+def bench_encode():
+    words = (160, 160, 160, 60, 80, 80, 80)
+    return lambda: maxprotocol.encode(maxprotocol.encode_words(words))
+
+
+def bench_decode():
+    return lambda: maxprotocol.decode(ANSWER)
+
+
+def bench_backtest():
+    # one law and one set of settings over a day of measures every second, the periods being computed once
+    timestamps = numpy.arange(EPOCH, EPOCH + 86400)
+    phase = (timestamps % 86400) / 86400.0
+    history = backtest.History(timestamps, numpy.cos(phase * 40), numpy.maximum(numpy.sin(phase * 6.3) * 25, 0),
+                               5 + 4 * numpy.cos(phase * 300) ** 2)
+    periods = backtest.Periods(history, 60)
+    return lambda: backtest.simulate(history, "PV_Low-priority", 6, 16, 32, 60, periods)
+
+
+def bench_sinab(workdir):
+    # Whole decision of a cycle : measures, control law, frame, answer handling, logs and store ; no serial I/O
+    main = harness.load_main(workdir, "benchmark")
+    main.writer.silent = True
+    response = maxprotocol.decode(ANSWER)
+    response.min_interval = 0  # else the modem is not called again during the benchmark
+    main.sendto_evbox = lambda payload, address=maxprotocol.MODEM: response
+    return main, main.SinaB
+
+
+def benchmarks():
+    """list of (name, function returning the function to time)"""
+    answer = [("SmartPi.process", bench_process)]
+    answer += [("SmartPi.getmean[{}]".format(size), lambda size=size: bench_getmean(size))
+               for size in (12, 720, 86400)]
+    answer += [("WindowStats.add", bench_windowstats), ("EVBox.chksum", bench_chksum),
+               ("maxprotocol.encode", bench_encode), ("maxprotocol.decode", bench_decode),
+               ("backtest.simulate", bench_backtest)]
+    return answer
+
+
+def run(only=None):
+    """
+    Run the benchmarks in a temporary directory (the logs and the store written during the run go there)
+    :param only: Names of the benchmarks to run, all of them if None
+    :return: dict name -> result of timeit()
+    """
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="td2c-benchmark-")
+    current = os.getcwd()
+    os.chdir(workdir)
+    debug, shared = SmartPi.debug, SmartPi.writer
+    SmartPi.debug = False
+    SmartPi.writer = writer = logwriter.LogWriter(silent=True)
+    writer.start()
+    main = None
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for name, bench in benchmarks():
+                if only is None or name in only:
+                    results[name] = timeit(bench())
+                    writer.flush()  # the writer thread must not compete with the next benchmark
+            if only is None or "main.SinaB" in only:
+                main, sinab = bench_sinab(workdir)
+                results["main.SinaB"] = timeit(sinab)
+    finally:
+        if main is not None:
+            main.store.flush()
+            main.writer.close()
+        writer.close()
+        SmartPi.debug, SmartPi.writer = debug, shared
+        os.chdir(current)
+    return results
+
+
+def compare(results, baselines, threshold=THRESHOLD):
+    """
+    :param results: dict name -> result of timeit()
+    :param baselines: same for the stored run
+    :return: list of (name, microsecond, baseline, ratio, regression) for the benchmarks having a baseline.
+        A regression is a ratio of the best times above 1 + threshold + the noise of both runs
+    """
+    rows = []
+    for name, value in results.items():
+        if name in baselines:
+            baseline = baselines[name]
+            ratio = value['best'] / baseline['best']
+            rows.append((name, value['best'], baseline['best'], ratio,
+                         ratio > 1 + threshold + value['noise'] + baseline['noise']))
+    return rows
+
+
+def load(path=BASELINE):
+    """:return: (host of the baselines, dict name -> result of timeit()), (None, {}) without baselines"""
+    try:
+        with open(path) as f:
+            content = json.load(f)
+        return content['host'], content['results']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None, {}
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    threshold = float(arguments[arguments.index("--threshold") + 1]) if "--threshold" in arguments else THRESHOLD
+    only = arguments[arguments.index("--only") + 1].split(",") if "--only" in arguments else None
+    results = run(only)
+    if "--save" in arguments:
+        with open(BASELINE, "w") as f:
+            json.dump({'host': host(), 'results': dict((name, {'best': round(value['best'], 3),
+                                                                'noise': round(value['noise'], 3)})
+                                                        for name, value in results.items())},
+                      f, indent=2, sort_keys=True)
+            f.write("\n")
+        for name, value in results.items():
+            print("{:>24} : {:10.3f} us   noise {:5.1f} %".format(name, value['best'], value['noise'] * 100))
+        sys.exit(0)
+    measured_on, baselines = load()
+    same_host = measured_on == host()
+    if baselines and not same_host:
+        print("Baselines measured on another host ({}), shown for information only".format(measured_on))
+    for name, value in results.items():
+        if name not in baselines:
+            print("{:>24} : {:10.3f} us   (no baseline)".format(name, value['best']))
+    regressions = 0
+    for row in compare(results, baselines, threshold):
+        for retry in range(RETRIES):
+            if not row[4] or not same_host:
+                break
+            # slower than the noise allows : a busy moment of the host, or a real regression
+            again = run([row[0]])[row[0]]
+            if again['best'] < results[row[0]]['best']:
+                results[row[0]] = again
+            row = compare({row[0]: results[row[0]]}, baselines, threshold)[0]
+        name, value, baseline, ratio, regression = row
+        regressions += regression and same_host
+        print("{:>24} : {:10.3f} us   baseline {:10.3f} us   {:+6.1f} %{}".format(
+            name, value, baseline, (ratio - 1) * 100, "   REGRESSION" if regression else ""))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,60 @@
+# Last command sent to each EV-Box modem and its last answer : an order that did not move more than the deadband
+# is not sent again, except as a keep-alive just before the timeout of the station runs out (it would fall back to
+# its default current), and the connector state of the last answer is served between the exchanges
+import time
+from Libraries import maxprotocol
+
+
+class CommandCache:
+
+    def __init__(self, deadband=0.0, margin=10.0):
+
+        """
+        :param deadband: A limit moving by this many A or less is not sent again (0 : only an identical order
+            is skipped). Stopping (0 A) or starting a charge is always sent
+        :param margin: The command is repeated this many seconds before the timeout of the station elapses
+        """
+
+        self.deadband = deadband
+        self.margin = margin
+        self.sent = {}  # address -> (limits, timeout, other words, time.monotonic() of the sending)
+        self.responses = {}  # address -> last maxprotocol.StationResponse of the modem
+
+    def reason(self, address, limits, timeout, extra=(), now=None):
+        """
+        Why the command must go on the bus
+        :param limits: [L1, L2, L3] in A
+        :param timeout: Timeout of the command in second (the station falls back to its default current after it)
+        :param extra: The other words of the command (default currents), sent again when they change
+        :return: 'new' (nothing sent, or the last exchange failed), 'changed', 'keepalive', or None to skip it
+        """
+        now = time.monotonic() if now is None else now
+        last = self.sent.get(address)
+        if last is None:
+            return 'new'
+        sent_limits, sent_timeout, sent_extra, sent_at = last
+        if timeout != sent_timeout or tuple(extra) != sent_extra or \
+                any((new == 0) != (old == 0) or abs(new - old) > self.deadband + 1e-9
+                    for new, old in zip(limits, sent_limits)):
+            return 'changed'
+        if now >= sent_at + timeout - self.margin:
+            return 'keepalive'
+        return None
+
+    def done(self, address, limits, timeout, extra, response, sent_at):
+        """Record an exchange : StationResponse, or error string (the next command is sent whatever it is)"""
+        if isinstance(response, maxprotocol.StationResponse):
+            self.sent[address] = (list(limits), timeout, tuple(extra), sent_at)
+            self.responses[address] = response
+        else:
+            self.sent.pop(address, None)
+
+    def keepalives(self):
+        """dict address -> time.monotonic() when its command must be repeated"""
+        return dict((address, sent_at + timeout - self.margin)
+                    for address, (limits, timeout, extra, sent_at) in self.sent.items())
+
+    def forget(self, address):
+        """A modem removed from the bus"""
+        self.sent.pop(address, None)
+        self.responses.pop(address, None)
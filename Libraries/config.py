@@ -0,0 +1,341 @@
+# Settings of the controller : the JSON file is validated once into typed attributes,
+# and read again when it changes, an invalid version being rejected while the last good one stays in use
+import os
+import json
+from Libraries.valuesparser import ITEMS
+from Libraries.modbus import KINDS
+from Libraries.meters import ROLES, COMBINE
+
+REQUIRED = object()  # default of a key that must be in the file
+
+
+def number(low=None, high=None, integer=False, optional=False):
+    """Converter of a number between 'low' and 'high' (included), None accepted if 'optional'"""
+    def convert(value):
+        if value is None and optional:
+            return None
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError("a number is expected, not {!r}".format(value))
+        if integer:
+            if value != int(value):
+                raise ValueError("an integer is expected, not {!r}".format(value))
+            value = int(value)
+        if (low is not None and value < low) or (high is not None and value > high):
+            raise ValueError("{} is out of [{}, {}]".format(value, low, high))
+        return value
+    return convert
+
+
+def choice(*values):
+    def convert(value):
+        if value not in values:
+            raise ValueError("{!r} is not one of {}".format(value, list(values)))
+        return value
+    return convert
+
+
+def text(value):
+    if not isinstance(value, str) or not value:
+        raise ValueError("a non empty string is expected, not {!r}".format(value))
+    return value
+
+
+def boolean(value):
+    if not isinstance(value, bool):
+        raise ValueError("true or false is expected, not {!r}".format(value))
+    return value
+
+
+def address(value):
+    """Modem address written in hex ("80") -> int"""
+    try:
+        result = int(value, 16)
+    except (TypeError, ValueError):
+        raise ValueError("{!r} is not an hexadecimal address".format(value))
+    if not 0 <= result <= 0xFF:
+        raise ValueError("{!r} is not a one byte address".format(value))
+    return result
+
+
+def addresses(value):
+    if not isinstance(value, list) or not value:
+        raise ValueError("a non empty list of hexadecimal addresses is expected")
+    result = [address(item) for item in value]
+    if len(set(result)) != len(result):
+        raise ValueError("an address is given twice")
+    return result
+
+
+def listen(value):
+    """"host:port", path of a Unix socket, or "" for nothing"""
+    if not isinstance(value, str):
+        raise ValueError("a string is expected, not {!r}".format(value))
+    if value and not value.startswith('/'):
+        host, separator, port = value.rpartition(':')
+        if not separator or not port.isdigit() or not 0 < int(port) < 65536:
+            raise ValueError("{!r} is neither host:port nor the path of a Unix socket".format(value))
+    return value
+
+
+def filename(value):
+    """Path of a file, "" for none"""
+    if not isinstance(value, str):
+        raise ValueError("a string is expected, not {!r}".format(value))
+    return value
+
+
+def registers(value):
+    """Modbus map {"I1": [0, "float32", 1.0], ...} -> {"I1": (0, "float32", 1.0)}, None for the default one"""
+    if value is None:
+        return None
+    if not isinstance(value, dict) or not value:
+        raise ValueError("an object channel -> [first register, kind, scale] is expected")
+    result = {}
+    for channel, spec in value.items():
+        if channel not in ITEMS[1:]:
+            raise ValueError("{!r} is not a channel of the values file".format(channel))
+        if not isinstance(spec, list) or len(spec) != 3 or spec[1] not in KINDS:
+            raise ValueError("{} : [first register, one of {}, scale] is expected".format(channel, sorted(KINDS)))
+        result[channel] = (number(0, 65535, integer=True)(spec[0]), spec[1], number()(spec[2]))
+    return result
+
+
+def meters(value):
+    """
+    [{"name": "main", "source": {like the Source section}, "channels": {"I1": "iBatt", "I4": "-iBatt"...}}, ...]
+    -> list of dict with 'name', 'source' (Section) and 'channels', None for the Source section alone
+    """
+    if value is None:
+        return None
+    if not isinstance(value, list) or not value:
+        raise ValueError("a non empty list of meters is expected")
+    result = []
+    for i, meter in enumerate(value):
+        if not isinstance(meter, dict):
+            raise ValueError("meter {} : an object is expected".format(i))
+        name = text(meter.get('name', "meter{}".format(i)))
+        errors = []
+        source = Section("source", meter.get('source', {}), SCHEMA['Source'], errors)
+        if errors:
+            raise ValueError("meter {} : {}".format(name, ", ".join(errors)))
+        channels = meter.get('channels', {})
+        if not isinstance(channels, dict) or not channels:
+            raise ValueError("meter {} : an object channel -> role is expected".format(name))
+        for channel, role in channels.items():
+            if channel not in ITEMS[1:]:
+                raise ValueError("meter {} : {!r} is not a channel of the values file".format(name, channel))
+            if not isinstance(role, str) or role.lstrip('-') not in ROLES:
+                raise ValueError("meter {} : {!r} is not one of {} (- ahead for a reversed clamp)".format(
+                    name, role, list(ROLES)))
+        result.append({'name': name, 'source': source, 'channels': dict(channels)})
+    if len(set(meter['name'] for meter in result)) != len(result):
+        raise ValueError("a meter name is given twice")
+    return result
+
+
+def combine(value):
+    if not isinstance(value, dict):
+        raise ValueError("an object role -> one of {} is expected".format(sorted(COMBINE)))
+    for role, how in value.items():
+        if role not in ROLES or how not in COMBINE:
+            raise ValueError("{!r}: {!r} : a role of {} and one of {} are expected".format(
+                role, how, list(ROLES), sorted(COMBINE)))
+    return dict(value)
+
+
+def spans(value):
+    if not isinstance(value, list) or not value:
+        raise ValueError("a non empty list of durations in second is expected")
+    return sorted(set(number(1, integer=True)(item) for item in value))
+
+
+def priorities(value):
+    """{"80": priority of the modem, "80:1": priority of one of its ChargeBoxes}, keys normalised to upper case"""
+    if not isinstance(value, dict):
+        raise ValueError("an object is expected")
+    result = {}
+    for key, priority in value.items():
+        modem, separator, index = str(key).partition(':')
+        address(modem)
+        if separator and not index.isdigit():
+            raise ValueError("{!r} : the ChargeBox index must be an integer".format(key))
+        result[key.upper()] = number()(priority)
+    return result
+
+
+# Keys of each section : key -> (converter, default)
+SCHEMA = {
+    'SinaB': {
+        'MaxConsoCurrent': (number(0), REQUIRED),  # max current of the house in A
+        'RefreshF': (number(1, 60, integer=True), REQUIRED),  # control cycle in minute
+        'triggerThreshold': (number(0), 0),  # move of the order in A triggering a cycle at once, 0 = off
+        'windows': (spans, [30, 120, 600]),  # windows of the measure statistics in second
+        'smoothing': (number(0, integer=True), 0),  # window of the EWMA used by the law, 0 = mean of the buffer
+    },
+    'EVBox': {
+        'poleMin': (number(0, 6553), REQUIRED),
+        'poleMax': (number(0, 6553), REQUIRED),
+        'timeout': (number(0, 65535, integer=True), REQUIRED),
+        'defaultCurrent': (number(0, 6553), REQUIRED),
+        'addresses': (addresses, ["80"]),
+        'allocation': (choice("fair", "priority"), "fair"),
+        'priorities': (priorities, {}),
+        'deadband': (number(0), 0),  # A, an order moving less is not sent again (before the keep-alive)
+        'keepAliveMargin': (number(0), 10),  # s, an unchanged order is sent again this long before the timeout
+        'measuredPhase': (choice(1, 2, 3), 1),  # phase of the stations the consumption clamp (SmartPi I3) is on
+    },
+    'Serial': {
+        'port': (text, REQUIRED),
+        'baudrate': (number(1, integer=True), REQUIRED),
+        'bytesize': (choice(5, 6, 7, 8), 8),
+        'parity': (choice("N", "E", "O", "M", "S"), "N"),
+        'stopbits': (choice(1, 1.5, 2), 1),
+        'timeout': (number(0, optional=True), None),
+        'writeTimeout': (number(0, optional=True), None),
+        'interByteTimeout': (number(0), 0.1),
+        'answerDeadline': (number(0), 10),
+    },
+    'Log': {
+        'flushInterval': (number(0), 10),
+        'flushSize': (number(0, integer=True), 64 * 1024),
+        'maxSize': (number(0, integer=True), 5 * 1024 * 1024),
+        'daily': (boolean, True),
+        'backups': (number(0, integer=True), 14),
+        'silent': (boolean, False),
+    },
+    'Store': {
+        'path': (text, "store"),
+    },
+    'Source': {
+        'type': (choice("file", "stream", "modbus"), "file"),  # where the measures come from, read at startup
+        'path': (text, "/var/tmp/smartpi/values"),  # values file of the SmartPi daemon
+        'url': (text, "udp://127.0.0.1:9878"),  # stream : tcp://host:port, udp://host:port or unix:///path
+        'host': (text, "127.0.0.1"),  # modbus
+        'port': (number(1, 65535, integer=True), 502),
+        'unit': (number(0, 255, integer=True), 1),
+        'interval': (number(1), 1),  # s between two Modbus readings, the measures are stored once per second at most
+        'registers': (registers, None),  # channel -> [first register, kind, scale], None for the default map
+    },
+    'Meters': {
+        'meters': (meters, None),  # meters of the site, read at startup, None : the Source section wired as I1-I3
+        'combine': (combine, {}),  # role -> sum, mean or max of its channels, sum by default
+        'maxSkew': (number(0), 30),  # s, a meter later than this does not hold the site view back
+    },
+    'Snapshot': {
+        'path': (filename, "snapshot.bin"),  # warm restart file, "" for none
+        'interval': (number(1), 60),  # shortest time in second between two snapshots
+        'maxAge': (number(0), 300),  # an older snapshot is not used at startup
+    },
+    'Metrics': {
+        'listen': (listen, "127.0.0.1:9877"),  # Prometheus endpoint, read at startup only
+    },
+}
+
+
+class Section:
+
+    """Validated section of the settings, one attribute per key of the schema"""
+
+    def __init__(self, name, values, schema, errors):
+        self._keys = list(schema)
+        if not isinstance(values, dict):
+            errors.append("{} : an object is expected".format(name))
+            values = {}
+        for key, (convert, default) in schema.items():
+            value = None
+            if key not in values:
+                if default is REQUIRED:
+                    errors.append("{}.{} : missing".format(name, key))
+                else:
+                    value = convert(default)
+            else:
+                try:
+                    value = convert(values[key])
+                except ValueError as e:
+                    errors.append("{}.{} : {}".format(name, key, e))
+            setattr(self, key, value)
+
+    def asdict(self):
+        return dict((key, getattr(self, key)) for key in self._keys)
+
+    def __eq__(self, other):
+        return isinstance(other, Section) and self.asdict() == other.asdict()
+
+    def __repr__(self):
+        return repr(self.asdict())
+
+
+class Config:
+
+    """Whole settings, one Section attribute per section of the schema (config.EVBox.poleMin...)"""
+
+    def __init__(self, values, schema=SCHEMA):
+        """
+        :param values: dict read from the JSON file, unknown sections and keys are ignored
+        :raise ValueError: with every problem found, one per line
+        """
+        errors = []
+        if not isinstance(values, dict):
+            raise ValueError("the settings must be a JSON object")
+        for name, keys in schema.items():
+            setattr(self, name, Section(name, values.get(name, {}), keys, errors))
+        if not errors and self.EVBox.poleMin > self.EVBox.poleMax:
+            errors.append("EVBox.poleMin : {} is above poleMax {}".format(self.EVBox.poleMin, self.EVBox.poleMax))
+        if not errors and self.SinaB.smoothing and self.SinaB.smoothing not in self.SinaB.windows:
+            errors.append("SinaB.smoothing : {} is not one of the windows {}".format(self.SinaB.smoothing,
+                                                                                    self.SinaB.windows))
+        if errors:
+            raise ValueError("\n".join(errors))
+
+
+def load(path):
+    """
+    :return: Config of the file
+    :raise OSError: the file cannot be read
+    :raise ValueError: not JSON, or invalid settings
+    """
+    with open(path) as f:
+        return Config(json.load(f))  # json.JSONDecodeError is a ValueError
+
+
+class ConfigFile:
+
+    """Settings file in use : 'current' is replaced by a new Config, in one assignment, only when the file
+    changed and its new content is valid. Read 'current' once per cycle to use one version all along"""
+
+    def __init__(self, path, rejected=None):
+
+        """
+        :param path: JSON file, it must be valid at startup (the exception goes up)
+        :param rejected: Function called with the reason when a changed file is invalid
+        """
+
+        self.path = path
+        self.rejected = rejected
+        self.signature = self._signature()
+        self.current = load(path)
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def check(self):
+        """
+        Read the file again if it changed since the last check (one stat otherwise)
+        :return: True if a new Config is in use
+        """
+        signature = self._signature()
+        if signature == self.signature or signature is None:
+            return False  # unchanged, or being replaced : the next check will see the new file
+        self.signature = signature  # an invalid version is reported once, not at each check
+        try:
+            config = load(self.path)
+        except (OSError, ValueError) as e:
+            if self.rejected is not None:
+                self.rejected(str(e))
+            return False
+        self.current = config
+        return True
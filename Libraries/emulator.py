@@ -0,0 +1,137 @@
+import os
+import tty
+import time
+import random
+import select
+import threading
+from Libraries import maxprotocol
+
+
+class EVBoxEmulator(threading.Thread):
+
+    """EV-Box modem(s) speaking the 0x69 command of the Max protocol on a pseudo-terminal,
+    for tests and benchmarks without a charging station"""
+
+    def __init__(self, connectors=1, addresses=(maxprotocol.MODEM,), latency=0.0, min_interval=1, max_current=32,
+                 min_current=6, car_current=16, checksum_rate=0.0, timeout_rate=0.0):
+
+        """
+        :param connectors: Number of ChargeBoxes behind each modem address (1 to 20)
+        :param addresses: Modem addresses answering on the bus
+        :param latency: Delay in second before answering a command
+        :param min_interval: Minimum admissible interval between two commands announced in the answers
+        :param max_current: Max current per phase of the station in A
+        :param min_current: Minimum current of a ChargeBox in A
+        :param car_current: Current in A a connected car draws when allowed to
+        :param checksum_rate: Probability of answering with a wrong checksum
+        :param timeout_rate: Probability of not answering at all
+        """
+
+        threading.Thread.__init__(self, name="EVBoxEmulator")
+        self.daemon = True
+        self.connectors = connectors
+        self.addresses = addresses
+        self.latency = latency
+        self.min_interval = min_interval
+        self.max_current = max_current
+        self.min_current = min_current
+        self.car_current = car_current
+        self.checksum_rate = checksum_rate
+        self.timeout_rate = timeout_rate
+        self.faults = []  # one-shot faults applied to the next answers : 'checksum', 'timeout' or 'partial'
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        self.port = os.ttyname(self.slave)  # give this to serial.Serial / the 'Serial' settings
+        self.enabled = True
+        # Simulated state : per address, per connector [L1, L2, L3, Wh]
+        self.state = {address: [[0.0, 0.0, 0.0, 0.0] for i in range(connectors)] for address in addresses}
+        self.last_update = time.monotonic()
+        self.commands = []  # (address, words) of every valid command received
+        self.received = 0  # frames received
+        self.answered = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def inject(self, fault, count=1):
+        """Apply a fault ('checksum', 'timeout' or 'partial') to the next 'count' answers"""
+        self.faults.extend([fault] * count)
+
+    def stop(self):
+        self.enabled = False
+
+    def close(self):
+        self.stop()
+        if self.is_alive():
+            self.join(1)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self):
+        data = b''
+        while self.enabled:
+            if not select.select([self.master], [], [], 0.1)[0]:
+                continue
+            chunk = os.read(self.master, 4096)
+            self.bytes_in += len(chunk)
+            data += chunk
+            while maxprotocol.STOP in data:
+                frame, data = data.split(maxprotocol.STOP, 1)
+                start = frame.rfind(maxprotocol.START)
+                if start >= 0:
+                    self.answer(frame[start + 1:])
+
+    def answer(self, frame):
+        self.received += 1
+        try:
+            recipient, sender, command, words = maxprotocol.decode_command(frame)
+        except ValueError:
+            return  # a real modem ignores a corrupted frame
+        if command != maxprotocol.SETMAXCURRENT or len(words) != 7:
+            return
+        targets = self.addresses if recipient == maxprotocol.BROADCAST else \
+            [recipient] if recipient in self.addresses else []
+        self._simulate()
+        for address in targets:
+            self.commands.append((address, words))
+            self._apply(address, words)
+        if recipient == maxprotocol.BROADCAST or not targets:
+            return  # nobody answers a broadcast
+        fault = self.faults.pop(0) if self.faults else None
+        if fault is None and random.random() < self.timeout_rate:
+            fault = 'timeout'
+        if fault is None and random.random() < self.checksum_rate:
+            fault = 'checksum'
+        if fault == 'timeout':
+            return
+        # the modem answers the one that sent the command
+        response = maxprotocol.StationResponse(
+            sender=recipient, recipient=sender, command=command, min_interval=self.min_interval,
+            max_current=self.max_current, boxes=[
+                maxprotocol.ChargeBox((self.min_current * 10, l1 * 10, l2 * 10, l3 * 10, 1000, 1000, 1000, wh))
+                for l1, l2, l3, wh in self.state[recipient]])
+        reply = maxprotocol.encode_response(response)
+        if fault == 'checksum':
+            reply = reply[:-5] + (b'0' if reply[-5:-4] != b'0' else b'1') + reply[-4:]
+        elif fault == 'partial':
+            reply = reply[:len(reply) // 2]
+        if self.latency:
+            time.sleep(self.latency)
+        os.write(self.master, reply)
+        self.answered += 1
+        self.bytes_out += len(reply)
+
+    def _simulate(self):
+        # Energy counted since the last command at the current consumption
+        now = time.monotonic()
+        hours = (now - self.last_update) / 3600
+        self.last_update = now
+        for boxes in self.state.values():
+            for box in boxes:
+                box[3] += 230 * (box[0] + box[1] + box[2]) * hours
+
+    def _apply(self, address, words):
+        # The station shares the limit of each phase between its connectors, a car charges only above the minimum
+        for box in self.state[address]:
+            for phase in range(3):
+                share = words[phase] / 10 / self.connectors
+                box[phase] = int(min(share, self.car_current)) if share >= self.min_current else 0
@@ -42,8 +42,11 @@ import os
 import sys
 import serial
 import time
-import operator
-from functools import reduce
+from Libraries import maxprotocol
+from Libraries import metrics
+
+ROUNDTRIP = metrics.histogram('td2c_serial_roundtrip_seconds', 'From the command written to the end of the answer frame')
+BYTES = metrics.counter('td2c_serial_bytes_total', 'Bytes written and read on the RS485 bus', ['direction'])
 
 
 # Main command : send phases' max power to the EV-Box charging point
@@ -81,9 +84,11 @@ from functools import reduce
 
 class EVBox:
 
-    def __init__(self):
+    def __init__(self, interbyte_timeout=0.1, deadline=10):
         """Communication method for EV-Box charging points.
-        Connexion type RS485 with a master that could have up to 20 connectors"""
+        Connexion type RS485 with a master that could have up to 20 connectors
+        :param interbyte_timeout: Longest silence in second accepted inside an answer frame
+        :param deadline: Longest wait in second for the complete answer after a command"""
 
         # bytes to begin and finish a command to the charging point
         self.start = 0x02
@@ -96,20 +101,20 @@ class EVBox:
         self.cmd = "69" # The only existing command for EV-Box charging points
         self.adr = self.modem_adr + self.manager_adr
         self.rien = 0
+        self.interbyte_timeout = interbyte_timeout
+        self.deadline = deadline
 
     # Checksum calculation
     # --------------------
     def chksum(self, payload):
-        # data = adr + cmd + payload
-        crcl = '{:X}'.format(sum(bytearray(payload, 'ascii')) % 256).zfill(2)
-        # if python 3 : crch = '{:X}'.format(reduce(operator.xor, bytes(payload, 'ascii'), 0)).zfill(2)
-        crch = '{:X}'.format(reduce(operator.xor, bytearray(payload, 'ascii'), 0)).zfill(2)
-        return crcl + crch
+        # data = adr + cmd + payload, as a string : the bytes level version is maxprotocol.checksum
+        return maxprotocol.checksum(payload.encode('ascii')).decode('ascii')
 
     # Main command : send phases' max power to the EV-Box charging point
     # ------------------------------------------------------------------
-    def setmaxcurrent(self, data, RS485):
-        # RS485 : serial instance that enable RS484 communication with th pole
+    def setmaxcurrent(self, data, RS485, recipient=None):
+        # RS485 : rs485.SerialSession that keeps the RS485 communication with the pole open between the commands
+        # recipient : address of the modem (int), the master modem self.modem_adr by default
         # data : part that contain the data in the TRAME structure
         # TRAME structure : START | ADDRESSES | COMMAND | DATA | CHECKSUM | STOP
         # Beginning structure
@@ -142,57 +147,94 @@ class EVBox:
         #       Cosinus phi L1 1 mot
         #       Valeur totale compteur kWh en Wh 2 mot
 
+        # data : ASCII hex as a string or bytes, see maxprotocol.encode_words
+        # Returns a maxprotocol.StationResponse, or a string beginning with a negative code in case of error
+
         # check data validity
+        if isinstance(data, str):
+            data = data.encode('ascii')
         if len(data) != 28:
             return "-1 The payload is not valid"
-        print("data is valid : " + data)
-        # Building the payload
-        payload = self.modem_adr + self.manager_adr + self.cmd + data
-
-        # calculate checksum
-        checksum = self.chksum(payload)
-        trame = bytearray(chr(self.start) + payload + checksum + chr(self.stop), 'ascii')
-        print("trame = " + trame)  # payload + " " + checksum)
+        # Building the frame with its checksum
+        if recipient is None:
+            recipient = int(self.modem_adr, 16)
+        trame = maxprotocol.encode(data, recipient, int(self.manager_adr, 16), int(self.cmd, 16))
+        print("trame = " + repr(trame))
         print("Sending over RS485")
+        try:
+            with RS485 as port:
+                if port is None:
+                    return "-5 Serial port unavailable"
+                return self.exchange(trame, port)
+        except (serial.SerialException, OSError) as e:
+            # The session closed the port, it is reopened with a backoff at the next command
+            return "-5 Serial port error : " + str(e)
+
+    def exchange(self, trame, RS485):
+        # An answer arrived after a previous timeout would be taken for the answer of this command
+        RS485.reset_input_buffer()
         # Send command to the charging station
         try:
+            start = time.perf_counter()
             sent = RS485.write(trame)
+            BYTES.labels('out').inc(sent or 0)
             print("sent data len = " + str(sent))
         except serial.SerialTimeoutException as e:
             # sending timeout raised
-            print("timeout raised: ", e.message)
+            print("timeout raised: ", e)
             return "-2 Sending timeout raised"
-        else:
-            # Data properly sent, wait 100ms for an answer
-            wait = 0.1
-            timeout = 10
-            timeExpired = 0
-            while True:
-                wait += 0.1
-                time.sleep(0.1)
-                if RS485.inWaiting() > 0:  # old version of PySerial : in_waiting > 0:  # answer received
-                    break
-                elif wait > timeout:  # no answer after timeout
-                    timeExpired = 1
-                    break
 
-        if timeExpired == 0:
-            # Read the answer
-            answer_length = RS485.inWaiting() # in_waiting
-            answer = RS485.read(answer_length)
-            # Remove non-printable characters
-            answer = ''.join([ch for ch in answer if ord(ch) > 31 and ord(ch) < 127])
-            print("EVBox.answer : " + answer + " type : " + str(type(answer)) + " length : " + str(len(answer)))
+        # Data properly sent, wait for the complete answer frame
+        answer = self.readframe(RS485)
+        if isinstance(answer, str):
+            return answer
+        ROUNDTRIP.observe(time.perf_counter() - start)
+        BYTES.labels('in').inc(len(answer) + 2)
+        print("EVBox.answer : " + repr(answer) + " length : " + str(len(answer)))
 
-            # Verify the checksum
-            received_checksum = answer[- 4:]
-            received_payload = answer[:- 4]
-            print("EVBox.received_checksum : " + received_checksum)
-            print("EVBox.received_payload : " + received_payload)
-            print("EVBox.calculated_cheksum : " + self.chksum(received_payload))
-            if received_checksum == self.chksum(received_payload):
-                return received_payload
-            else:
+        # Verify the checksum and decode the station header and the ChargeBoxes
+        try:
+            response = maxprotocol.decode(answer)
+        except ValueError as e:
+            if str(e) == "error with checksum":
                 return "-3 error with checksum"
-        else:
+            return "-7 Malformed answer : " + str(e)
+        # With several modems on the bus, a late answer of another one must not be taken for this one
+        if trame[1:3] != b'BC' and response.sender != int(trame[1:3], 16):
+            return "-7 Malformed answer : sent by {:02X} instead of {}".format(response.sender, trame[1:3].decode())
+        return response
+
+    # Answer reading : wait for the whole START ... STOP frame
+    # --------------------------------------------------------
+    def readframe(self, RS485):
+        # Return the bytes between START and STOP, or an error string :
+        #     "-4 ..." nothing has been received before the deadline
+        #     "-6 ..." the frame has started but a byte did not come in time (inter-byte timeout or deadline)
+        # Each read blocks in the driver until a byte arrives, there is no polling delay
+        deadline = time.monotonic() + self.deadline
+        frame = None  # None until the START byte has been received
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Before the frame starts, wait up to the deadline; inside it, up to the inter-byte timeout
+            RS485.timeout = remaining if frame is None else min(remaining, self.interbyte_timeout)
+            chunk = RS485.read(max(1, RS485.in_waiting))
+            if not chunk:
+                if frame is not None:
+                    break
+                continue
+            if frame is None:
+                start = chunk.find(self.start)
+                if start < 0:
+                    continue  # line noise before the frame
+                frame = bytearray()
+                chunk = chunk[start + 1:]
+            stop = chunk.find(self.stop)
+            if stop >= 0:
+                frame += chunk[:stop]
+                return bytes(frame)
+            frame += chunk
+        if frame is None:
             return "-4 Serial waiting timeout expired"
+        return "-6 Incomplete answer : " + frame.decode('ascii', 'replace')
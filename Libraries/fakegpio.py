@@ -0,0 +1,70 @@
+# Stand-in for the RPi.GPIO module, to run main.py on a computer without GPIO
+# install() must be called before main.py is imported
+import sys
+import types
+
+BOARD = 10
+BCM = 11
+IN = 1
+OUT = 0
+PUD_UP = 22
+PUD_DOWN = 21
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+levels = {}  # pin -> level read by input(), 1 by default (pull-up)
+callbacks = {}  # pin -> list of functions called by set_input() on a change
+
+
+def setmode(mode):
+    pass
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(channels, direction, pull_up_down=None, initial=None):
+    for channel in (channels if isinstance(channels, (list, tuple)) else [channels]):
+        levels.setdefault(channel, 0 if pull_up_down == PUD_DOWN else 1)
+
+
+def input(channel):
+    return levels.get(channel, 1)
+
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    callbacks.setdefault(channel, [])
+    if callback is not None:
+        callbacks[channel].append(callback)
+
+
+def add_event_callback(channel, callback):
+    callbacks.setdefault(channel, []).append(callback)
+
+
+def remove_event_detect(channel):
+    callbacks.pop(channel, None)
+
+
+def cleanup(channels=None):
+    levels.clear()
+    callbacks.clear()
+
+
+def set_input(channel, level):
+    """Test helper : change the level of a pin, like a switch would, and run its event callbacks"""
+    changed = levels.get(channel, 1) != level
+    levels[channel] = level
+    if changed:
+        for callback in callbacks.get(channel, []):
+            callback(channel)
+
+
+def install():
+    """Register this module as RPi.GPIO"""
+    package = sys.modules.get('RPi') or types.ModuleType('RPi')
+    package.GPIO = sys.modules[__name__]
+    sys.modules['RPi'] = package
+    sys.modules['RPi.GPIO'] = sys.modules[__name__]
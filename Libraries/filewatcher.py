@@ -0,0 +1,178 @@
+import os
+import select
+import threading
+import asyncio
+import struct
+import ctypes
+import ctypes.util
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+def _load_inotify():
+    # inotify is only reachable through the libc, there is no module for it in the standard library
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        return libc if hasattr(libc, 'inotify_init1') else None
+    except OSError:
+        return None
+
+
+class FileWatcher:
+
+    """Call a function each time a file is rewritten, with inotify or by polling its mtime/size"""
+
+    def __init__(self, path, callback, poll_interval=0.5):
+
+        """
+        :param path: File to watch, it does not need to exist yet
+        :param callback: Function called without argument when the file changed
+        :param poll_interval: Period in second of the mtime/size check when inotify is not available
+        """
+
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.name = os.fsencode(os.path.basename(path))
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.enabled = True
+        self.mode = None
+        self._signature = None
+        # self-pipe used to wake up select() when the watcher is stopped
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._lock = threading.Lock()  # stop() and close() are called from different threads
+
+    def run(self):
+        """Blocking loop, return after stop() is called"""
+        fd = self._open_inotify()
+        try:
+            if fd is None:
+                self.mode = "poll"
+                self._poll_loop()
+            else:
+                self.mode = "inotify"
+                self._inotify_loop(fd)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    async def watch(self):
+        """Same as run() inside an asyncio loop : the inotify descriptor and the wake-up pipe are readers of the loop,
+        ends when stop() is called or when cancelled"""
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def woken():
+            # stop(), from any thread
+            os.read(self._wakeup_r, 4096)
+            changed.set()
+
+        loop.add_reader(self._wakeup_r, woken)
+        fd = self._open_inotify()
+        try:
+            if fd is None:
+                self.mode = "poll"
+                while self.enabled:
+                    self._changed()
+                    try:
+                        await asyncio.wait_for(changed.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                return
+            self.mode = "inotify"
+
+            def readable():
+                try:
+                    if self._concerned(os.read(fd, 4096)):
+                        changed.set()
+                except BlockingIOError:
+                    pass
+
+            loop.add_reader(fd, readable)
+            self._changed()  # content already present before the watch started
+            while self.enabled:
+                await changed.wait()
+                changed.clear()
+                if self.enabled:
+                    self._changed()
+        finally:
+            loop.remove_reader(self._wakeup_r)
+            if fd is not None:
+                loop.remove_reader(fd)
+                os.close(fd)
+
+    def stop(self):
+        """End run() or watch(), nothing to do once the watcher is closed"""
+        self.enabled = False
+        with self._lock:
+            if self._wakeup_w is not None:
+                os.write(self._wakeup_w, b'x')
+
+    def close(self):
+        """Release the wake-up pipe once the watcher is stopped and run() returned"""
+        with self._lock:
+            if self._wakeup_w is not None:
+                os.close(self._wakeup_r)
+                os.close(self._wakeup_w)
+                self._wakeup_r = self._wakeup_w = None
+
+    def _open_inotify(self):
+        libc = _load_inotify()
+        if libc is None or not os.path.isdir(self.directory):
+            return None
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        # The directory is watched rather than the file so that a file replaced by a rename is still seen
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(self.directory), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _inotify_loop(self, fd):
+        self._changed()  # content already present before the watch started
+        while self.enabled:
+            ready = select.select([fd, self._wakeup_r], [], [])[0]
+            if self._wakeup_r in ready:
+                break
+            try:
+                events = os.read(fd, 4096)
+            except BlockingIOError:
+                continue
+            if self._concerned(events):
+                self._changed()
+
+    def _concerned(self, events):
+        # True if one of the events in the raw buffer is about the watched file
+        pos = 0
+        while pos < len(events):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(events, pos)
+            pos += EVENT_HEADER.size
+            if events[pos:pos + length].rstrip(b'\0') == self.name:
+                return True
+            pos += length
+        return False
+
+    def _poll_loop(self):
+        while self.enabled:
+            self._changed()
+            if select.select([self._wakeup_r], [], [], self.poll_interval)[0]:
+                break
+
+    def _changed(self):
+        # Only call back when the file really differs from the last time it has been seen
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature != self._signature:
+            self._signature = signature
+            self.callback()
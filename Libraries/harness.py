@@ -0,0 +1,131 @@
+# End to end run of the SinaB control cycle against the EV-Box emulator, with a fake GPIO and a fake SmartPi
+# values file, to measure the control-cycle latency and the serial throughput without hardware
+# Usage : python -m Libraries.harness [cycles] [connectors] [latency in s] [mode] [modems]
+import os
+import sys
+import json
+import time
+import tempfile
+import importlib
+import contextlib
+from Libraries import fakegpio
+from Libraries import emulator
+from Libraries import SmartPi
+from Libraries import meters
+from Libraries import sources
+
+# Position of the switches (pins 21, 19) for each mode
+MODES = {"PV_High-priority": (0, 1), "PV_Low-priority": (1, 1), "Peak-shaving": (1, 0)}
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # where main.py is
+VALUES = "{};{};{};{};0;230;230;230;0;0;0;1;1;1;50;50;50;0;\n"
+
+
+def settings(port, addresses=(0x80,)):
+    return {
+        "SinaB": {"MaxConsoCurrent": 40, "RefreshF": 1},
+        # keepAliveMargin = timeout : every cycle goes on the bus, even with the same order
+        "EVBox": {"poleMin": 6, "poleMax": 32, "timeout": 60, "defaultCurrent": 8, "keepAliveMargin": 60,
+                  "addresses": ["{:02X}".format(address) for address in addresses]},
+        "Serial": {"port": port, "baudrate": 9600, "bytesize": 8, "parity": "N", "stopbits": 1,
+                   "timeout": 1, "writeTimeout": 1, "interByteTimeout": 0.05, "answerDeadline": 1},
+        "Log": {"silent": True},
+        "Store": {"path": "store"},
+    }
+
+
+def load_main(workdir, port, mode="Peak-shaving", addresses=(0x80,)):
+    """
+    Import main.py with a fake GPIO, settings pointing to 'port' and fake SmartPi measures
+    (battery idle, 10 A of PV, 12 A of consumption). The current directory must be 'workdir'
+    :return: the main module, ready for SinaB()
+    """
+    config = os.path.join(workdir, "config.json")
+    with open(config, "w") as f:
+        json.dump(settings(port, addresses), f)
+    os.environ["SMATCHATHOME_CONFIG"] = config
+    fakegpio.install()
+    fakegpio.cleanup()  # the edge callbacks of a previous import
+    fakegpio.levels[21], fakegpio.levels[19] = MODES[mode]
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    main = importlib.reload(sys.modules["main"]) if "main" in sys.modules else importlib.import_module("main")
+    main.debug = False
+    SmartPi.debug = False
+    sources.debug = False
+
+    measure = SmartPi.SmartPi(5, 12)
+    measure.file_to_watch = os.path.join(workdir, "values")
+    with open(measure.file_to_watch, "w") as f:
+        for i in range(12):
+            f.write(VALUES.format(time.strftime("%Y-%m-%d %H:%M:", time.localtime()) + "%02d" % i, 0, 10, 12))
+    measure.readmeasure()
+    main.site = meters.Site([meters.Meter("main", measure)])
+    return main
+
+
+def run(cycles=100, connectors=1, latency=0.0, mode="Peak-shaving", faults=(), workdir=None, quiet=True, modems=1):
+    """
+    Drive main.SinaB() 'cycles' times against emulated modems
+    :param connectors: ChargeBoxes behind each modem
+    :param faults: faults injected in the first answers, see EVBoxEmulator.inject
+    :param modems: Number of modem addresses on the bus, from 0x80
+    :return: dict of the measured figures
+    """
+    workdir = workdir or tempfile.mkdtemp(prefix="td2c-harness-")
+    addresses = tuple(range(0x80, 0x80 + modems))
+    # no minimum interval between two commands : the cycles are run back to back
+    station = emulator.EVBoxEmulator(connectors, addresses, latency=latency, min_interval=0)
+    for fault in faults:
+        station.inject(fault)
+    station.start()
+
+    current = os.getcwd()
+    os.chdir(workdir)  # log files and store of the run stay in the working directory
+    try:
+        main = load_main(workdir, station.port, mode, addresses)
+
+        answers = []
+        handle = main.handle_response
+        main.handle_response = lambda command, responses: (answers.extend(responses.values()),
+                                                           handle(command, responses))
+        durations = []
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+            start = time.perf_counter()
+            for i in range(cycles):
+                begin = time.perf_counter()
+                main.SinaB()
+                durations.append(time.perf_counter() - begin)
+            elapsed = time.perf_counter() - start
+        main.handle_response = handle
+        main.bus.close()
+        main.store.flush()
+        main.writer.close()
+    finally:
+        os.chdir(current)
+        station.close()
+
+    durations.sort()
+    return {
+        "cycles": cycles,
+        "connectors": connectors,
+        "modems": modems,
+        "errors": sum(1 for answer in answers if isinstance(answer, str)),
+        "cycle mean ms": 1000 * sum(durations) / len(durations),
+        "cycle p50 ms": 1000 * durations[len(durations) // 2],
+        "cycle p95 ms": 1000 * durations[int(len(durations) * 0.95)],
+        "cycle max ms": 1000 * durations[-1],
+        "frames/s": station.received / elapsed,
+        "bytes/s": (station.bytes_in + station.bytes_out) / elapsed,
+        "workdir": workdir,
+    }
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    result = run(int(arguments[0]) if len(arguments) > 0 else 100,
+                 int(arguments[1]) if len(arguments) > 1 else 1,
+                 float(arguments[2]) if len(arguments) > 2 else 0.0,
+                 arguments[3] if len(arguments) > 3 else "Peak-shaving",
+                 modems=int(arguments[4]) if len(arguments) > 4 else 1)
+    for key, value in result.items():
+        print("{:>14} : {}".format(key, round(value, 3) if isinstance(value, float) else value))
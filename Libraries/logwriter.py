@@ -0,0 +1,111 @@
+import os
+import gzip
+import glob
+import time
+import queue
+import shutil
+import threading
+from datetime import datetime
+
+
+class LogWriter(threading.Thread):
+
+    """Append lines to log files from a background thread, by batches, with rotation and compression"""
+
+    def __init__(self, flush_interval=10, flush_size=64 * 1024, max_size=5 * 1024 * 1024, daily=True, backups=14,
+                 silent=False):
+
+        """
+        :param flush_interval: Longest time in second a line waits in memory before being written
+        :param flush_size: Number of pending bytes that forces a write before flush_interval
+        :param max_size: A file bigger than this (bytes) is rotated, 0 for no size limit
+        :param daily: Rotate the files at the first write of a new day
+        :param backups: Number of compressed old files kept per log
+        :param silent: Do not print the lines on the console (production mode)
+        """
+
+        threading.Thread.__init__(self, name="LogWriter")
+        self.daemon = True
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_size = max_size
+        self.daily = daily
+        self.backups = backups
+        self.silent = silent
+        self.queue = queue.SimpleQueue()
+        self.pending = {}  # filename -> list of lines waiting to be written
+        self.pending_size = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, filename, line, echo=True):
+        """Queue a line, never blocks on the file system. echo=False never prints it, even when not silent"""
+        self.queue.put((filename, line))
+        if echo and not self.silent:
+            print(line)
+
+    def flush(self, timeout=None):
+        """Ask the thread to write everything now and wait until it is done"""
+        done = threading.Event()
+        self.queue.put((None, done))
+        return done.wait(timeout) if self.is_alive() else False
+
+    def close(self, timeout=10):
+        """Write what is pending and stop the thread"""
+        if self.is_alive():
+            self.queue.put((None, None))
+            self.join(timeout)
+
+    def run(self):
+        while True:
+            wait = self.flush_interval - (time.monotonic() - self.last_flush)
+            try:
+                filename, line = self.queue.get(timeout=max(wait, 0.01)) if self.pending else self.queue.get()
+            except queue.Empty:
+                self._flush()
+                continue
+            if filename is None:
+                self._flush()
+                if line is None:
+                    return
+                line.set()
+                continue
+            if not self.pending:
+                self.last_flush = time.monotonic()  # the waiting time starts with the first pending line
+            self.pending.setdefault(filename, []).append(line + '\n')
+            self.pending_size += len(line) + 1
+            if self.pending_size >= self.flush_size:
+                self._flush()
+
+    def _flush(self):
+        for filename, lines in self.pending.items():
+            try:
+                self._rotate(filename, sum(len(line) for line in lines))
+                with open(filename, 'a') as f:
+                    f.writelines(lines)
+            except OSError as e:
+                print("LogWriter : cannot write {} : {}".format(filename, e))
+        self.pending = {}
+        self.pending_size = 0
+        self.last_flush = time.monotonic()
+
+    def _rotate(self, filename, incoming):
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return
+        too_big = self.max_size and stat.st_size + incoming > self.max_size
+        new_day = self.daily and datetime.fromtimestamp(stat.st_mtime).date() != datetime.now().date()
+        if not (too_big or new_day) or stat.st_size == 0:
+            return
+        stamp = datetime.fromtimestamp(stat.st_mtime).strftime('%Y%m%d-%H%M%S')
+        archive = "{}.{}.gz".format(filename, stamp)
+        n = 0
+        while os.path.exists(archive):  # several rotations in the same second
+            n += 1
+            archive = "{}.{}-{}.gz".format(filename, stamp, n)
+        with open(filename, 'rb') as source, gzip.open(archive, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(filename)
+        # Only the most recent archives are kept
+        for old in sorted(glob.glob(glob.escape(filename) + '.*.gz'), key=os.path.getmtime)[:-self.backups or None]:
+            os.remove(old)
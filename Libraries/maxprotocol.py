@@ -0,0 +1,154 @@
+# Encoder / decoder of the EV-Box "Max" protocol frames, see evbox.py for the frame structure
+# Everything works on bytes : the frame is ASCII hexadecimal between a START and a STOP byte
+import struct
+import binascii
+
+START = b'\x02'
+STOP = b'\x03'
+MODEM = 0x80  # master modem of the charging station
+BROADCAST = 0xBC
+MANAGER = 0xA0  # energy manager (us)
+SETMAXCURRENT = 0x69
+MAX_CHARGEBOXES = 20
+
+HEADER = struct.Struct('>BBBHHB')  # recipient, sender, command, min interval, station max current, nb of boxes
+CHARGEBOX = struct.Struct('>7HI')  # min current, L1, L2, L3, cos L1, cos L2, cos L3, Wh meter
+
+
+def checksum(payload):
+    """
+    Checksum of the protocol : sum modulo 256 then XOR of all the bytes, as 4 ASCII hex characters
+    :param payload: bytes, bytearray or memoryview of the ASCII text between START and the checksum
+    """
+    crcl = sum(payload) & 0xFF
+    # XOR of all the bytes : fold the payload as a big integer in halves until one byte remains
+    crch = int.from_bytes(payload, 'little')
+    size = len(payload)
+    while size > 1:
+        size = (size + 1) // 2
+        crch = (crch >> (size * 8)) ^ (crch & ((1 << (size * 8)) - 1))
+    return b'%02X%02X' % (crcl, crch)
+
+
+def encode_words(words):
+    """Data part of a command : each value (int or float, rounded) as a 4 hex characters word"""
+    return (b'%04X' * len(words)) % tuple(int(round(word)) for word in words)
+
+
+def encode(data, recipient=MODEM, sender=MANAGER, command=SETMAXCURRENT):
+    """
+    Complete frame ready to be written on the bus
+    :param data: ASCII hex data part, see encode_words()
+    """
+    payload = b'%02X%02X%02X' % (recipient, sender, command) + data
+    return START + payload + checksum(payload) + STOP
+
+
+def encode_setmaxcurrent(l1, l2, l3, timeout, default_l1, default_l2, default_l3, recipient=MODEM):
+    """Frame of the 0x69 command, currents in A (sent in dA) and timeout in second"""
+    return encode(encode_words((l1 * 10, l2 * 10, l3 * 10, timeout,
+                                default_l1 * 10, default_l2 * 10, default_l3 * 10)), recipient)
+
+
+class ChargeBox:
+
+    """Values of one ChargeBox module in an answer, currents in A and meter in Wh"""
+
+    __slots__ = ('min_current', 'l1', 'l2', 'l3', 'cos1', 'cos2', 'cos3', 'wh')
+
+    def __init__(self, words):
+        self.min_current = words[0] / 10
+        self.l1 = words[1] / 10
+        self.l2 = words[2] / 10
+        self.l3 = words[3] / 10
+        self.cos1 = words[4] / 1000
+        self.cos2 = words[5] / 1000
+        self.cos3 = words[6] / 1000
+        self.wh = words[7]
+
+    def power(self, voltage=230):
+        """Active power used by the box in W"""
+        return voltage * (self.l1 * self.cos1 + self.l2 * self.cos2 + self.l3 * self.cos3)
+
+    def tolist(self):
+        return [self.min_current, self.l1, self.l2, self.l3, self.cos1, self.cos2, self.cos3, self.wh]
+
+    def __repr__(self):
+        return str(self.tolist())
+
+
+class StationResponse:
+
+    """Decoded answer of a modem : station header and every ChargeBox connected to it"""
+
+    __slots__ = ('recipient', 'sender', 'command', 'min_interval', 'max_current', 'boxes')
+
+    def __init__(self, recipient, sender, command, min_interval, max_current, boxes):
+        self.recipient = recipient
+        self.sender = sender
+        self.command = command
+        self.min_interval = min_interval  # minimum admissible interval between two commands in second
+        self.max_current = max_current  # max current per phase of the station in A
+        self.boxes = boxes
+
+    def power(self, voltage=230):
+        """Active power used by all the ChargeBoxes of the station in W"""
+        return sum(box.power(voltage) for box in self.boxes)
+
+    def __repr__(self):
+        return "{:02X}>{:02X} cmd {:02X} interval={}s max={}A boxes={}".format(
+            self.sender, self.recipient, self.command, self.min_interval, self.max_current, self.boxes)
+
+
+def decode(frame):
+    """
+    Check and decode an answer frame
+    :param frame: bytes between START and STOP (START/STOP included or not)
+    :return: StationResponse
+    :raise ValueError: wrong checksum, not hexadecimal or wrong length
+    """
+    view = memoryview(frame)
+    if view[:1] == START:
+        view = view[1:]
+    if view[-1:] == STOP:
+        view = view[:-1]
+    if len(view) < 4 or checksum(view[:-4]) != view[-4:].tobytes():
+        raise ValueError("error with checksum")
+    raw = binascii.unhexlify(view[:-4])  # binascii.Error is a ValueError
+    if len(raw) < HEADER.size:
+        raise ValueError("answer too short : {} bytes".format(len(raw)))
+    recipient, sender, command, min_interval, max_current, count = HEADER.unpack_from(raw)
+    if count > MAX_CHARGEBOXES or len(raw) != HEADER.size + count * CHARGEBOX.size:
+        raise ValueError("{} ChargeBoxes announced for {} bytes of data".format(count, len(raw)))
+    boxes = [ChargeBox(words) for words in CHARGEBOX.iter_unpack(memoryview(raw)[HEADER.size:])]
+    return StationResponse(recipient, sender, command, min_interval, max_current / 10, boxes)
+
+
+def decode_command(frame):
+    """
+    Check and decode a command frame (modem side, used by the emulator)
+    :return: (recipient, sender, command, tuple of the data words)
+    :raise ValueError: wrong checksum or not hexadecimal
+    """
+    view = memoryview(frame)
+    if view[:1] == START:
+        view = view[1:]
+    if view[-1:] == STOP:
+        view = view[:-1]
+    if len(view) < 10 or checksum(view[:-4]) != view[-4:].tobytes():
+        raise ValueError("error with checksum")
+    raw = binascii.unhexlify(view[:-4])
+    words = struct.unpack_from('>{}H'.format((len(raw) - 3) // 2), raw, 3)
+    return raw[0], raw[1], raw[2], words
+
+
+def encode_response(response):
+    """Answer frame of a StationResponse (modem side, used by the emulator)"""
+    raw = HEADER.pack(response.recipient, response.sender, response.command, response.min_interval,
+                      int(round(response.max_current * 10)), len(response.boxes))
+    for box in response.boxes:
+        raw += CHARGEBOX.pack(int(round(box.min_current * 10)), int(round(box.l1 * 10)), int(round(box.l2 * 10)),
+                              int(round(box.l3 * 10)), int(round(box.cos1 * 1000)), int(round(box.cos2 * 1000)),
+                              int(round(box.cos3 * 1000)), int(box.wh))
+    payload = binascii.hexlify(raw).upper()
+    return START + payload + checksum(payload) + STOP
@@ -0,0 +1,111 @@
+# Several meters of one site in the controller process : each meter is a SmartPi buffer fed by its own source,
+# some of its channels have a role (battery, PV or consumption current), and the site view SinaB uses combines
+# the roles of every meter over the same time window
+import asyncio
+from Libraries import metrics
+from Libraries.SmartPi import todatetime
+
+ROLES = ('iBatt', 'iPV', 'iConso')
+SIGNED = ('iBatt',)  # the direction matters, the other roles are taken as absolute values like their clamps
+# Wiring of the Smatch Box, used when no meter is configured : I1 on the battery phase (positive when it is
+# discharging), I2 on the PV inverter output, I3 on the sub-circuit with only consumption
+CHANNELS = {'I1': 'iBatt', 'I2': 'iPV', 'I3': 'iConso'}
+# How the channels with the same role are combined : feeders add up, the phases of a board can be averaged
+# or the most loaded one taken
+COMBINE = {'sum': sum, 'mean': lambda values: sum(values) / len(values), 'max': max}
+
+LAG = metrics.gauge('td2c_meter_lag_seconds', 'Age of the newest measure of a meter behind the site view',
+                    ['meter'])
+STALE = metrics.counter('td2c_meter_stale_total', 'Site views computed with the last values of a late meter',
+                        ['meter'])
+
+
+class Meter:
+
+    """A SmartPi buffer of the site and the roles of its channels"""
+
+    def __init__(self, name, measure, channels=None):
+
+        """
+        :param measure: SmartPi instance with its source
+        :param channels: dict channel of the values file -> role, "-iBatt" for a clamp in the other direction
+        """
+
+        self.name = name
+        self.measure = measure
+        self.channels = dict(channels or CHANNELS)
+        # (column in the buffer, role, sign)
+        self.terms = [(measure.items.index(channel) - 1, role.lstrip('-'), -1 if role.startswith('-') else 1)
+                      for channel, role in self.channels.items()]
+        # column of each term in the statistics of the meter (they follow fewer channels than the buffer has),
+        # None when one of the channels is not followed
+        names = measure.stats.names if measure.stats is not None else ()
+        self.followed = ([names.index(channel) for channel in self.channels]
+                         if all(channel in names for channel in self.channels) else None)
+
+    def __repr__(self):
+        return "{} {}".format(self.name, self.channels)
+
+
+class Site:
+
+    """Meters of the site, ingested concurrently and seen together by the control law"""
+
+    def __init__(self, meters):
+        self.meters = list(meters)
+
+    async def ingest(self):
+        """Every source in the event loop, until they are stopped"""
+        await asyncio.gather(*(meter.measure.ingest() for meter in self.meters))
+
+    def stop(self):
+        for meter in self.meters:
+            meter.measure.stop()
+
+    def aligned(self, max_skew):
+        """
+        Time of the site view : the newest measure all the meters have, but a meter late by more than 'max_skew'
+        seconds behind the newest one does not hold the others back
+        :return: timestamp, None when no meter has a measure
+        """
+        lasts = [meter.measure.last_measure for meter in self.meters if len(meter.measure.buffer)]
+        if not lasts:
+            return None
+        return max(min(lasts), max(lasts) - max_skew)
+
+    def measures(self, span, smoothing=0, combine=None, max_skew=30):
+        """
+        Currents of the roles over the last 'span' seconds of the site view
+        :param smoothing: window of the EWMA of the meters statistics to use instead of the mean, 0 for the mean
+        :param combine: dict role -> key of COMBINE, 'sum' for a role not given
+        :return: (datetime of the view, iBatt, iPV, iConso), None when there is no measure
+        """
+        timestamp = self.aligned(max_skew)
+        if timestamp is None:
+            return None
+        combine = combine or {}
+        values = dict((role, []) for role in ROLES)
+        for meter in self.meters:
+            measure = meter.measure
+            means, columns = None, None
+            if smoothing and meter.followed is not None and smoothing in measure.stats.windows:
+                means, columns = measure.stats.get('ewma', smoothing), meter.followed
+            if means is None:
+                columns = [column for column, role, sign in meter.terms]
+                window = measure.buffer.mean_between(timestamp - span + 1, timestamp)
+                if window is None and len(measure.buffer):
+                    # late meter : its last window, until it catches up
+                    STALE.labels(meter.name).inc()
+                    window = measure.buffer.mean_since(measure.last_measure - span + 1)
+                means = window[2] if window is not None else None
+            LAG.labels(meter.name).set(max(timestamp - measure.last_measure, 0) if len(measure.buffer) else 0)
+            if means is None:
+                continue
+            for term, column in zip(meter.terms, columns):
+                role, sign = term[1:]
+                value = sign * float(means[column])
+                values[role].append(value if role in SIGNED else abs(value))
+        answer = [todatetime(timestamp)]
+        for role in ROLES:
+            answer.append(COMBINE[combine.get(role, 'sum')](values[role]) if values[role] else 0)
+        return tuple(answer)
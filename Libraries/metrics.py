@@ -0,0 +1,261 @@
+# Counters, gauges and histograms of the controller, served in the Prometheus text format
+# on a local HTTP port or a Unix socket : curl http://127.0.0.1:9877/metrics
+import os
+import time
+import bisect
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler
+
+# Latencies in second, from a fast control computation to a serial exchange waiting for its deadline
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def labelstring(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in pairs) + '}'
+
+
+class Metric:
+
+    """Base of the metrics : one child per combination of label values, created at first use"""
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.children[()] = self.new()
+
+    def labels(self, *values):
+        """Child of these label values (in the order of 'labels')"""
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new())
+        return child
+
+    def new(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, escape(self.help)), '# TYPE {} {}'.format(self.name, self.kind)]
+        with self.lock:
+            # labels() may add a child from another thread meanwhile
+            children = list(self.children.items())
+        for values, child in sorted(children):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class CounterValue:
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self, name, names, values):
+        return ['{}{} {}'.format(name, labelstring(names, values), self.value)]
+
+
+class Counter(Metric):
+
+    """Value that only increases (events, errors, bytes)"""
+
+    kind = 'counter'
+
+    def new(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+
+class GaugeValue:
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, names, values):
+        return ['{}{} {}'.format(name, labelstring(names, values), self.value)]
+
+
+class Gauge(Metric):
+
+    """Value that goes up and down (last order, buffer filling)"""
+
+    kind = 'gauge'
+
+    def new(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self.children[()].set(value)
+
+
+class HistogramValue:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        return Timer(self)
+
+    def render(self, name, names, values):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulated = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+            cumulated += count
+            lines.append('{}_bucket{} {}'.format(name, labelstring(names, values, [('le', bound)]), cumulated))
+        lines.append('{}_sum{} {}'.format(name, labelstring(names, values), total))
+        lines.append('{}_count{} {}'.format(name, labelstring(names, values), cumulated))
+        return lines
+
+
+class Histogram(Metric):
+
+    """Distribution of durations (or sizes) in buckets, with their sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        Metric.__init__(self, name, help, labels)
+
+    def new(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def time(self):
+        """with histogram.time(): ... observes the duration of the block"""
+        return Timer(self.children[()])
+
+
+class Timer:
+
+    def __init__(self, target):
+        self.target = target
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.target.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric, or return the one already registered with this name (module imported twice)"""
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format 0.0.4"""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in sorted(metrics, key=lambda metric: metric.name):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labels=()):
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def gauge(name, help, labels=()):
+    return REGISTRY.register(Gauge(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return str(self.client_address or 'unix')
+
+    def log_message(self, format, *args):
+        pass  # a scrape every few seconds must not fill the logs
+
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(listen, registry=REGISTRY):
+    """
+    Serve the metrics from a daemon thread
+    :param listen: "host:port" for HTTP over TCP, or the path of a Unix socket (beginning with /)
+    :return: the server, server.shutdown() stops it
+    """
+    if listen.startswith('/'):
+        if os.path.exists(listen):
+            os.remove(listen)  # left by a previous run
+        server = UnixServer(listen, Handler)
+    else:
+        host, port = listen.rsplit(':', 1)
+        server = TCPServer((host, int(port)), Handler)
+    server.registry = registry
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    return server
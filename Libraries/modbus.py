@@ -0,0 +1,136 @@
+# Minimal Modbus-TCP : "read holding registers" (function 0x03) on the client side,
+# and a stand-in server to test the meter readings without a meter
+import struct
+import threading
+import socketserver
+
+MBAP = struct.Struct('>HHHB')  # transaction id, protocol id (0), length of what follows, unit id
+READ = struct.Struct('>BHH')  # function, first register, number of registers
+READ_HOLDING_REGISTERS = 0x03
+MAX_REGISTERS = 125  # per request
+
+# Encoding of a value in the registers (the most significant word first) : format and number of registers
+KINDS = {
+    'int16': ('>h', 1),
+    'uint16': ('>H', 1),
+    'int32': ('>i', 2),
+    'uint32': ('>I', 2),
+    'float32': ('>f', 2),
+}
+
+
+class ModbusError(ValueError):
+
+    """Exception answer of the device, or an answer that does not match the request"""
+
+
+def request(transaction, unit, address, count):
+    """Frame of a read holding registers request"""
+    return MBAP.pack(transaction, 0, 1 + READ.size, unit) + READ.pack(READ_HOLDING_REGISTERS, address, count)
+
+
+async def read_registers(reader, writer, transaction, unit, address, count):
+    """
+    One request / answer on an open connection
+    :return: tuple of 'count' register values (uint16)
+    :raise ModbusError: exception answer or wrong answer
+    :raise asyncio.IncompleteReadError: the connection was closed
+    """
+    writer.write(request(transaction, unit, address, count))
+    await writer.drain()
+    header = await reader.readexactly(MBAP.size)
+    tid, protocol, length, answer_unit = MBAP.unpack(header)
+    pdu = await reader.readexactly(length - 1)
+    if tid != transaction or protocol != 0 or answer_unit != unit:
+        raise ModbusError("answer of transaction {} unit {} to the request {} unit {}".format(
+            tid, answer_unit, transaction, unit))
+    if pdu[0] == READ_HOLDING_REGISTERS | 0x80:
+        raise ModbusError("exception code {}".format(pdu[1]))
+    if pdu[0] != READ_HOLDING_REGISTERS or pdu[1] != 2 * count or len(pdu) != 2 + 2 * count:
+        raise ModbusError("malformed answer")
+    return struct.unpack('>{}H'.format(count), pdu[2:])
+
+
+def decode(registers, offset, kind):
+    """Value of 'kind' stored from registers[offset]"""
+    fmt, size = KINDS[kind]
+    return struct.unpack(fmt, struct.pack('>{}H'.format(size), *registers[offset:offset + size]))[0]
+
+
+def encode(value, kind):
+    """Registers holding 'value' as 'kind'"""
+    fmt, size = KINDS[kind]
+    return struct.unpack('>{}H'.format(size), struct.pack(fmt, value))
+
+
+class Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server.owner
+        while True:
+            header = self.receive(MBAP.size)
+            if header is None:
+                return
+            transaction, protocol, length, unit = MBAP.unpack(header)
+            pdu = self.receive(length - 1)
+            if pdu is None:
+                return
+            server.requests += 1
+            function, address, count = READ.unpack(pdu[:READ.size])
+            if function != READ_HOLDING_REGISTERS:
+                answer = bytes((function | 0x80, 1))  # illegal function
+            elif count < 1 or count > MAX_REGISTERS or address + count > len(server.registers):
+                answer = bytes((function | 0x80, 2))  # illegal data address
+            else:
+                with server.lock:
+                    values = server.registers[address:address + count]
+                answer = struct.pack('>BB{}H'.format(count), function, 2 * count, *values)
+            self.request.sendall(MBAP.pack(transaction, 0, 1 + len(answer), unit) + answer)
+
+    def receive(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ModbusServer(threading.Thread):
+
+    """Stand-in Modbus-TCP device serving holding registers, for tests and benchmarks without a meter"""
+
+    def __init__(self, host='127.0.0.1', port=0, size=256):
+
+        """
+        :param port: 0 for a free port, see self.port
+        :param size: Number of holding registers, all 0 at the beginning
+        """
+
+        threading.Thread.__init__(self, name="ModbusServer")
+        self.daemon = True
+        self.registers = [0] * size
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.server = TCPServer((host, port), Handler)
+        self.server.owner = self
+        self.port = self.server.server_address[1]
+
+    def set(self, address, value, kind='float32'):
+        """Write a value in the registers, like the meter updating a measure"""
+        words = encode(value, kind)
+        with self.lock:
+            self.registers[address:address + len(words)] = words
+
+    def run(self):
+        self.server.serve_forever(0.1)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,68 @@
+import threading
+
+
+class ModeSwitch:
+
+    """Control mode given by switches on GPIO inputs : edge callbacks instead of reading the pins each cycle,
+    a position is taken once the pins stayed stable during 'settle' (contact bounce)"""
+
+    def __init__(self, gpio, pins, modes, default, on_change=None, settle=0.05):
+
+        """
+        :param gpio: RPi.GPIO module, already set up with the pins as inputs
+        :param pins: GPIO channels of the switches
+        :param modes: dict tuple of the pin levels -> mode, a position not in it is undefined : the mode is kept
+        :param default: Mode used until a defined position is read
+        :param on_change: Function called with (old mode, new mode) from the GPIO or timer thread
+        :param settle: Time in second the pins must stay unchanged after an edge before the position is read
+        """
+
+        self.gpio = gpio
+        self.pins = tuple(pins)
+        self.modes = modes
+        self.on_change = on_change
+        self.settle = settle
+        self.mode = default  # replaced in one assignment : a reader always sees a complete mode
+        self.position = None  # pin levels of the last reading
+        self.timer = None
+        self.lock = threading.Lock()  # timer
+        self.reading = threading.Lock()  # position and mode
+        self.edges = True  # False when the edge detection is not available : refresh() reads the pins
+        self.refresh()
+        try:
+            for pin in self.pins:
+                gpio.add_event_detect(pin, gpio.BOTH, callback=self._edge)
+        except RuntimeError:
+            self.edges = False
+
+    def _edge(self, channel):
+        # A new edge restarts the settle delay, the pins are read once they stopped bouncing
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.settle, self.refresh)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def refresh(self):
+        """Read the pins and publish the mode of their position. :return: the mode in use"""
+        with self.reading:
+            position = tuple(self.gpio.input(pin) for pin in self.pins)
+            if position == self.position:
+                return self.mode
+            self.position = position
+            new = self.modes.get(position)
+            if new is None or new == self.mode:
+                return self.mode  # undefined position (switch between two positions) : the last mode stays
+            old, self.mode = self.mode, new
+        if self.on_change is not None:
+            self.on_change(old, new)
+        return new
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+        if self.edges:
+            for pin in self.pins:
+                self.gpio.remove_event_detect(pin)
@@ -0,0 +1,57 @@
+# Control laws of SinaB as pure functions : same answer live (floats) and in the backtester (numpy arrays)
+#
+# The measures follow the wiring of the Smatch Box, currents in A on one phase :
+# - iBatt, from i1, phase of the battery, positive when the battery is DISCHARGING
+# - iPV, from i2, output of the PV inverter (production only, taken as absolute value)
+# - iConso, from i3, sub-circuit with ONLY CONSUMPTION, the charging stations included (absolute value)
+# - iStation, current drawn by the stations on the phase of i3 at their last answers, removed from iConso
+import numpy
+
+VOLTAGE = 230  # V, nominal voltage of the grid
+
+
+def pv_high(iBatt, iPV, iConso, iStation, iMaxHouse):
+    """PV_High-priority : the charge may use the whole instant PV production measured at the inverter output"""
+    # if we accept to take a bit on the grid at a low current, the order could be poleMin
+    # when iPV < poleMin and iConso < iMaxHouse + iPV
+    return iPV
+
+
+def pv_low(iBatt, iPV, iConso, iStation, iMaxHouse):
+    """PV_Low-priority : the PV production minus the house consumption, and minus the battery charging"""
+    # A discharging battery is not PV production, it doesn't enter in account,
+    # a charging one has priority on the PV
+    return iPV - iConso + iStation + numpy.minimum(iBatt, 0)
+
+
+def peak_shaving(iBatt, iPV, iConso, iStation, iMaxHouse):
+    """Peak-shaving : the max current allowed by the grid minus the consumption of the house"""
+    return iMaxHouse - iConso + iStation
+
+
+POLICIES = {
+    "PV_High-priority": pv_high,
+    "PV_Low-priority": pv_low,
+    "Peak-shaving": peak_shaving,
+}
+
+
+def order(mode, iBatt, iPV, iConso, iStation, iMaxHouse):
+    """
+    Current the charge is allowed to use on each phase
+    :param mode: key of POLICIES, another value is taken as Peak-shaving
+    :return: order in A, not below 0 (there is no power for the car), float or array like the measures
+    """
+    value = numpy.maximum(POLICIES.get(mode, peak_shaving)(iBatt, iPV, iConso, iStation, iMaxHouse), 0)
+    return float(value) if numpy.ndim(value) == 0 else value
+
+
+def station_current(responses, phase=0):
+    """
+    Own current of the stations as the consumption clamp sees it : what their ChargeBoxes draw on the phase of
+    the clamp (an RMS current like the measure, not the active one), a car charging on another phase counts
+    for nothing
+    :param responses: iterable of maxprotocol.StationResponse
+    :param phase: phase of the clamp, 0 for L1
+    """
+    return sum((box.l1, box.l2, box.l3)[phase] for response in responses for box in response.boxes)
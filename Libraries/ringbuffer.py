@@ -0,0 +1,157 @@
+import threading
+import numpy
+
+
+class RingBuffer:
+
+    """Fixed-size circular storage of timestamped measurements with O(1) moving means"""
+
+    def __init__(self, size, channels):
+
+        """
+        Preallocate the storage once, nothing is allocated when samples are added
+        :param size: Number of samples to keep (the oldest one is overwritten when full)
+        :param channels: Number of float channels stored next to each timestamp
+        """
+
+        self.size = size
+        self.channels = channels
+        self.timestamps = numpy.zeros(size, dtype=numpy.int64)
+        self.data = numpy.zeros((size, channels), dtype=numpy.float64)
+        # Cumulative sums of every channel, one slot more than the data so that the sum of
+        # the last n samples is always cum[head] - cum[head - n]
+        self._cum = numpy.zeros((size + 1, channels), dtype=numpy.float64)
+        self._count = 0  # number of valid samples in the buffer
+        self._total = 0  # number of samples ever appended
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, values):
+        """
+        Store one sample, overwrite the oldest one if the buffer is full. A sample with a NaN or an infinite
+        value is not stored : it would stay in the cumulative sums, and in every mean, for good
+        :param timestamp: epoch in seconds (int)
+        :param values: sequence of 'channels' floats
+        :return: False when the sample is rejected
+        """
+        values = numpy.asarray(values, dtype=numpy.float64)
+        if not numpy.isfinite(values).all():
+            return False
+        with self.lock:
+            self._append(timestamp, values)
+        return True
+
+    def extend(self, timestamps, values):
+        """
+        Store several samples at once, the ones with a non-finite value are rejected like in append()
+        :param timestamps: array of epoch in seconds
+        :param values: 2D array, one line per sample
+        """
+        values = numpy.asarray(values, dtype=numpy.float64).reshape(-1, self.channels)
+        finite = numpy.isfinite(values).all(axis=1)
+        if not finite.all():
+            timestamps, values = numpy.asarray(timestamps)[finite], values[finite]
+        with self.lock:
+            n = len(timestamps)
+            if n >= self.size:
+                # everything already stored would be overwritten, only the last 'size' samples matter
+                self._total += n - self.size
+                self._count = 0
+                timestamps, values, n = timestamps[-self.size:], values[-self.size:], self.size
+            steps = numpy.arange(self._total, self._total + n)
+            self.timestamps[steps % self.size] = timestamps
+            self.data[steps % self.size] = values
+            self._cum[(steps + 1) % (self.size + 1)] = self._cum[self._total % (self.size + 1)] + \
+                numpy.cumsum(values, axis=0)
+            crossed = (self._total + n) // self.size != self._total // self.size
+            self._total += n
+            self._count = min(self.size, self._count + n)
+            if crossed:
+                self._rebase()
+
+    def _append(self, timestamp, values):
+        pos = self._total % self.size
+        head = self._total % (self.size + 1)
+        self.timestamps[pos] = timestamp
+        self.data[pos] = values
+        numpy.add(self._cum[head], self.data[pos], out=self._cum[(head + 1) % (self.size + 1)])
+        self._total += 1
+        if self._count < self.size:
+            self._count += 1
+        if self._total % self.size == 0:
+            self._rebase()
+
+    def _rebase(self):
+        # The cumulative sums grow without limit, bring them back near zero once per buffer
+        # length to keep the float precision (amortised O(1) per sample)
+        self._cum -= self._cum[(self._total - self._count) % (self.size + 1)].copy()
+
+    def clear(self):
+        with self.lock:
+            self._count = 0
+            self._total = 0
+            self._cum[:] = 0
+
+    def last(self):
+        """Return (timestamp, values) of the newest sample, None if empty"""
+        with self.lock:
+            if self._count == 0:
+                return None
+            pos = (self._total - 1) % self.size
+            return int(self.timestamps[pos]), self.data[pos].copy()
+
+    def sum(self, length):
+        """Sum of each channel over the last 'length' samples, O(1)"""
+        head = self._total % (self.size + 1)
+        return self._cum[head] - self._cum[(self._total - length) % (self.size + 1)]
+
+    def mean(self, length=None):
+        """
+        Moving mean over the last 'length' samples
+        :return: (first timestamp, last timestamp, array of the channel means) or None if not enough samples
+        """
+        with self.lock:
+            return self._mean(self._count if length is None else length)
+
+    def mean_since(self, timestamp):
+        """Moving mean over the samples at or after 'timestamp' (same result format as mean)"""
+        with self.lock:
+            times = self._ordered(self.timestamps)
+            return self._mean(self._count - int(numpy.searchsorted(times, timestamp, side='left')))
+
+    def mean_between(self, first, last):
+        """Mean over the samples with first <= timestamp <= last (same result format as mean)"""
+        with self.lock:
+            times = self._ordered(self.timestamps)
+            start = int(numpy.searchsorted(times, first, side='left'))
+            end = int(numpy.searchsorted(times, last, side='right'))
+            if end <= start:
+                return None
+            # samples [start, end) of the chronological order, from the cumulative sums
+            oldest = self._total - self._count
+            sums = self._cum[(oldest + end) % (self.size + 1)] - self._cum[(oldest + start) % (self.size + 1)]
+            return int(times[start]), int(times[end - 1]), sums / (end - start)
+
+    def _mean(self, length):
+        if length <= 0 or length > self._count:
+            return None
+        first = int(self.timestamps[(self._total - length) % self.size])
+        last = int(self.timestamps[(self._total - 1) % self.size])
+        return first, last, self.sum(length) / length
+
+    def _ordered(self, column):
+        # Chronological copy of a column of the circular storage
+        if self._count < self.size:
+            return column[:self._count].copy()
+        pos = self._total % self.size
+        return numpy.concatenate((column[pos:], column[:pos]))
+
+    def get(self, first=None, last=None):
+        """
+        Chronological copy of the buffer content, sliced like a list
+        :return: (timestamps array, 2D data array)
+        """
+        with self.lock:
+            return self._ordered(self.timestamps)[first:last], self._ordered(self.data)[first:last]
@@ -0,0 +1,95 @@
+import os
+import time
+import threading
+import serial
+
+
+class SerialSession:
+
+    """Long-lived RS485 port shared by the commands : opened when first needed, reused, reopened with a backoff"""
+
+    def __init__(self, settings, min_backoff=1, max_backoff=60):
+
+        """
+        :param settings: 'Serial' part of the configuration (port, baudrate, bytesize, parity, stopbits,
+            timeout, writeTimeout)
+        :param min_backoff: Delay in second before the first reconnection attempt after a failure
+        :param max_backoff: Longest delay between two reconnection attempts (the delay doubles at each failure)
+        """
+
+        self.settings = settings
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.next_attempt = 0  # no connection attempt before this time
+        self.failures = 0
+        self.serial = None
+        self.lock = threading.RLock()
+
+    def __enter__(self):
+        """Take the bus and return the open port, or None if it is not available right now"""
+        self.lock.acquire()
+        try:
+            return self.acquire()
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is not None and issubclass(exc_type, (serial.SerialException, OSError)):
+                self.broken(exc_value)
+            elif exc_type is None and self.serial is not None:
+                self.backoff = self.min_backoff
+        finally:
+            self.lock.release()
+        return False
+
+    def acquire(self):
+        """Return the open port, open it if needed. None while waiting before the next reconnection"""
+        if self.serial is not None and not os.path.exists(self.settings['port']):
+            # The USB adapter disappeared (re-enumeration), the file descriptor is dead
+            self.broken("device {} is gone".format(self.settings['port']))
+        if self.serial is None:
+            if time.monotonic() < self.next_attempt:
+                return None
+            try:
+                self.serial = serial.Serial(
+                    port=self.settings['port'],
+                    baudrate=self.settings['baudrate'],
+                    bytesize=self.settings['bytesize'],
+                    parity=self.settings['parity'],
+                    stopbits=self.settings['stopbits'],
+                    timeout=self.settings['timeout'],
+                    writeTimeout=self.settings['writeTimeout']
+                )
+            except (serial.SerialException, OSError, ValueError) as e:
+                self.broken(e)
+                return None
+        return self.serial
+
+    def reconfigure(self, settings):
+        """Use new settings : the port is closed and reopened with them at the next command"""
+        with self.lock:
+            self.settings = settings
+            self.close()
+            self.backoff = self.min_backoff
+            self.next_attempt = 0
+
+    def broken(self, reason=None):
+        """Close the port after an error, the next attempt to reopen it is delayed by the backoff"""
+        with self.lock:
+            self.close()
+            self.failures += 1
+            self.next_attempt = time.monotonic() + self.backoff
+            print("RS485 port unavailable ({}), next attempt in {} s".format(reason, self.backoff))
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def close(self):
+        with self.lock:
+            if self.serial is not None:
+                try:
+                    self.serial.close()
+                except (serial.SerialException, OSError):
+                    pass
+                self.serial = None
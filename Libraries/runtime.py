@@ -0,0 +1,118 @@
+import time
+import signal
+import asyncio
+
+
+class ControlRuntime:
+
+    """Run the measurement ingestion, the control law and the EV-Box serial exchanges
+    as cooperating asyncio tasks of one event loop (the log files are written by logwriter.LogWriter)"""
+
+    def __init__(self, measure, control, send, handle, next_deadline, min_interval=None):
+
+        """
+        :param measure: Measures to ingest, an object with an async ingest() (meters.Site, or a SmartPi)
+        :param control: function without argument computing the command to send, or None to send nothing.
+            It runs in the loop : it must be fast and do no I/O
+        :param send: blocking function sending a command to the EV-Box and returning its answer,
+            it runs in a worker thread so that a slow exchange never delays the other tasks
+        :param handle: function called in the loop with (command, answer) once the exchange is done
+        :param next_deadline: function returning the epoch of the next control cycle
+        :param min_interval: function returning the minimum time in second between two exchanges (announced by
+            the EV-Box in its answers). A cycle triggered sooner waits until it has elapsed
+        """
+
+        self.measure = measure
+        self.control = control
+        self.send = send
+        self.handle = handle
+        self.next_deadline = next_deadline
+        self.min_interval = min_interval
+        self.last_exchange = None  # time.monotonic() at the end of the last exchange
+        self.loop = None
+        self.tasks = []
+        self.commands = None  # only the newest command waits for the bus, an older one is replaced
+        self.wakeup = None  # set by a trigger, or at the end of an exchange (the deadline may have moved)
+        self.triggered = False
+
+    @property
+    def running(self):
+        return self.loop is not None and self.loop.is_running()
+
+    def trigger(self):
+        """Ask for a control cycle now (can be called from any thread)"""
+        if self.running:
+            self.loop.call_soon_threadsafe(self.wake, True)
+
+    def wake(self, triggered=False):
+        self.triggered = self.triggered or triggered
+        self.wakeup.set()
+
+    def stop(self):
+        """Cancel every task, run() returns once they are all finished"""
+        for task in self.tasks:
+            task.cancel()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.commands = asyncio.Queue(maxsize=1)
+        self.wakeup = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # not the main thread
+        self.tasks = [asyncio.ensure_future(self.measure.ingest()),
+                      asyncio.ensure_future(self.controller()),
+                      asyncio.ensure_future(self.serial())]
+        try:
+            await asyncio.gather(*self.tasks)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.stop()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    self.loop.remove_signal_handler(signum)
+                except (NotImplementedError, RuntimeError):
+                    pass
+
+    async def controller(self):
+        while True:
+            deadline = self.next_deadline()
+            # Sleep until the deadline (wall clock) unless a cycle is triggered before
+            if not self.triggered and time.time() < deadline:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), deadline - time.time())
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                if not self.triggered and time.time() < deadline:
+                    continue  # an exchange ended : the deadline is computed again
+            self.triggered = False
+            await self.holdoff()  # the law runs after the wait, on the newest measures
+            command = self.control()
+            if command is not None:
+                if self.commands.full():
+                    self.commands.get_nowait()  # the bus is still busy with the previous one, it is outdated
+                self.commands.put_nowait(command)
+            # a deadline already passed must not keep the loop from the serial task and the signals
+            await asyncio.sleep(0)
+
+    async def serial(self):
+        while True:
+            command = await self.commands.get()
+            await self.holdoff()
+            answer = await asyncio.to_thread(self.send, command)
+            self.handle(command, answer)
+            self.last_exchange = time.monotonic()
+            self.wake()
+
+    async def holdoff(self):
+        # Rate limit of the bus : nothing is sent before the minimum interval since the end of the last exchange
+        if self.min_interval is None or self.last_exchange is None:
+            return
+        delay = self.last_exchange + self.min_interval() - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,106 @@
+# Warm restart : the measures buffer, the last answers of the modems and the controller state are saved
+# in a small binary file, and read back at startup if it is recent enough
+#
+# File layout (little endian) :
+#   header : magic, version, saved at (epoch), number of meters, iStation, order
+#   per meter : rows, channels, last measure, rows int64 timestamps, then rows x channels float64 measures
+#   number of answers, then per answer : modem address, frame length, frame (maxprotocol.encode_response)
+#   CRC32 of everything before it
+import os
+import time
+import zlib
+import struct
+import numpy
+from Libraries import maxprotocol
+
+MAGIC = b'TD2CSNAP'
+VERSION = 3  # 2 : iStation in A on the measured phase (it was a power in W), 3 : several meters
+HEADER = struct.Struct('<8sHdHdd')
+BUFFER = struct.Struct('<IIq')
+ANSWER = struct.Struct('<BH')
+CRC = struct.Struct('<I')
+
+
+def save(path, buffers, responses, iStation, order):
+    """
+    Write the snapshot atomically : a crash leaves the previous file or the new one, never a mix
+    :param buffers: list of (timestamps, data, last measure) per meter : the measures of its buffer in
+        chronological order (see RingBuffer.get()), data being a 2D array with a line per measure
+    :param responses: dict address -> maxprotocol.StationResponse
+    """
+    parts = [HEADER.pack(MAGIC, VERSION, time.time(), len(buffers), float(iStation), float(order))]
+    for timestamps, data, last_measure in buffers:
+        data = numpy.ascontiguousarray(data, dtype='<f8')
+        parts += [BUFFER.pack(len(timestamps), data.shape[1] if data.ndim == 2 else 0, int(last_measure)),
+                  numpy.ascontiguousarray(timestamps, dtype='<i8').tobytes(), data.tobytes()]
+    parts.append(struct.pack('<H', len(responses)))
+    for address, response in sorted(responses.items()):
+        frame = maxprotocol.encode_response(response)
+        parts.append(ANSWER.pack(address, len(frame)) + frame)
+    content = b''.join(parts)
+    content += CRC.pack(zlib.crc32(content))
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    try:
+        # the rename itself is durable once the directory is synced
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+    except OSError:
+        pass
+
+
+def load(path, max_age):
+    """
+    :param max_age: A snapshot older than this (second) is ignored
+    :return: dict with 'saved', 'buffers' (list of dict 'timestamps', 'data', 'last_measure' per meter),
+        'responses', 'iStation', 'order', or None when there is no usable snapshot
+    :raise ValueError: the file is corrupted (wrong CRC, truncated, other version)
+    """
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+    if len(content) < HEADER.size + CRC.size or \
+            CRC.unpack_from(content, len(content) - CRC.size)[0] != zlib.crc32(content[:-CRC.size]):
+        raise ValueError("{} : corrupted snapshot".format(path))
+    magic, version, saved, count, iStation, order = HEADER.unpack_from(content)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("{} : not a snapshot of version {}".format(path, VERSION))
+    if not 0 <= time.time() - saved <= max_age:
+        return None
+    try:
+        return parse(content, saved, count, iStation, order)
+    except struct.error as e:
+        raise ValueError("{} : truncated snapshot ({})".format(path, e))
+
+
+def parse(content, saved, count, iStation, order):
+    offset = HEADER.size
+    buffers = []
+    for i in range(count):
+        rows, channels, last_measure = BUFFER.unpack_from(content, offset)
+        offset += BUFFER.size
+        timestamps = numpy.frombuffer(content, '<i8', rows, offset).astype(numpy.int64)
+        offset += rows * 8
+        data = numpy.frombuffer(content, '<f8', rows * channels, offset).reshape(rows, channels).astype(
+            numpy.float64)
+        offset += rows * channels * 8
+        buffers.append({'timestamps': timestamps, 'data': data, 'last_measure': last_measure})
+    responses = {}
+    count, = struct.unpack_from('<H', content, offset)
+    offset += 2
+    for i in range(count):
+        address, length = ANSWER.unpack_from(content, offset)
+        offset += ANSWER.size
+        responses[address] = maxprotocol.decode(content[offset:offset + length])
+        offset += length
+    return {'saved': saved, 'buffers': buffers, 'responses': responses, 'iStation': iStation, 'order': order}
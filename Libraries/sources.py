@@ -0,0 +1,186 @@
+# Sources of measures feeding a SmartPi buffer from the asyncio loop (see SmartPi.ingest) :
+# - FileSource : the values file rewritten by the SmartPi daemon (default)
+# - StreamSource : lines in the same format pushed on a TCP, UDP or Unix socket
+# - ModbusSource : registers of a meter read over Modbus-TCP
+# A source has an async run(measure) storing its readings with measure.store(), and stop()
+import os
+import time
+import asyncio
+import calendar
+import numpy
+from Libraries import valuesparser
+from Libraries import modbus
+from Libraries.filewatcher import FileWatcher
+
+# Default Modbus layout : every channel of the values file as a float32, in the same order, from register 0
+REGISTERS = dict((name, (2 * i, 'float32', 1.0)) for i, name in enumerate(valuesparser.ITEMS[1:]))
+
+debug = True
+
+
+def now():
+    """Current time as an epoch of the local wall clock, like the timestamps of the values file"""
+    return calendar.timegm(time.localtime())
+
+
+class FileSource:
+
+    """Values file read each time the SmartPi daemon rewrites it (inotify, or polling of its mtime/size)"""
+
+    def __init__(self, path, poll_interval=0.5):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.watcher = None
+
+    async def run(self, measure):
+        self.watcher = FileWatcher(self.path, lambda: measure.load(self.path), self.poll_interval)
+        try:
+            await self.watcher.watch()
+        finally:
+            self.watcher.close()
+
+    def stop(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+
+
+class StreamSource:
+
+    """Listen for lines in the format of the values file : 'tcp://host:port', 'udp://host:port' or
+    'unix:///path'. With TCP and Unix sockets several senders may be connected, a UDP datagram holds whole lines"""
+
+    def __init__(self, url):
+        self.url = url
+        self.scheme, separator, self.address = url.partition('://')
+        if self.scheme not in ('tcp', 'udp', 'unix') or not separator:
+            raise ValueError("{} : the source must be tcp://host:port, udp://host:port or unix:///path".format(url))
+        self.server = None
+        self.transport = None
+        self.stopped = None
+
+    def _hostport(self):
+        host, port = self.address.rsplit(':', 1)
+        return host, int(port)
+
+    async def run(self, measure):
+        loop = asyncio.get_running_loop()
+        self.stopped = loop.create_future()
+        if self.scheme == 'udp':
+            self.transport, protocol = await loop.create_datagram_endpoint(
+                lambda: Datagrams(self, measure), local_addr=self._hostport())
+        elif self.scheme == 'tcp':
+            self.server = await asyncio.start_server(lambda r, w: self.client(measure, r, w), *self._hostport())
+        else:
+            if os.path.exists(self.address):
+                os.remove(self.address)  # left by a previous run
+            self.server = await asyncio.start_unix_server(lambda r, w: self.client(measure, r, w), self.address)
+        try:
+            await self.stopped
+        finally:
+            if self.transport is not None:
+                self.transport.close()
+            if self.server is not None:
+                self.server.close()
+
+    async def client(self, measure, reader, writer):
+        pending = b''
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                complete, newline, pending = (pending + data).rpartition(b'\n')
+                if newline:
+                    self.feed(measure, complete + newline)
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            pass  # sender gone, or the source stopped while it was connected
+        finally:
+            writer.close()
+
+    def feed(self, measure, data):
+        measures, report = valuesparser.parse(data)
+        measure.store(measures, report, self.url)
+
+    def stop(self):
+        if self.stopped is not None and not self.stopped.done():
+            self.stopped.get_loop().call_soon_threadsafe(self.stopped.cancel)
+
+
+class Datagrams(asyncio.DatagramProtocol):
+
+    def __init__(self, source, measure):
+        self.source = source
+        self.measure = measure
+
+    def datagram_received(self, data, address):
+        self.source.feed(self.measure, data)
+
+
+class ModbusSource:
+
+    """Meter read over Modbus-TCP every 'interval' seconds, all the registers in one request"""
+
+    def __init__(self, host, port=502, unit=1, interval=1.0, registers=None, timeout=2.0, backoff=5.0):
+
+        """
+        :param interval: Time in second between two readings. The measures are timestamped to the second like
+            the values file, a reading in the same second as the previous one is not stored
+        :param registers: dict channel of the values file -> (first register, kind, scale), see modbus.KINDS.
+            A channel not given is stored as 0
+        :param timeout: Longest wait in second for the connection or an answer
+        :param backoff: Delay in second before connecting again after an error
+        """
+
+        self.host = host
+        self.port = port
+        self.unit = unit
+        self.interval = interval
+        self.registers = registers or REGISTERS
+        self.timeout = timeout
+        self.backoff = backoff
+        self.transaction = 0
+        self.errors = 0
+        self.task = None
+        # One read covers every register of the map
+        self.first = min(address for address, kind, scale in self.registers.values())
+        self.count = max(address + modbus.KINDS[kind][1] for address, kind, scale in self.registers.values()) - \
+            self.first
+        if self.count > modbus.MAX_REGISTERS:
+            raise ValueError("the registers of the map span {} registers, {} at most".format(
+                self.count, modbus.MAX_REGISTERS))
+
+    def decode(self, registers, timestamp):
+        """Measure of a read, as a DTYPE array of one element"""
+        row = numpy.zeros(1, dtype=valuesparser.DTYPE)
+        row['timestamp'] = timestamp
+        for name, (address, kind, scale) in self.registers.items():
+            row[name] = modbus.decode(registers, address - self.first, kind) * scale
+        return row
+
+    async def run(self, measure):
+        self.task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        while True:
+            writer = None
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+                while True:
+                    started = loop.time()
+                    self.transaction = (self.transaction + 1) & 0xFFFF
+                    registers = await asyncio.wait_for(modbus.read_registers(
+                        reader, writer, self.transaction, self.unit, self.first, self.count), self.timeout)
+                    measure.store(self.decode(registers, now()), source="modbus://{}:{}".format(self.host, self.port))
+                    await asyncio.sleep(max(0.0, self.interval - (loop.time() - started)))
+            except (OSError, EOFError, ValueError, asyncio.TimeoutError) as e:
+                # connection refused or lost, timeout, exception answer : connect again after a while
+                self.errors += 1
+                if debug: print("Modbus {}:{} : {!r}, new attempt in {} s".format(self.host, self.port, e,
+                                                                                  self.backoff))
+            finally:
+                if writer is not None:
+                    writer.close()
+            await asyncio.sleep(self.backoff)
+
+    def stop(self):
+        if self.task is not None:
+            self.task.get_loop().call_soon_threadsafe(self.task.cancel)
@@ -0,0 +1,248 @@
+import os
+import numpy
+
+# Series kept by the controller and their columns
+SERIES = {
+    'measures': ['iBatt', 'iPV', 'iConso'],
+    'commands': ['L1', 'L2', 'L3'],
+    'connectors': ['connector', 'min_current', 'l1', 'l2', 'l3', 'cos1', 'cos2', 'cos3', 'wh'],
+}
+# Column telling which source a row comes from : the rollups are kept per source instead of mixing them
+# (a connector is its modem address * 100 + its index on the modem)
+KEYS = {'connectors': 'connector'}
+# Counters only growing : their rollup is the last value instead of the mean
+COUNTERS = {'connectors': ['wh']}
+RESOLUTIONS = (60, 900, 3600)  # rollups of 1 min, 15 min and 1 h
+
+
+class Table:
+
+    """Append-only set of memory-mapped columns : one file of int64 timestamps and one file of float64 per column"""
+
+    def __init__(self, path, columns, chunk=16384):
+
+        """
+        :param path: Directory of the table, created if needed
+        :param columns: Names of the float columns
+        :param chunk: Number of rows added to the files each time they are full
+        """
+
+        self.path = path
+        self.columns = list(columns)
+        self.chunk = chunk
+        os.makedirs(path, exist_ok=True)
+        self.maps = {}
+        self.capacity = 0
+        self._map(max(chunk, self._filesize()))
+        # The files are preallocated with zeros, the length is the number of non-zero timestamps
+        # (timestamps never decrease, so it is found by a binary search, nothing else has to be saved)
+        stamps = self.maps['timestamp']
+        low, high = 0, self.capacity
+        while low < high:
+            middle = (low + high) // 2
+            if stamps[middle] > 0:
+                low = middle + 1
+            else:
+                high = middle
+        self.length = low
+
+    def _filesize(self):
+        try:
+            return os.path.getsize(os.path.join(self.path, 'timestamp.i8')) // 8
+        except OSError:
+            return 0
+
+    def _map(self, capacity):
+        # (re)open every column with a file size of 'capacity' rows
+        for name, dtype in [('timestamp', numpy.int64)] + [(column, numpy.float64) for column in self.columns]:
+            filename = os.path.join(self.path, name + ('.i8' if name == 'timestamp' else '.f8'))
+            if name in self.maps:
+                self.maps[name].flush()
+                del self.maps[name]
+            with open(filename, 'ab') as f:
+                f.truncate(capacity * 8)
+            self.maps[name] = numpy.memmap(filename, dtype=dtype, mode='r+', shape=(capacity,))
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.length
+
+    def last(self):
+        """Timestamp of the newest row, 0 if the table is empty"""
+        return int(self.maps['timestamp'][self.length - 1]) if self.length else 0
+
+    def extend(self, timestamps, values):
+        """
+        Append rows
+        :param timestamps: epochs in second, not older than the last row of the table
+        :param values: 2D array, one line per row and one column per table column
+        """
+        timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+        values = numpy.asarray(values, dtype=numpy.float64).reshape(len(timestamps), len(self.columns))
+        if not len(timestamps):
+            return
+        if timestamps[0] < self.last() or (numpy.diff(timestamps) < 0).any() or timestamps[0] <= 0:
+            raise ValueError("{} : timestamps must be positive and increasing".format(self.path))
+        end = self.length + len(timestamps)
+        if end > self.capacity:
+            self._map((end // self.chunk + 1) * self.chunk)
+        for i, column in enumerate(self.columns):
+            self.maps[column][self.length:end] = values[:, i]
+        self.maps['timestamp'][self.length:end] = timestamps  # written last : a row counts once it has a timestamp
+        self.length = end
+
+    def append(self, timestamp, values):
+        self.extend([timestamp], [values])
+
+    def query(self, start=None, end=None):
+        """
+        Rows with start <= timestamp < end, as views on the files (no copy)
+        :return: dict of numpy arrays, 'timestamp' and one entry per column
+        """
+        stamps = self.maps['timestamp'][:self.length]
+        first = 0 if start is None else int(numpy.searchsorted(stamps, start, side='left'))
+        last = self.length if end is None else int(numpy.searchsorted(stamps, end, side='left'))
+        return {name: column[first:last] for name, column in self.maps.items()}
+
+    def flush(self):
+        for column in self.maps.values():
+            column.flush()
+
+
+class Series:
+
+    """Raw rows of a series and its rollups, the rollups are updated each time rows are appended"""
+
+    def __init__(self, path, columns, resolutions=RESOLUTIONS, key=None, counters=()):
+
+        """
+        :param key: Column telling the source of a row, there is a rollup row per bucket and value of this column
+        :param counters: Columns rolled up with their last value instead of the mean
+        """
+
+        self.columns = list(columns)
+        self.key = key
+        self.counters = list(counters)
+        self.aggregated = [column for column in self.columns if column != key]
+        self.raw = Table(os.path.join(path, 'raw'), columns)
+        aggregates = ['count'] + ([key] if key else []) + \
+            [column + suffix for column in self.aggregated for suffix in ('_sum', '_min', '_max')] + \
+            [column + '_last' for column in self.counters]
+        self.rollups = {resolution: Table(os.path.join(path, str(resolution)), aggregates)
+                        for resolution in resolutions}
+        # Bucket being filled for each resolution : [start, {key: [count, sums, mins, maxs, lasts]}]
+        self.current = {}
+        for resolution, table in self.rollups.items():
+            # rebuilt from the raw rows after the last complete bucket (lost when the process stopped)
+            pending = self.raw.query(table.last() + resolution if len(table) else None)
+            self.current[resolution] = None
+            if len(pending['timestamp']):
+                self._aggregate(resolution, pending['timestamp'],
+                                numpy.column_stack([pending[column] for column in self.columns]))
+
+    def extend(self, timestamps, values):
+        timestamps = numpy.asarray(timestamps, dtype=numpy.int64)
+        values = numpy.asarray(values, dtype=numpy.float64).reshape(len(timestamps), len(self.columns))
+        self.raw.extend(timestamps, values)
+        for resolution in self.rollups:
+            self._aggregate(resolution, timestamps, values)
+
+    def append(self, timestamp, values):
+        self.extend([timestamp], [values])
+
+    def _aggregate(self, resolution, timestamps, values):
+        buckets = timestamps - timestamps % resolution
+        keys = values[:, self.columns.index(self.key)] if self.key else numpy.zeros(len(timestamps))
+        values = values[:, [self.columns.index(column) for column in self.aggregated]]
+        # limits of the runs of rows falling in the same bucket
+        cuts = numpy.flatnonzero(numpy.diff(buckets)) + 1
+        for rows in numpy.split(numpy.arange(len(buckets)), cuts):
+            start = int(buckets[rows[0]])
+            current = self.current[resolution]
+            if current is not None and current[0] != start:
+                self._close(resolution)
+                current = None
+            if current is None:
+                current = self.current[resolution] = [start, {}]
+            for key in numpy.unique(keys[rows]):
+                block = values[rows[keys[rows] == key]]
+                group = current[1].get(float(key))
+                if group is None:
+                    current[1][float(key)] = [len(block), block.sum(axis=0), block.min(axis=0), block.max(axis=0),
+                                              block[-1]]
+                else:
+                    group[0] += len(block)
+                    group[1] = group[1] + block.sum(axis=0)
+                    group[2] = numpy.minimum(group[2], block.min(axis=0))
+                    group[3] = numpy.maximum(group[3], block.max(axis=0))
+                    group[4] = block[-1]
+
+    def _rows(self, resolution):
+        """Rows of the rollup table for the bucket being filled, one per key"""
+        counters = [self.aggregated.index(column) for column in self.counters]
+        rows = []
+        for key, (count, sums, mins, maxs, lasts) in sorted(self.current[resolution][1].items()):
+            rows.append([count] + ([key] if self.key else []) + numpy.column_stack((sums, mins, maxs)).ravel().tolist()
+                        + lasts[counters].tolist())
+        return rows
+
+    def _close(self, resolution):
+        rows = self._rows(resolution)
+        self.rollups[resolution].extend([self.current[resolution][0]] * len(rows), rows)
+        self.current[resolution] = None
+
+    def query(self, start=None, end=None, resolution=None):
+        """
+        Range query
+        :param resolution: None for the raw rows, else one of the rollup resolutions in second
+        :return: dict of numpy arrays. For a rollup : 'timestamp' (bucket start), 'count', the key column,
+            and per column its mean (its last value for a counter) plus '<column>_min' and '<column>_max'
+        """
+        if resolution is None:
+            return self.raw.query(start, end)
+        table = self.rollups[resolution]
+        rows = table.query(start, end)
+        current = self.current[resolution]
+        if current is not None and (start is None or current[0] >= start) and (end is None or current[0] < end):
+            # the bucket being filled is returned too, with what it holds so far
+            partial = numpy.array(self._rows(resolution))
+            rows = dict((name, numpy.append(column, [current[0]] * len(partial) if name == 'timestamp'
+                                            else partial[:, table.columns.index(name)]))
+                        for name, column in rows.items())
+        answer = {'timestamp': rows['timestamp'], 'count': rows['count']}
+        if self.key:
+            answer[self.key] = rows[self.key]
+        for column in self.aggregated:
+            if column in self.counters:
+                answer[column] = rows[column + '_last']
+            else:
+                answer[column] = rows[column + '_sum'] / numpy.maximum(rows['count'], 1)
+            answer[column + '_min'] = rows[column + '_min']
+            answer[column + '_max'] = rows[column + '_max']
+        return answer
+
+    def flush(self):
+        self.raw.flush()
+        for table in self.rollups.values():
+            table.flush()
+
+
+class TimeSeriesStore:
+
+    """Columnar storage of the controller data : measures, commands and EV-Box connector readings"""
+
+    def __init__(self, path, series=SERIES, resolutions=RESOLUTIONS):
+        self.path = path
+        self.series = {name: Series(os.path.join(path, name), columns, resolutions, KEYS.get(name),
+                                    COUNTERS.get(name, ()))
+                       for name, columns in series.items()}
+
+    def append(self, name, timestamp, values):
+        self.series[name].append(timestamp, values)
+
+    def query(self, name, start=None, end=None, resolution=None):
+        return self.series[name].query(start, end, resolution)
+
+    def flush(self):
+        for series in self.series.values():
+            series.flush()
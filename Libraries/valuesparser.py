@@ -0,0 +1,137 @@
+import numpy
+
+# Fields of a line of the SmartPi values file, each one is followed by a ";"
+ITEMS = ["timestamp", "I1", "I2", "I3", "I4", "V1", "V2", "V3", "P1", "P2", "P3", "Cos1", "Cos2",
+         "Cos3", "F1", "F2", "F3", "Balanced"]
+DTYPE = numpy.dtype([(ITEMS[0], numpy.int64)] + [(item, numpy.float64) for item in ITEMS[1:]])
+
+# Layout of the timestamp 'YYYY-MM-DD HH:MM:SS' at the beginning of each line
+STAMP_LEN = 19
+DIGITS = numpy.array([0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18])
+SEPARATORS = {4: b'-', 7: b'-', 10: b' ', 13: b':', 16: b':', 19: b';'}
+MONTH_DAYS = numpy.array([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def days_from_civil(y, m, d):
+    """Number of days since 1970-01-01 of arrays of dates (proleptic Gregorian calendar)"""
+    y = y - (m <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * numpy.where(m > 2, m - 3, m + 9) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def parse(text, report=None):
+    """
+    Convert many lines of the SmartPi values file in one pass
+    The timestamps are kept as epochs of the SmartPi local time (same as the SmartPi buffer)
+    :param text: bytes (or str) with one measure per line, as written by the SmartPi daemon
+    :param report: dict of counters to update, see new_report()
+    :return: numpy structured array of DTYPE, one element per valid line, and the report
+    """
+    if report is None:
+        report = new_report()
+    if isinstance(text, str):
+        text = text.encode('ascii', 'replace')
+    if not text.endswith(b'\n'):
+        text += b'\n'
+    raw = numpy.frombuffer(text, dtype=numpy.uint8)
+
+    # Boundaries of every line, blank lines are not counted as lines
+    ends = numpy.flatnonzero(raw == ord('\n'))
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts
+    if lengths.size and (raw[ends - 1] == ord('\r')).any():
+        lengths -= raw[ends - 1] == ord('\r')
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    report['lines'] += len(starts)
+
+    # Number of ';' per line, from the sorted positions of all the ';' of the text
+    semicolons = numpy.flatnonzero(raw == ord(';'))
+    counts = numpy.searchsorted(semicolons, starts + lengths) - numpy.searchsorted(semicolons, starts)
+    valid = (counts == len(ITEMS)) & (lengths > STAMP_LEN + 1) & (raw[starts + lengths - 1] == ord(';'))
+    report['malformed']['field count'] += int((~valid).sum())
+    starts, lengths = starts[valid], lengths[valid]
+
+    # Timestamps : checked and converted on a (lines x 20) character matrix
+    stamps = raw[starts[:, None] + numpy.arange(STAMP_LEN + 1)] if len(starts) else \
+        numpy.zeros((0, STAMP_LEN + 1), dtype=numpy.uint8)
+    digits = stamps[:, DIGITS].astype(numpy.int64) - ord('0')
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    for position, char in SEPARATORS.items():
+        valid &= stamps[:, position] == ord(char)
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month, day, hour, minute, second = [digits[:, i] * 10 + digits[:, i + 1] for i in range(4, 14, 2)]
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (hour < 24) & (minute < 60) & (second < 60)
+    valid &= day <= MONTH_DAYS[numpy.clip(month, 0, 12)] - ((month == 2) & ~leap)
+    report['malformed']['timestamp'] += int((~valid).sum())
+    starts, lengths = starts[valid], lengths[valid]
+    timestamps = (days_from_civil(year[valid], month[valid], day[valid]) * 86400 +
+                  hour[valid] * 3600 + minute[valid] * 60 + second[valid])
+
+    # Values : all the numeric parts are joined and converted at once
+    fields = [text[start + STAMP_LEN + 1:start + length - 1] for start, length in zip(starts.tolist(), lengths.tolist())]
+    try:
+        values = numpy.array(b';'.join(fields).split(b';'), dtype=numpy.float64) if fields else numpy.zeros(0)
+    except ValueError:
+        # At least one bad number, find the guilty lines and convert the others
+        good = [_is_numeric(field) for field in fields]
+        report['malformed']['value'] += good.count(False)
+        timestamps = timestamps[numpy.array(good, dtype=bool)]
+        fields = [field for field, ok in zip(fields, good) if ok]
+        values = numpy.array(b';'.join(fields).split(b';'), dtype=numpy.float64) if fields else numpy.zeros(0)
+
+    values = values.reshape(len(timestamps), len(ITEMS) - 1)
+    # "nan" and "inf" are numbers for float(), not measures
+    finite = numpy.isfinite(values).all(axis=1)
+    if not finite.all():
+        report['malformed']['value'] += int((~finite).sum())
+        timestamps, values = timestamps[finite], values[finite]
+
+    result = numpy.empty(len(timestamps), dtype=DTYPE)
+    result['timestamp'] = timestamps
+    for i, item in enumerate(ITEMS[1:]):
+        result[item] = values[:, i]
+    report['parsed'] += len(result)
+    return result, report
+
+
+def _is_numeric(field):
+    try:
+        [float(value) for value in field.split(b';')]
+        return True
+    except ValueError:
+        return False
+
+
+def new_report():
+    """Counters of a parsing : lines read, lines converted and malformed lines per reason"""
+    return {'lines': 0, 'parsed': 0, 'malformed': {'field count': 0, 'timestamp': 0, 'value': 0}}
+
+
+def parse_file(path, chunk_size=32 * 1024 * 1024):
+    """
+    Convert a live values file or an archived dump, read by chunks to limit the memory used
+    :param path: File to read
+    :param chunk_size: Number of bytes converted at once
+    :return: numpy structured array of DTYPE and the report of the parsing
+    """
+    report = new_report()
+    parts = []
+    rest = b''
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            cut = chunk.rfind(b'\n') + 1  # an incomplete last line is kept for the next chunk
+            rest = chunk[cut:]
+            if cut:
+                parts.append(parse(chunk[:cut], report)[0])
+    if rest:
+        parts.append(parse(rest, report)[0])
+    return (numpy.concatenate(parts) if parts else numpy.zeros(0, dtype=DTYPE)), report
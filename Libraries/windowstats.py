@@ -0,0 +1,157 @@
+import math
+import bisect
+import threading
+from collections import deque
+import numpy
+
+SPANS = (30, 120, 600)  # windows in second : 30 s, 2 min, 10 min
+# Channels followed by default : currents, voltages, powers and power factors of the SmartPi
+CHANNELS = ("I1", "I2", "I3", "I4", "V1", "V2", "V3", "P1", "P2", "P3", "Cos1", "Cos2", "Cos3")
+QUANTILES = (0.05, 0.5, 0.95)  # given by summary()
+
+
+class Window:
+
+    """Statistics of the samples of the last 'span' seconds, updated for each sample :
+    running sum for the mean, EWMA, monotonic deques for min/max and sorted values for the quantiles"""
+
+    def __init__(self, span, channels):
+        self.span = span
+        self.channels = channels
+        self.samples = deque()  # (timestamp, values) inside the window
+        self.sum = numpy.zeros(channels)
+        self.ewma = None
+        self.last = None  # timestamp of the newest sample
+        # per channel : (timestamp, value) with increasing values for the min, decreasing ones for the max
+        self.mins = [deque() for i in range(channels)]
+        self.maxs = [deque() for i in range(channels)]
+        self.sorted = [[] for i in range(channels)]  # values inside the window, sorted, per channel
+
+    def add(self, timestamp, values):
+        # EWMA with the span as time constant, the weight follows the real time between the samples
+        if self.ewma is None:
+            self.ewma = values.copy()
+        else:
+            alpha = 1 - math.exp(-max(timestamp - self.last, 0) / self.span)
+            self.ewma += alpha * (values - self.ewma)
+        self.last = timestamp
+
+        # Samples leaving the window
+        limit = timestamp - self.span
+        while self.samples and self.samples[0][0] <= limit:
+            old = self.samples.popleft()[1]
+            self.sum -= old
+            for c in range(self.channels):
+                column = self.sorted[c]
+                del column[bisect.bisect_left(column, old[c])]
+        for queue in self.mins + self.maxs:
+            while queue and queue[0][0] <= limit:
+                queue.popleft()
+
+        # New sample
+        self.samples.append((timestamp, values))
+        self.sum += values
+        for c, value in enumerate(values.tolist()):
+            bisect.insort(self.sorted[c], value)
+            queue = self.mins[c]
+            while queue and queue[-1][1] >= value:
+                queue.pop()
+            queue.append((timestamp, value))
+            queue = self.maxs[c]
+            while queue and queue[-1][1] <= value:
+                queue.pop()
+            queue.append((timestamp, value))
+
+    def __len__(self):
+        return len(self.samples)
+
+    def mean(self):
+        return self.sum / len(self.samples)
+
+    def min(self):
+        return numpy.array([queue[0][1] for queue in self.mins])
+
+    def max(self):
+        return numpy.array([queue[0][1] for queue in self.maxs])
+
+    def quantile(self, q):
+        """Nearest-rank quantile of each channel, 0 <= q <= 1"""
+        index = min(int(q * len(self.samples)), len(self.samples) - 1)
+        return numpy.array([column[index] for column in self.sorted])
+
+
+class WindowStats:
+
+    """Several windows over the same measures, every statistic is read in constant time"""
+
+    def __init__(self, names, spans=SPANS, channels=CHANNELS):
+
+        """
+        :param names: Names of the columns of the values given to add() / extend()
+        :param spans: Length of the windows in second
+        :param channels: Names of the columns followed
+        """
+
+        self.names = list(channels)
+        self.columns = [list(names).index(name) for name in channels]
+        self.windows = dict((span, Window(span, len(self.columns))) for span in spans)
+        self.horizon = 5 * max(spans)  # older samples weigh less than 1 % in the EWMA
+        self.lock = threading.Lock()
+
+    def add(self, timestamp, values):
+        """
+        :param timestamp: epoch in second, not older than the previous sample
+        :param values: one value per column of 'names'. A sample with a NaN or an infinite value in a followed
+            channel is ignored : it cannot be ordered in the sorted values, and it would stay in the sums
+        :return: False when the sample is ignored
+        """
+        values = numpy.asarray(values, dtype=numpy.float64)[self.columns]
+        if not numpy.isfinite(values).all():
+            return False
+        with self.lock:
+            for window in self.windows.values():
+                window.add(timestamp, values)
+        return True
+
+    def extend(self, timestamps, values):
+        """Several samples, a line per sample. Only those of the last 'horizon' seconds are used, and like in add()
+        the ones with a non-finite value are ignored"""
+        if not len(timestamps):
+            return
+        first = numpy.searchsorted(timestamps, timestamps[-1] - self.horizon, side='right')
+        values = numpy.asarray(values, dtype=numpy.float64)[first:, self.columns]
+        finite = numpy.isfinite(values).all(axis=1)
+        timestamps, values = numpy.asarray(timestamps)[first:][finite], values[finite]
+        with self.lock:
+            for timestamp, row in zip(timestamps.tolist(), values):
+                for window in self.windows.values():
+                    window.add(timestamp, row)
+
+    def get(self, statistic, span, channel=None, q=0.5):
+        """
+        :param statistic: 'mean', 'ewma', 'min', 'max' or 'quantile' (with q)
+        :param span: one of the spans
+        :param channel: name of a channel for a float, None for an array of all of them
+        :return: None when the window is empty
+        """
+        with self.lock:
+            window = self.windows[span]
+            if not len(window):
+                return None
+            if statistic == 'ewma':
+                values = window.ewma.copy()
+            elif statistic == 'quantile':
+                values = window.quantile(q)
+            else:
+                values = getattr(window, statistic)()
+        return values if channel is None else float(values[self.names.index(channel)])
+
+    def summary(self, span):
+        """dict channel -> dict of every statistic of the window (for the logs)"""
+        values = dict((statistic, self.get(statistic, span)) for statistic in ('mean', 'ewma', 'min', 'max'))
+        if values['mean'] is None:
+            return {}
+        for q in QUANTILES:
+            values['p{:g}'.format(q * 100)] = self.get('quantile', span, q=q)
+        return dict((name, dict((statistic, float(array[i])) for statistic, array in values.items()))
+                    for i, name in enumerate(self.names))
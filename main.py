@@ -1,218 +1,445 @@
-import sys, time, sched, threading
+import os, sys, time, asyncio, calendar, threading
 from datetime import datetime
 from Libraries import SmartPi
 from Libraries import evbox
+from Libraries import rs485
+from Libraries import maxprotocol
+from Libraries import allocator
+from Libraries import commandcache
+from Libraries import policies
+from Libraries import config
+from Libraries import modeswitch
+from Libraries import metrics
+from Libraries import snapshot
+from Libraries import sources
+from Libraries import meters
+from Libraries import runtime as controlruntime
+from Libraries import logwriter
+from Libraries import tsstore
 import RPi.GPIO as GPIO
-import json
-import serial
 import math
 
 # Initialisations
 # --------------------------------------------------
-settings_file = '/boot/SmatchatHome_config.json'
+# SMATCHATHOME_CONFIG overrides the path, to run the controller with other settings (tests, emulator)
+settings_file = os.environ.get('SMATCHATHOME_CONFIG', '/boot/SmatchatHome_config.json')
+# Validated settings, settings.current is replaced when the file changes (see reload_settings)
+settings = config.ConfigFile(settings_file, lambda reason: log(
+    "Settings file rejected, the previous settings stay in use : " + reason.replace('\n', ' ; '), 'logfile'))
 
+# Debug flag to show intermediate results or not
+debug = True
 
-def load_settings():
-    f = open(settings_file)
-    parameters = json.load(f)
-    f.close()
-    return parameters
-
+# Asyncio runtime of the measurement, control and serial tasks (None when not running)
+runtime = None
 
-params = load_settings()
+# Meters of the site, see Libraries/meters.py (built at startup from the 'Meters' and 'Source' settings)
+site = None
 
-# Debug flag to show intermediate results or not
-debug = True
+# Log files are written by a background thread, see the 'Log' part of the settings
+logging_params = settings.current.Log
+writer = logwriter.LogWriter(flush_interval=logging_params.flushInterval,
+                             flush_size=logging_params.flushSize,
+                             max_size=logging_params.maxSize,
+                             daily=logging_params.daily,
+                             backups=logging_params.backups,
+                             silent=logging_params.silent)
+writer.start()
+SmartPi.writer = writer
 
-# Initialisation of the threading
-s = sched.scheduler(time.time, time.sleep)
-station_management = {}
+# Columnar storage of the measures, commands and connector readings, with 1 min / 15 min / 1 h rollups
+store = tsstore.TimeSeriesStore(settings.current.Store.path)
 
 # Initialize GPIOs for mode switching
 GPIO.setmode(GPIO.BOARD)
 Btn_9 = 21
 Btn_10 = 19
 GPIO.setup([Btn_9, Btn_10], GPIO.IN, pull_up_down=GPIO.PUD_UP)
+# Levels of (Btn_9, Btn_10) for each mode, the 4th position (0, 0) is undefined and keeps the current mode
+# - Charging only from local PV with first priority
+# - Charging only from local PV with low priority
+# - Power limitation according to the max consumption of the house
+switch = modeswitch.ModeSwitch(GPIO, (Btn_9, Btn_10), {(0, 1): "PV_High-priority", (1, 1): "PV_Low-priority",
+                                                       (1, 0): "Peak-shaving"}, "Peak-shaving")
 
 # Initialisation of the Smatch @ Home algorithms
-mode = "Peak-shaving"
+mode = switch.mode
 iStation = 0
 order = 0
-station = evbox.EVBox()
+station = evbox.EVBox(settings.current.Serial.interByteTimeout, settings.current.Serial.answerDeadline)
+# The RS485 port is opened once and kept open, it is reopened with a backoff if the adapter disappears
+bus = rs485.SerialSession(settings.current.Serial.asdict())
+# Modems on the bus (hex addresses in the settings), the order is shared between all their ChargeBoxes
+addresses = list(settings.current.EVBox.addresses)
+# Last command and answer of each modem : an unchanged order is not sent again before the keep-alive
+commands = commandcache.CommandCache(settings.current.EVBox.deadband, settings.current.EVBox.keepAliveMargin)
+stations = commands.responses  # address -> last maxprotocol.StationResponse of the modem
+scheduler = allocator.BusScheduler(addresses)
+snapshot_saved = 0  # time.monotonic() of the last snapshot
+snapshot_thread = None
+pending = False  # a command computed by control() is waiting for the bus or being sent
+
+
+# Metrics of the control cycle, see Libraries/metrics.py for the endpoint
+control_time = metrics.histogram('td2c_control_seconds', 'Computation of the command by control()')
+cycle_time = metrics.histogram('td2c_cycle_seconds', 'From the start of control() to the handling of the answers')
+results = metrics.counter('td2c_evbox_results_total', 'Exchanges with the modems by result, ok or error code',
+                          ['address', 'result'])
+decisions = metrics.counter('td2c_commands_total', 'Commands per modem : new, changed, keepalive or skipped',
+                            ['address', 'reason'])
+triggers = metrics.counter('td2c_triggers_total', 'Cycles triggered before the RefreshF boundary', ['reason'])
+order_gauge = metrics.gauge('td2c_order_amperes', 'Last order computed (current available per phase)')
+station_gauge = metrics.gauge('td2c_station_power_watts', 'Power used by the stations at their last answers')
 
 
 def log(line, filename):
-    f = open(filename + '.txt', 'a')
-    f.write(str(datetime.now()) + ': ' + line + '\n')
-    f.close()
-    print(str(datetime.now()) + ': ' + line)
+    # queued for the writer thread : batched writes, rotation, and no print in silent mode
+    writer.write(filename + '.txt', str(datetime.now()) + ': ' + line)
 
 
 def getmode():
+    """Mode of the switches, published by their edge callbacks (the pins are read here only without them)"""
     global mode
-    if GPIO.input(Btn_9) == 0 and GPIO.input(Btn_10) == 1:
-        # Charging only from local PV with first priority
-        if mode != "PV_High-priority":
-            log("Mode changed from " + mode + " to PV_High-priority", 'logfile')
-            mode = "PV_High-priority"
-        return mode
-    elif GPIO.input(Btn_9) == 1 and GPIO.input(Btn_10) == 1:
-        # Charging only from local PV with low priority
-        if mode != "PV_Low-priority":
-            log("Mode changed from " + mode + " to PV_Low-priority", 'logfile')
-            mode = "PV_Low-priority"
-        return mode
-    elif GPIO.input(Btn_9) == 1 and GPIO.input(Btn_10) == 0:
-        # Power limitation according to the max consumption of the house
-        if mode != "Peak-shaving":
-            log("Mode changed from " + mode + " to Peak-shaving", 'logfile')
-            mode = "Peak-shaving"
-        return mode
-    else:
-        return -1
+    mode = switch.mode if switch.edges else switch.refresh()
+    return mode
+
+
+def mode_changed(old, new):
+    # from the GPIO thread : the charger follows the new mode without waiting the next RefreshF boundary
+    log("Mode changed from " + old + " to " + new, 'logfile')
+    if runtime is not None:
+        triggers.labels('mode').inc()
+        runtime.trigger()
+
+
+switch.on_change = mode_changed
 
 
 def SinaB():
-    global mode,  order, iStation, station_management
-    # New inscription to the scheduler
+    """One complete control cycle : compute the order, send it to the EV-Box modems and analyse their answers"""
+    command = control()
+    handle_response(command, sendto_stations(command))
+
+
+def getmeasures():
+    """
+    Site view of the meters over the last RefreshF minutes : mean of their buffered measures aligned on the same
+    window, or their EWMA over the 'smoothing' window (read in constant time).
+    With 'triggerThreshold' set, every cycle takes the mean of the shortest window of the statistics instead :
+    a RefreshF cycle computing the order on the slow mean would raise back an order a trigger has just cut
+    :return: (timestamp, iBatt, iPV, iConso), now and zeros when there is no measure
+    """
+    cfg = settings.current
+    if cfg.SinaB.triggerThreshold:
+        measures = site.measures(cfg.SinaB.windows[0], 0, cfg.Meters.combine, cfg.Meters.maxSkew)
+    else:
+        measures = site.measures(cfg.SinaB.RefreshF * 60, cfg.SinaB.smoothing, cfg.Meters.combine,
+                                 cfg.Meters.maxSkew)
+    if measures is None:
+        if debug: print("No measure from the meters")
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 0, 0, 0
+    return measures
+
+
+def control_law(mode, iBatt, iPV, iConso):
+    """
+    Current the charge is allowed to use on each phase for a mode, no I/O (see Libraries/policies.py)
+    :return: order in A, not below 0 (poleMax is applied to each connector by the allocator)
+    """
+    return policies.order(mode, iBatt, iPV, iConso, iStation, settings.current.SinaB.MaxConsoCurrent)
+
+
+def control():
+    """
+    Compute the order of the charging station from the measures and the mode, without any I/O on the bus
+    :return: dict with the measures used, the order in A (current available for the charge on each phase),
+        the modems of the cycle, the limits per phase of each modem and the messages to send to them
+    """
+    global mode, order, pending
+    started = time.perf_counter()
+    reload_settings()
+    cfg = settings.current  # one version of the settings for the whole cycle
     log('Next EV-Box command at: ' + time.ctime(get_next_timestamp()), 'logfile')
-    station_management = s.enterabs(get_next_timestamp(), 2, SinaB, ())
     if debug: print("SinaB launched !")
 
-    # Set constant for house
-    iMaxHouse = params['SinaB']['MaxConsoCurrent']
-
     # Get measurements
-    measures = thread_measure.getmean()
-    timestamp, iBatt, iPV, iConso = datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 0, 0, 0
-    if measures != -1:
-        timestamp = measures[0]
-        iBatt = measures[1]     # CT connected to I1 terminal also plugged on the battery phase
-        iPV = abs(measures[2])       # CT connected to I2 terminal also connected on the PV inverter output phase
-        iConso = abs(measures[3])  # CT connected to I3 also connected on the main line phase
-        if debug: print("{} : iBatt={} iPV={} iConso={}".format(timestamp, iBatt, iPV, iConso))
-    else:
-        if debug: print("SmartPi.getmean() returned -1")
+    timestamp, iBatt, iPV, iConso = getmeasures()
+    if debug: print("{} : iBatt={} iPV={} iConso={}".format(timestamp, iBatt, iPV, iConso))
 
     # Set constant for EVBox stations
-    poleMin = params['EVBox']['poleMin']
-    poleMax = params['EVBox']['poleMax']
-    timeout = params['EVBox']['timeout']
-    defaultCurrent = params['EVBox']['defaultCurrent']
+    poleMin = cfg.EVBox.poleMin
+    poleMax = cfg.EVBox.poleMax
+    timeout = cfg.EVBox.timeout
+    defaultCurrent = cfg.EVBox.defaultCurrent
     if debug: print("poleMin={} poleMax={} timeout={} defaultCurrent={}".format(poleMin, poleMax, timeout, defaultCurrent))
 
     # Get button position
     mode = getmode()
     if debug: print("Control mode selected : {}".format(mode))
-
-    # The next calculus are taking the following assumptions, they are required for a normal working
-    # - iBatt, from i1 on the Smatch Box is connected to the phase of the battery,
-    #   the arrow of the current sensor show current flow when the battery is DISCHARGING
-    # - iPV, from i2 on the Smatch Box is connected to the phase of the PV inverter
-    #   as it is only production, the sens of the clamp is not important, however, it should indicate the prod flow
-    # - iConso, from i3 on the Smatch Box is connected to the sub-circuit part that contains ONLY CONSUMPTION
-    #   as it is only consumption, the sens of the clamp is not important, however, it should indicate the prod flow
-    order = 0
-    if mode == "PV_High-priority":
-        print("PV_High-priority")
-        # calculation of the max current allowed to send to the pole
-        # Rule = The max current the charging station is allowed to use
-        # is equal to the instant PV production measured at the output of the inverter.
-
-        # if we accept to take a bit on the grid at a low current, uncomment below
-        # if iPV < poleMin and iConso < iMaxHouse + iPV:
-        #    order = poleMin
-        # else:
-        order = iPV
-
-    elif mode == "PV_Low-priority":
-        print("PV_Low-priority")
-        # calculation of the max current allowed to send to the pole
-        # Rule = The max current the charging station is allowed to use
-        # is equal to the instant PV production,
-        # minus the house consumption, minus the battery charging.
-        if iBatt > 0:  # battery is discharging
-            # The discharge of the battery is not PV production, it doesn't enter in account
-            # The own current of the station is removed from the total consumption
-            order = iPV - iConso + iStation
+    order = control_law(mode, iBatt, iPV, iConso)
+
+    # Share the order between the ChargeBoxes of every modem, phase by phase, keeping their minimum current
+    connectors = allocator.connectors(addresses, stations, poleMin, poleMax, cfg.EVBox.priorities)
+    grants = allocator.allocate([order] * allocator.PHASES, connectors, cfg.EVBox.allocation)
+    limits = allocator.station_limits(addresses, grants)
+    if debug: print("order={}A - limits={} - defaultcurrent={}A".format(order, limits, defaultCurrent))
+
+    # build the payloads, currents are sent in a tenth of A : 16 A -> 160 dA
+    messages = {}
+    for address, (l1, l2, l3) in limits.items():
+        messages[address] = maxprotocol.encode_words((l1 * 10, l2 * 10, l3 * 10, timeout,
+                                                      defaultCurrent * 10, defaultCurrent * 10, defaultCurrent * 10))
+    order_gauge.set(order)
+    control_time.observe(time.perf_counter() - started)
+    pending = True
+    return {'timestamp': timestamp, 'iBatt': iBatt, 'iPV': iPV, 'iConso': iConso, 'order': order,
+            'addresses': list(addresses), 'limits': limits, 'messages': messages, 'timeout': timeout,
+            'defaults': (defaultCurrent,) * 3, 'started': started}
+
+
+def handle_response(command, responses):
+    """
+    Analyse the answers of the EV-Box modems to a command built by control()
+    :param responses: dict address -> StationResponse or error string, see sendto_stations()
+    """
+    global iStation, pending
+    pending = False
+    timestamp, iBatt, iPV, iConso = [command[key] for key in ('timestamp', 'iBatt', 'iPV', 'iConso')]
+    if debug: print("EVBox answers are {}".format(responses))
+
+    # EVBox responses analyse
+    answered = False
+    for address, response in responses.items():
+        if address not in addresses:
+            continue  # removed by a reload of the settings during the exchange
+        scheduler.done(address, response)
+        # the last answer goes in stations, here in the loop where it is read
+        commands.done(address, command['limits'][address], command['timeout'], command['defaults'], response,
+                      command['sent'][address])
+        results.labels("{:02X}".format(address), "ok" if isinstance(response, maxprotocol.StationResponse)
+                       else response.split(' ', 1)[0]).inc()
+        if isinstance(response, maxprotocol.StationResponse):
+            answered = True
+            if debug: print("Number of connectors associated to modem {:02X} : {}".format(address, len(response.boxes)))
+            log("EV-Box {:02X} answer : {}".format(address, response.boxes), 'logfile')
         else:
-            # The battery also charge on PV it has priority in that case
-            # The own current of the station is removed from the total consumption
-            order = iPV - iConso + iBatt + iStation
-
-    else:  # self.mode == "Peak-shaving":
-        print("Peak-shaving")
-        # calculation of the max current to send to the pole
-        # Rule = The max current the charging station is allowed to use
-        # is equal to the max current allowed by the grid, minus the current consumption.
-        order = iMaxHouse - iConso + iStation
-
-    # Verification of the order
-    if order > poleMax:  # there is more power than what the station can deliver
-        order = poleMax
-    if order < 0:  # there is no power for car :(
-        order = 0
-
-    if debug: print("order={}A - defaultcurrent={}A".format(order, defaultCurrent))
-    # build the payload
-    order *= 10  # value need to be in a tenth of A : 16 A -> 160 dA
-    defaultCurrent *= 10
-    message = "%0.4X" % order + "%0.4X" % order + "%0.4X" % order + "%0.4X" % \
-              timeout + "%0.4X" % defaultCurrent + "%0.4X" % defaultCurrent + "%0.4X" % defaultCurrent
-    response = sendto_evbox(message)
-    if debug: print("EVBox answer is {}".format(response))
-
-    # EVBox response analyse
-    if response[:6] == "A08069":
-        # intro = result[:6]  # sender - receiver - command
-        # timeout = int(result[6:10], 16)  # timeout in second
-        # maxsetcurrent = int(result[10:14], 16) / 10  # max charging current per phase converted form hex  A/10
-        nbconnectors = int(response[14:16], 16)  # Nb charging point managed by the master
-        if debug: print("Number of connectors associated to this modem : {}".format(nbconnectors))
-
-        p = 16  # Position of the first relevant data
-        connector = [[0 for j in range(8)] for i in range(nbconnectors)]
-
-        for i in range(0, nbconnectors):  # in our case, only one
-            connector[i][0] = int(response[p:p + 4], 16) / 10  # minimum current
-            connector[i][1] = int(response[p + 4:p + 8], 16) / 10  # actual charging current on L1
-            connector[i][2] = int(response[p + 8:p + 12], 16) / 10  # actual charging current on L2
-            connector[i][3] = int(response[p + 12:p + 16], 16) / 10  # actual charging current on L3
-            connector[i][4] = int(response[p + 16:p + 20], 16) / 1000  # actual power factor on L1
-            connector[i][5] = int(response[p + 20:p + 24], 16) / 1000  # actual power factor on L2
-            connector[i][6] = int(response[p + 24:p + 28], 16) / 1000  # actual power factor on L3
-            connector[i][7] = int(response[p + 28:p + 36], 16)  # Watt hour meter value
-            iStation = 230 * (
-                    connector[0][1] * connector[0][4] +
-                    connector[0][2] * connector[0][5] +
-                    connector[0][3] * connector[0][6])
-        log("EV-Box answer : " + str(connector), 'logfile')
-        log("{};{};{};{};{};{};{};{}".format(timestamp, "measures", 0, 0, 0, iBatt, iPV, iConso), 'KPI')
-        log("{};{};{};{};{};{};{};{}".format(timestamp, "EVCmd", 0, 0, 0, order, order, order), "KPI")
-        # the result is an error
+            # the result is an error
+            log("EV-Box {:02X} answer : {}".format(address, response), 'logfile')
+    cycle_time.observe(time.perf_counter() - command['started'])
+    if not answered and not command.get('skipped'):
+        return  # nothing in force is known for this cycle, a cycle with an unchanged order is kept
+    # own consumption of the stations, on all their connectors (last known one of a modem that did not answer),
+    # as the current the consumption clamp sees on its phase
+    iStation = policies.station_current(stations.values(), settings.current.EVBox.measuredPhase - 1)
+    station_gauge.set(sum(station.power() for station in stations.values()))
+    totals = [round(sum(limit[p] for limit in command['limits'].values()), 1) for p in range(allocator.PHASES)]
+    log("{};{};{};{};{};{};{};{}".format(timestamp, "measures", 0, 0, 0, iBatt, iPV, iConso), 'KPI')
+    log("{};{};{};{};{};{};{};{}".format(timestamp, "EVCmd", 0, 0, 0, *totals), "KPI")
+    if len(command['limits']) > 1:
+        for address, limit in command['limits'].items():
+            log("{};{};{};{};{};{};{};{}".format(timestamp, "EVCmd{:02X}".format(address), 0, 0, 0, *limit), "KPI")
+    savecycle(timestamp, iBatt, iPV, iConso, totals,
+              [(address, response.boxes) for address, response in sorted(stations.items())])
+    if time.monotonic() - snapshot_saved >= settings.current.Snapshot.interval:
+        savesnapshot()
+
+
+def savecycle(timestamp, iBatt, iPV, iConso, totals, stations):
+    # totals : limits sent per phase, summed on all the modems
+    # stations : list of (modem address, its ChargeBoxes), a box is stored as connector address * 100 + index
+    # epoch of the SmartPi local time, like the measures buffer (now when there was no measure)
+    if isinstance(timestamp, datetime):
+        epoch = calendar.timegm(timestamp.timetuple())
     else:
-        log("EV-Box answer : " + response, 'logfile')
-
-
-def sendto_evbox(payload):
-
-    RS485 = serial.Serial(
-        port=params['Serial']['port'],
-        baudrate=params['Serial']['baudrate'],
-        bytesize=params['Serial']['bytesize'],
-        parity=params['Serial']['parity'],
-        stopbits=params['Serial']['stopbits'],
-        timeout=params['Serial']['timeout'],
-        writeTimeout=params['Serial']['writeTimeout']
-    )
+        epoch = calendar.timegm(time.localtime())
+    try:
+        store.append('measures', epoch, [iBatt, iPV, iConso])
+        store.append('commands', epoch, totals)
+        for address, boxes in stations:
+            for i, box in enumerate(boxes):
+                store.append('connectors', epoch, [address * 100 + i] + box.tolist())
+    except ValueError as e:  # clock moved backward, the store is append-only
+        log("Cycle not stored : " + str(e), 'logfile')
+
+
+def reload_settings():
+    """
+    Take the settings file again if it changed and is valid, without restarting anything : the measures buffer
+    is kept (its size stays the one of the startup RefreshF), the log files and the store stay where they are
+    """
+    global addresses, scheduler
+    previous = settings.current
+    if not settings.check():
+        return
+    cfg = settings.current
+    log("Settings reloaded from " + settings_file, 'logfile')
+    station.interbyte_timeout = cfg.Serial.interByteTimeout
+    station.deadline = cfg.Serial.answerDeadline
+    if cfg.Serial != previous.Serial:
+        bus.reconfigure(cfg.Serial.asdict())
+    if cfg.EVBox.addresses != previous.EVBox.addresses:
+        addresses = list(cfg.EVBox.addresses)
+        scheduler = allocator.BusScheduler(addresses)
+        for address in list(stations):
+            if address not in addresses:
+                commands.forget(address)
+    commands.deadband = cfg.EVBox.deadband
+    commands.margin = cfg.EVBox.keepAliveMargin
+    writer.flush_interval = cfg.Log.flushInterval
+    writer.flush_size = cfg.Log.flushSize
+    writer.max_size = cfg.Log.maxSize
+    writer.daily = cfg.Log.daily
+    writer.backups = cfg.Log.backups
+    writer.silent = cfg.Log.silent
+
+
+def on_measure(count):
+    """
+    Called by the SmartPi thread after new measures are stored : with 'triggerThreshold' set, a cycle runs at once
+    when the order moved by this many A since the last command, instead of at the next RefreshF boundary
+    (the runtime still waits for the minimum interval announced by the EV-Box). The move is seen on the shortest
+    window of the statistics, see getmeasures()
+    """
+    reload_settings()
+    threshold = settings.current.SinaB.triggerThreshold
+    if not threshold or runtime is None:
+        return
+    timestamp, iBatt, iPV, iConso = getmeasures()
+    new_order = control_law(mode, iBatt, iPV, iConso)
+    # above what all the connectors can take, a move of the order does not change the limits
+    capacity = settings.current.EVBox.poleMax * len(allocator.connectors(addresses, stations, 0, 0))
+    if abs(min(new_order, capacity) - min(order, capacity)) >= threshold:
+        if debug: print("Order moved from {}A to {}A, control cycle triggered".format(order, new_order))
+        triggers.labels('order').inc()
+        runtime.trigger()
+
+
+def min_interval():
+    """Minimum time in second between two commands, the largest one announced by the modems"""
+    return max([response.min_interval for response in stations.values()] or [0])
+
+
+def measuresource(cfg):
+    """Source of the measures from the 'Source' section of the settings"""
+    if cfg.type == "stream":
+        return sources.StreamSource(cfg.url)
+    if cfg.type == "modbus":
+        return sources.ModbusSource(cfg.host, cfg.port, cfg.unit, cfg.interval, cfg.registers)
+    return sources.FileSource(cfg.path)
+
+
+def buildsite(cfg):
+    """Meters of the 'Meters' settings, or the 'Source' one wired like the Smatch Box"""
+    described = cfg.Meters.meters or [{'name': "main", 'source': cfg.Source, 'channels': meters.CHANNELS}]
+    answer = []
+    for meter in described:
+        # a buffer of RefreshF minutes : the timestamps are in second, a meter stores one measure per second at most
+        measure = SmartPi.SmartPi(5, cfg.SinaB.RefreshF * 60, watch=True, spans=cfg.SinaB.windows)
+        measure.on_measure = on_measure
+        measure.file_to_watch = meter['source'].path
+        measure.source = measuresource(meter['source'])
+        answer.append(meters.Meter(meter['name'], measure, meter['channels']))
+    return meters.Site(answer)
+
+
+def savesnapshot(wait=False):
+    """Save the warm restart state : the values are taken here, the file is written by a background thread
+    (an fsync on the SD card must not delay the loop)"""
+    global snapshot_saved, snapshot_thread
+    path = settings.current.Snapshot.path
+    if not path or (snapshot_thread is not None and snapshot_thread.is_alive()):
+        return
+    buffers = [meter.measure.buffer.get(None, None) + (meter.measure.last_measure,) for meter in site.meters]
+    snapshot_saved = time.monotonic()
+    snapshot_thread = threading.Thread(target=writesnapshot, name="snapshot", daemon=True, args=(
+        path, buffers, dict(stations), iStation, order))
+    snapshot_thread.start()
+    if wait:
+        snapshot_thread.join()
+
+
+def writesnapshot(path, *state):
+    try:
+        snapshot.save(path, *state)
+    except OSError as e:
+        log("Snapshot not saved : " + str(e), 'logfile')
+
+
+def restoresnapshot():
+    """At startup : measures, modem answers and controller state of the last run if they are recent enough,
+    so that the first cycle does not compute the order from zeros"""
+    global iStation, order
+    cfg = settings.current.Snapshot
+    if not cfg.path:
+        return
+    try:
+        state = snapshot.load(cfg.path, cfg.maxAge)
+    except (OSError, ValueError) as e:
+        log("Snapshot ignored : " + str(e), 'logfile')
+        return
+    if state is None:
+        return
+    if [buffer['data'].shape[1] for buffer in state['buffers']] != \
+            [meter.measure.buffer.channels for meter in site.meters]:
+        log("Snapshot ignored : saved with other meters", 'logfile')
+        return
+    for meter, buffer in zip(site.meters, state['buffers']):
+        meter.measure.restore(buffer['timestamps'], buffer['data'], buffer['last_measure'])
+    stations.update((address, response) for address, response in state['responses'].items() if address in addresses)
+    iStation = state['iStation']
+    order = state['order']
+    log("Snapshot of {} restored : {} measures, {} modem answers, order {}A".format(
+        time.ctime(state['saved']), sum(len(buffer['timestamps']) for buffer in state['buffers']),
+        len(state['responses']), order), 'logfile')
+
+
+def sendto_stations(command):
+    """
+    Send its limits to each modem due this cycle whose order moved more than the deadband, or whose keep-alive
+    is due, one after the other on the bus (blocking)
+    :return: dict address -> StationResponse or error string, for the modems called only
+    """
+    answers = {}
+    for address in scheduler.due():
+        if address not in command['addresses']:
+            continue  # added by a reload of the settings after the command was computed, it has no limits
+        limits = command['limits'][address]
+        reason = commands.reason(address, limits, command['timeout'], command['defaults'])
+        decisions.labels("{:02X}".format(address), reason or 'skipped').inc()
+        if reason is None:
+            if debug: print("EV-Box {:02X} : order unchanged, not sent".format(address))
+            command.setdefault('skipped', []).append(address)
+            continue
+        command.setdefault('sent', {})[address] = time.monotonic()  # recorded by handle_response()
+        answers[address] = sendto_evbox(command['messages'][address], address)
+    return answers
+
+
+def sendto_evbox(payload, address=maxprotocol.MODEM):
 
     # Sending order to the charging station
-    result = station.setmaxcurrent(payload, RS485)
+    result = station.setmaxcurrent(payload, bus, address)
     return result
 
 
+def next_deadline():
+    """
+    Epoch of the next control cycle : the RefreshF boundary, or the first keep-alive due before it. While a command
+    is waiting for the bus or being sent, it is the keep-alive : the cycle would only compute it again
+    """
+    deadline = get_next_timestamp()
+    if pending:
+        return deadline
+    now = time.monotonic()
+    for address, due in commands.keepalives().items():
+        if address in scheduler.not_before:
+            due = max(due, scheduler.not_before[address])  # not before the minimum interval of the modem
+        deadline = min(deadline, time.time() + max(due - now, 0))
+    return deadline
+
+
 def get_next_timestamp():
-    poll = params['SinaB']['RefreshF']
+    poll = settings.current.SinaB.RefreshF
     startTime = time.localtime()
     delta = (-(startTime.tm_min % poll) + poll - 1) * 60 + (60 - startTime.tm_sec)
     return math.floor(time.mktime(time.localtime()) + delta)
@@ -224,22 +451,29 @@ if __name__ == "__main__":
             log('Started script at' + time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()), 'logfile')
             log('timestamp;Id;vL1;vL2;vL3;iL1;iL2;iL3', 'KPI')
 
-            # Launching of the current measurement thread :
-            # initialisation of a frame 2 times bigger then the refresh frequency to get moving mean
-            thread_measure = SmartPi.SmartPi(5, params['SinaB']['RefreshF']*12)  # 24 for moving mean
-            thread_measure.daemon = True
-            thread_measure.start()
-            if debug: print("thread measure launched")
+            # Current measurement : every meter of the site is read by its own source (by default the values
+            # file, read each time the SmartPi daemon rewrites it)
+            site = buildsite(settings.current)
+            restoresnapshot()
+            if settings.current.Metrics.listen:
+                try:
+                    metrics.serve(settings.current.Metrics.listen)
+                except OSError as e:  # address in use, no right on the socket : the control goes on without it
+                    log("Metrics endpoint not started : " + str(e), 'logfile')
 
             # Launching of the charging station control routine :
-            # Launch SinaB method every minute
-            nexttimestamp=get_next_timestamp()
-            if debug: print("Next timestamp : {}".format(datetime.fromtimestamp(nexttimestamp).strftime('%Y-%m-%d %H:%M:%S')))
-            station_management = s.enterabs(nexttimestamp, 1, SinaB, ())
-            if debug: print("Thread SinaB ready to be run")
-            s.run()
-            if debug: print("station_management launched, next run at :" +
-                            str(datetime.fromtimestamp(nexttimestamp).strftime('%Y-%m-%d %H:%M:%S')))
+            # SinaB cycle at every RefreshF boundary, the bus exchange runs in a worker thread
+            runtime = controlruntime.ControlRuntime(site, control, sendto_stations, handle_response,
+                                                    next_deadline, min_interval)
+            if debug: print("Next timestamp : {}".format(datetime.fromtimestamp(get_next_timestamp()).strftime('%Y-%m-%d %H:%M:%S')))
+            try:
+                asyncio.run(runtime.run())
+            finally:
+                savesnapshot(wait=True)
+                bus.close()
+                store.flush()
+                writer.close()
+            if debug: print("Runtime stopped")
         elif sys.argv[1] == 'sync':
             print('Synching system')
             pass
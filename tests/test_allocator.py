@@ -0,0 +1,124 @@
+# allocator : max-min fair share, admission on the minimum current, limits per modem and bus scheduling
+import random
+import unittest
+from Libraries import allocator
+from Libraries import maxprotocol
+from Libraries.allocator import Connector
+
+
+def response(*boxes, max_current=32, min_interval=5):
+    """StationResponse of a modem whose ChargeBoxes draw (L1, L2, L3) A"""
+    return maxprotocol.StationResponse(0x80, maxprotocol.MANAGER, maxprotocol.SETMAXCURRENT, min_interval,
+                                       max_current, [maxprotocol.ChargeBox((60, l1 * 10, l2 * 10, l3 * 10,
+                                                                            1000, 1000, 1000, 0))
+                                                     for l1, l2, l3 in boxes])
+
+
+class FillTest(unittest.TestCase):
+
+    def test_water_level(self):
+        self.assertEqual(allocator.fill([0, 0, 0], [10, 10, 10], 12), [4, 4, 4])
+        # the lowest grants are raised first, a limit stops a grant
+        self.assertEqual(allocator.fill([6, 8, 0], [16, 9, 16], 10), [8, 8, 8])
+        self.assertEqual(allocator.fill([6, 8, 0], [16, 9, 16], 15), [10, 9, 10])
+        self.assertEqual(allocator.fill([6, 6], [6, 16], 5), [6, 11])
+        self.assertEqual(allocator.fill([1, 2], [5, 5], 100), [5, 5])
+        self.assertEqual(allocator.fill([1, 2], [5, 5], 0), [1, 2])
+        self.assertEqual(allocator.fill([], [], 10), [])
+
+    def test_random(self):
+        # the whole amount is given, nothing above a limit, and no grant raised above another one below its limit
+        generator = random.Random(1)
+        for i in range(2000):
+            count = generator.randint(1, 6)
+            grants = [generator.choice((0, 6, generator.uniform(0, 16))) for j in range(count)]
+            limits = [g + generator.choice((0, generator.uniform(0, 16))) for g in grants]
+            amount = generator.uniform(0, sum(limits) - sum(grants) + 5)
+            after = allocator.fill(grants, limits, amount)
+            self.assertAlmostEqual(sum(after) - sum(grants), min(amount, sum(limits) - sum(grants)), places=6)
+            for g, l, a in zip(grants, limits, after):
+                self.assertTrue(g - 1e-9 <= a <= l + 1e-9)
+            for a, g in zip(after, grants):
+                if a > g + 1e-9:
+                    self.assertTrue(all(b >= a - 1e-6 or b >= l - 1e-9 for b, l in zip(after, limits)))
+
+
+class AllocateTest(unittest.TestCase):
+
+    def test_fair(self):
+        boxes = [Connector(0x80, 0, 6, 16), Connector(0x81, 0, 6, 16), Connector(0x82, 0, 6, 10)]
+        grants = allocator.allocate([30, 30, 30], boxes)
+        self.assertEqual(grants[0x80, 0], [10, 10, 10])
+        self.assertEqual(grants[0x82, 0], [10, 10, 10])
+        grants = allocator.allocate([36, 36, 36], boxes)
+        self.assertEqual([grants[c.address, c.index][0] for c in boxes], [13, 13, 10])
+
+    def test_minimum_admission(self):
+        # 14 A : two minimums of 6 A fit, the third connector gets nothing instead of less than its minimum
+        boxes = [Connector(0x80, 0, 6, 16), Connector(0x80, 1, 6, 16), Connector(0x81, 0, 6, 16)]
+        grants = allocator.allocate([14, 14, 14], boxes)
+        self.assertEqual(grants[0x80, 0], [7, 7, 7])
+        self.assertEqual(grants[0x80, 1], [7, 7, 7])
+        self.assertEqual(grants[0x81, 0], [0, 0, 0])
+        # below every minimum, nothing at all
+        grants = allocator.allocate([5, 5, 5], boxes)
+        self.assertTrue(all(values == [0, 0, 0] for values in grants.values()))
+
+    def test_priority_and_idle(self):
+        boxes = [Connector(0x80, 0, 6, 16), Connector(0x81, 0, 6, 16, priority=1),
+                 Connector(0x82, 0, 6, 16, active=False)]
+        grants = allocator.allocate([30, 30, 30], boxes)
+        # the priority connector is served first up to its max, an idle one keeps its minimum only
+        self.assertEqual(grants[0x81, 0], [16, 16, 16])
+        self.assertEqual(grants[0x82, 0], [6, 6, 6])
+        self.assertEqual(grants[0x80, 0], [8, 8, 8])
+        # not enough for every minimum : the priority one and the active one are admitted before the idle one
+        grants = allocator.allocate([12, 12, 12], boxes)
+        self.assertEqual((grants[0x81, 0][0], grants[0x80, 0][0], grants[0x82, 0][0]), (6, 6, 0))
+
+    def test_phases(self):
+        # a car on L1 only does not take the current of L2 and L3
+        boxes = [Connector(0x80, 0, 6, 16, phases=(0,)), Connector(0x81, 0, 6, 16)]
+        grants = allocator.allocate([20, 20, 20], boxes)
+        self.assertEqual(grants[0x80, 0], [10, 0, 0])
+        self.assertEqual(grants[0x81, 0], [10, 16, 16])
+
+    def test_resolution(self):
+        grants = allocator.allocate([10, 10, 10], [Connector(0x80, i, 0, 16) for i in range(3)])
+        for value in grants[0x80, 0]:
+            self.assertAlmostEqual(value, 3.3)
+
+
+class ConnectorsTest(unittest.TestCase):
+
+    def test_from_answers(self):
+        responses = {0x80: response((10, 10, 10), (0, 0, 0), max_current=12)}
+        found = allocator.connectors([0x80, 0x81], responses, 6, 16, {"80:1": 2})
+        self.assertEqual([(c.address, c.index, c.active, c.priority) for c in found],
+                         [(0x80, 0, True, 0), (0x80, 1, False, 2), (0x81, 0, True, 0)])
+        self.assertEqual(found[0].max_current, 12)  # lowered to the station max current
+        self.assertEqual(found[2].max_current, 16)  # never answered : poleMax
+
+    def test_station_limits(self):
+        limits = allocator.station_limits([0x80, 0x81], {(0x80, 0): [6, 6, 6], (0x80, 1): [7.5, 7.5, 0]})
+        self.assertEqual(limits, {0x80: [13.5, 13.5, 6], 0x81: [0, 0, 0]})
+
+
+class BusSchedulerTest(unittest.TestCase):
+
+    def test_round_robin(self):
+        scheduler = allocator.BusScheduler([1, 2, 3])
+        self.assertEqual(scheduler.due(0), [1, 2, 3])
+        self.assertEqual(scheduler.due(0), [2, 3, 1])
+
+    def test_backoff_and_interval(self):
+        scheduler = allocator.BusScheduler([1, 2], max_skip=4)
+        scheduler.done(1, "-1 timeout", 0)
+        scheduler.done(1, "-1 timeout", 0)  # second failure : skipped for one cycle
+        scheduler.done(2, response(min_interval=10), 0)
+        self.assertEqual(scheduler.due(5), [])
+        self.assertEqual(scheduler.due(10), [2, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+# Benchmarks : a slower run is a regression only beyond the threshold and the noise of both runs
+import json
+import os
+import tempfile
+import unittest
+from Libraries import benchmark
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_compare(self):
+        baselines = {'a': {'best': 10.0, 'noise': 0.0}, 'b': {'best': 10.0, 'noise': 0.1}}
+        results = {'a': {'best': 12.5, 'noise': 0.0}, 'b': {'best': 12.5, 'noise': 0.1}, 'c': {'best': 1.0, 'noise': 0}}
+        rows = dict((row[0], row) for row in benchmark.compare(results, baselines, 0.2))
+        self.assertEqual(sorted(rows), ['a', 'b'])  # no baseline, no comparison
+        self.assertAlmostEqual(rows['a'][3], 1.25)
+        self.assertTrue(rows['a'][4])
+        self.assertFalse(rows['b'][4])  # 25 % slower, but both runs were 10 % noisy
+
+    def test_timeit(self):
+        result = benchmark.timeit(lambda: sum(range(100)), repeat=3, duration=0.01)
+        self.assertGreater(result['best'], 0)
+        self.assertGreaterEqual(result['noise'], 0)
+
+    def test_load(self):
+        path = os.path.join(tempfile.mkdtemp(), "baseline.json")
+        self.assertEqual(benchmark.load(path), (None, {}))
+        with open(path, "w") as f:
+            json.dump({'host': benchmark.host(), 'results': {'a': {'best': 1.0, 'noise': 0.0}}}, f)
+        self.assertEqual(benchmark.load(path), (benchmark.host(), {'a': {'best': 1.0, 'noise': 0.0}}))
+        with open(path, "w") as f:
+            json.dump({'a': 1.0}, f)  # baselines of the first format, without the host
+        self.assertEqual(benchmark.load(path), (None, {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+# CommandCache : which commands go on the bus again, and when the keep-alives are due
+import unittest
+from Libraries import maxprotocol
+from Libraries.commandcache import CommandCache
+
+ANSWER = maxprotocol.StationResponse(0x80, maxprotocol.MANAGER, maxprotocol.SETMAXCURRENT, 5, 32, [])
+DEFAULTS = (8, 8, 8)
+
+
+class CommandCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = CommandCache(deadband=0.5, margin=10)
+        self.cache.done(0x80, [10, 10, 10], 60, DEFAULTS, ANSWER, 1000)
+
+    def test_new(self):
+        self.assertEqual(self.cache.reason(0x81, [10, 10, 10], 60, DEFAULTS, 1000), 'new')
+        self.assertIs(self.cache.responses[0x80], ANSWER)
+
+    def test_deadband(self):
+        self.assertIsNone(self.cache.reason(0x80, [10, 10, 10], 60, DEFAULTS, 1001))
+        self.assertIsNone(self.cache.reason(0x80, [10.5, 9.5, 10], 60, DEFAULTS, 1001))
+        self.assertEqual(self.cache.reason(0x80, [10.6, 10, 10], 60, DEFAULTS, 1001), 'changed')
+
+    def test_other_words(self):
+        self.assertEqual(self.cache.reason(0x80, [10, 10, 10], 30, DEFAULTS, 1001), 'changed')
+        self.assertEqual(self.cache.reason(0x80, [10, 10, 10], 60, (6, 6, 6), 1001), 'changed')
+
+    def test_start_and_stop(self):
+        # inside the deadband, but a charge stopped or started is always sent
+        self.cache.deadband = 20
+        self.assertEqual(self.cache.reason(0x80, [0, 10, 10], 60, DEFAULTS, 1001), 'changed')
+        self.cache.done(0x80, [0, 0, 0], 60, DEFAULTS, ANSWER, 1001)
+        self.assertEqual(self.cache.reason(0x80, [6, 6, 6], 60, DEFAULTS, 1002), 'changed')
+        self.assertIsNone(self.cache.reason(0x80, [0, 0, 0], 60, DEFAULTS, 1002))
+
+    def test_keepalive(self):
+        self.assertEqual(self.cache.keepalives(), {0x80: 1050})
+        self.assertIsNone(self.cache.reason(0x80, [10, 10, 10], 60, DEFAULTS, 1049.9))
+        self.assertEqual(self.cache.reason(0x80, [10, 10, 10], 60, DEFAULTS, 1050), 'keepalive')
+        self.cache.done(0x80, [10, 10, 10], 60, DEFAULTS, ANSWER, 1050)
+        self.assertEqual(self.cache.keepalives(), {0x80: 1100})
+
+    def test_failed_exchange(self):
+        # after an error, the next command goes whatever it is, and the last answer is kept
+        self.cache.done(0x80, [10, 10, 10], 60, DEFAULTS, "-1 timeout", 1001)
+        self.assertEqual(self.cache.reason(0x80, [10, 10, 10], 60, DEFAULTS, 1002), 'new')
+        self.assertEqual(self.cache.keepalives(), {})
+        self.assertIs(self.cache.responses[0x80], ANSWER)
+
+    def test_forget(self):
+        self.cache.forget(0x80)
+        self.assertEqual((self.cache.sent, self.cache.responses), ({}, {}))
+        self.cache.forget(0x81)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+# Settings : validation of the JSON file, rejection of an invalid version on reload, reload by main.py
+import os
+import json
+import copy
+import tempfile
+import unittest
+from Libraries import config
+from Libraries import harness
+from Libraries import emulator
+
+
+def values(**changes):
+    """Valid settings, with 'Section.key' changed (None removes the key)"""
+    result = copy.deepcopy(harness.settings("/dev/null"))
+    for name, value in changes.items():
+        section, key = name.split('_', 1)
+        if value is None:
+            result[section].pop(key, None)
+        else:
+            result.setdefault(section, {})[key] = value
+    return result
+
+
+class ValidationTest(unittest.TestCase):
+
+    def test_valid(self):
+        cfg = config.Config(values(EVBox_addresses=["80", "8a"], SinaB_windows=[600, 30, 30]))
+        self.assertEqual(cfg.EVBox.addresses, [0x80, 0x8A])
+        self.assertEqual(cfg.SinaB.windows, [30, 600])  # sorted, once each
+        self.assertEqual(cfg.EVBox.allocation, "fair")  # default
+        self.assertEqual(cfg.Metrics.listen, "127.0.0.1:9877")
+
+    def test_errors(self):
+        cases = {
+            "SinaB.MaxConsoCurrent : missing": values(SinaB_MaxConsoCurrent=None),
+            "SinaB.RefreshF : an integer is expected": values(SinaB_RefreshF=1.5),
+            "EVBox.poleMin : -1 is out of": values(EVBox_poleMin=-1),
+            "EVBox.poleMax : a number is expected": values(EVBox_poleMax="32"),
+            "EVBox.addresses : an address is given twice": values(EVBox_addresses=["80", "80"]),
+            "EVBox.addresses : '1FF' is not a one byte address": values(EVBox_addresses=["1FF"]),
+            "EVBox.allocation : 'random' is not one of": values(EVBox_allocation="random"),
+            "EVBox.poleMin : 40 is above poleMax 32": values(EVBox_poleMin=40),
+            "SinaB.smoothing : 60 is not one of the windows": values(SinaB_smoothing=60),
+            "Log.daily : true or false is expected": values(Log_daily=1),
+        }
+        for expected, settings in cases.items():
+            with self.assertRaises(ValueError) as raised:
+                config.Config(settings)
+            self.assertIn(expected, str(raised.exception))
+
+    def test_every_error(self):
+        with self.assertRaises(ValueError) as raised:
+            config.Config(values(EVBox_poleMin="6", Serial_port=None))
+        self.assertEqual(len(str(raised.exception).splitlines()), 2)
+
+
+class ConfigFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "config.json")
+        self.write(values())
+        self.reasons = []
+        self.settings = config.ConfigFile(self.path, self.reasons.append)
+
+    def write(self, content):
+        with open(self.path, "w") as f:
+            f.write(content if isinstance(content, str) else json.dumps(content))
+
+    def test_reload(self):
+        self.assertFalse(self.settings.check())  # unchanged
+        self.write(values(EVBox_poleMax=16))
+        self.assertTrue(self.settings.check())
+        self.assertEqual(self.settings.current.EVBox.poleMax, 16)
+
+    def test_rejected(self):
+        previous = self.settings.current
+        self.write(values(EVBox_poleMin=40))
+        self.assertFalse(self.settings.check())
+        self.assertIs(self.settings.current, previous)  # the last good version stays in use
+        self.write("{not json")
+        self.assertFalse(self.settings.check())
+        self.assertFalse(self.settings.check())  # reported once
+        self.assertEqual(len(self.reasons), 2)
+        self.assertIn("poleMin", self.reasons[0])
+
+    def test_invalid_at_startup(self):
+        self.write(values(Serial_port=None))
+        with self.assertRaises(ValueError):
+            config.ConfigFile(self.path)
+
+
+class ReloadTest(unittest.TestCase):
+
+    """main.py taking a new version of its settings file between two cycles"""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        self.station = emulator.EVBoxEmulator(1, (0x80, 0x81), min_interval=0)
+        self.station.start()
+        self.main = harness.load_main(self.workdir, self.station.port)
+
+    def tearDown(self):
+        self.station.close()
+        self.main.bus.close()
+        self.main.writer.close()
+        os.chdir(self.cwd)
+
+    def change(self, addresses, **changes):
+        settings = harness.settings(self.station.port, addresses)
+        for name, value in changes.items():
+            section, key = name.split('_', 1)
+            settings[section][key] = value
+        with open(os.environ["SMATCHATHOME_CONFIG"], "w") as f:
+            json.dump(settings, f)
+
+    def test_modem_added_during_a_command(self):
+        main = self.main
+        command = main.control()
+        self.change((0x80, 0x81))
+        main.reload_settings()
+        self.assertEqual(main.addresses, [0x80, 0x81])
+        # the command computed before the reload only goes to the modems it has limits for
+        answers = main.sendto_stations(command)
+        self.assertEqual(list(answers), [0x80])
+        main.handle_response(command, answers)
+        command = main.control()
+        main.handle_response(command, main.sendto_stations(command))
+        self.assertEqual(sorted(main.stations), [0x80, 0x81])
+
+    def test_modem_removed(self):
+        main = self.main
+        self.change((0x80, 0x81))
+        main.reload_settings()
+        command = main.control()
+        main.handle_response(command, main.sendto_stations(command))
+        self.change((0x81,))
+        main.reload_settings()
+        self.assertEqual(sorted(main.stations), [0x81])
+        self.assertNotIn(0x80, main.commands.sent)
+
+    def test_rejected_version(self):
+        main = self.main
+        self.change((0x80,), EVBox_poleMin=50, EVBox_poleMax=32)
+        main.reload_settings()
+        self.assertEqual(main.settings.current.EVBox.poleMin, 6)
+        self.change((0x80,), EVBox_deadband=0.5)
+        main.reload_settings()
+        self.assertEqual(main.commands.deadband, 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
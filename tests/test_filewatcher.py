@@ -0,0 +1,74 @@
+# File watcher : a rewrite of the file calls back, stop() ends run() and watch() with inotify or by polling
+import os
+import asyncio
+import tempfile
+import threading
+import time
+import unittest
+from Libraries import filewatcher
+
+
+class FileWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "values")
+        self.calls = 0
+        self.watcher = filewatcher.FileWatcher(self.path, self.changed, poll_interval=0.05)
+
+    def tearDown(self):
+        self.watcher.close()
+
+    def changed(self):
+        self.calls += 1
+
+    def write(self, content):
+        with open(self.path, "w") as f:
+            f.write(content)
+
+    def wait(self, calls, timeout=2):
+        end = time.monotonic() + timeout
+        while self.calls < calls and time.monotonic() < end:
+            time.sleep(0.01)
+        self.assertEqual(self.calls, calls)
+
+    def test_run(self):
+        thread = threading.Thread(target=self.watcher.run)
+        thread.start()
+        self.write("1")
+        self.wait(1)
+        self.write("22")
+        self.wait(2)
+        self.watcher.stop()
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+
+    def run_watch(self):
+        async def scenario():
+            task = asyncio.ensure_future(self.watcher.watch())
+            await asyncio.sleep(0.1)
+            self.write("1")
+            await asyncio.sleep(0.2)
+            # from another thread, like SmartPi.stop()
+            threading.Thread(target=self.watcher.stop).start()
+            await asyncio.wait_for(task, 2)
+        asyncio.run(scenario())
+        self.assertEqual(self.calls, 1)
+
+    def test_watch(self):
+        self.run_watch()
+        self.assertEqual(self.watcher.mode, "inotify" if filewatcher._load_inotify() else "poll")
+
+    def test_watch_poll(self):
+        self.watcher._open_inotify = lambda: None
+        self.run_watch()
+        self.assertEqual(self.watcher.mode, "poll")
+
+    def test_stop_after_close(self):
+        self.watcher.close()
+        self.watcher.stop()  # no write to a closed descriptor
+        self.watcher.close()
+        self.assertFalse(self.watcher.enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()
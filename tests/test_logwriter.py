@@ -0,0 +1,77 @@
+# Buffered log writer : lines written by batches from its thread, files rotated by size or day and compressed
+import os
+import glob
+import gzip
+import time
+import tempfile
+import unittest
+from Libraries import logwriter
+
+
+class LogWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "logfile")
+        self.writer = None
+
+    def tearDown(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def start(self, **options):
+        self.writer = logwriter.LogWriter(silent=True, **options)
+        self.writer.start()
+        return self.writer
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_batch(self):
+        writer = self.start(flush_interval=60)
+        writer.write(self.path, "first")
+        writer.write(self.path, "second")
+        time.sleep(0.05)
+        self.assertFalse(os.path.exists(self.path))  # waiting in memory
+        self.assertTrue(writer.flush(2))
+        self.assertEqual(self.read(), "first\nsecond\n")
+        writer.write(self.path, "third")
+        writer.close()
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(self.read(), "first\nsecond\nthird\n")  # pending lines written by close()
+        self.assertFalse(writer.flush(0.1))  # nothing to wait for once stopped
+
+    def test_flush_size(self):
+        writer = self.start(flush_interval=60, flush_size=10)
+        writer.write(self.path, "0123456789")
+        end = time.monotonic() + 2
+        while not os.path.exists(self.path) and time.monotonic() < end:
+            time.sleep(0.01)
+        self.assertEqual(self.read(), "0123456789\n")
+
+    def test_rotate_size(self):
+        writer = self.start(max_size=100, daily=False, backups=2)
+        for i in range(5):
+            writer.write(self.path, str(i) * 60)
+            writer.flush(2)
+        archives = sorted(glob.glob(self.path + ".*.gz"), key=os.path.getmtime)
+        self.assertEqual(len(archives), 2)  # the oldest ones removed
+        with gzip.open(archives[-1], 'rt') as f:
+            self.assertEqual(f.read(), "3" * 60 + "\n")
+        self.assertEqual(self.read(), "4" * 60 + "\n")
+
+    def test_rotate_day(self):
+        with open(self.path, "w") as f:
+            f.write("yesterday\n")
+        os.utime(self.path, (time.time() - 86400, time.time() - 86400))
+        writer = self.start(max_size=0)
+        writer.write(self.path, "today")
+        writer.flush(2)
+        self.assertEqual(self.read(), "today\n")
+        archive, = glob.glob(self.path + ".*.gz")
+        with gzip.open(archive, 'rt') as f:
+            self.assertEqual(f.read(), "yesterday\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
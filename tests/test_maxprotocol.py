@@ -0,0 +1,61 @@
+# Max protocol frames : round trip of the commands and answers, and the answers refused by decode()
+import unittest
+from Libraries import maxprotocol
+
+# Answer of a modem with 2 ChargeBoxes
+ANSWER = b"\x02A080690001015E02007800000000000003E803E803E800000028007800000000000003E803E803E80000001EC47A\x03"
+
+
+def frame(raw):
+    """Answer frame of the raw bytes, with a valid checksum"""
+    payload = raw.hex().upper().encode()
+    return maxprotocol.START + payload + maxprotocol.checksum(payload) + maxprotocol.STOP
+
+
+class MaxProtocolTest(unittest.TestCase):
+
+    def test_decode(self):
+        response = maxprotocol.decode(ANSWER)
+        self.assertEqual((response.recipient, response.sender, response.command), (0xA0, 0x80, 0x69))
+        self.assertEqual((response.min_interval, response.max_current), (1, 35))
+        self.assertEqual([box.wh for box in response.boxes], [40, 30])
+        self.assertEqual(response.boxes[0].tolist(), [12, 0, 0, 0, 1, 1, 1, 40])
+        self.assertEqual(maxprotocol.decode(ANSWER[1:-1]).boxes[1].wh, 30)  # without START and STOP
+        self.assertEqual(maxprotocol.encode_response(response), ANSWER)
+
+    def test_command(self):
+        command = maxprotocol.encode_setmaxcurrent(16, 16, 16, 60, 8, 8, 8, recipient=0x81)
+        self.assertEqual(command[:1], maxprotocol.START)
+        self.assertEqual(maxprotocol.decode_command(command), (0x81, 0xA0, 0x69, (160, 160, 160, 60, 80, 80, 80)))
+
+    def test_bad_checksum(self):
+        corrupted = ANSWER[:20] + (b"0" if ANSWER[20:21] != b"0" else b"1") + ANSWER[21:]
+        with self.assertRaisesRegex(ValueError, "checksum"):
+            maxprotocol.decode(corrupted)
+        with self.assertRaisesRegex(ValueError, "checksum"):
+            maxprotocol.decode(b"\x02A0\x03")
+        with self.assertRaisesRegex(ValueError, "checksum"):
+            maxprotocol.decode_command(corrupted)
+
+    def test_wrong_length(self):
+        header = maxprotocol.HEADER.pack(0xA0, 0x80, 0x69, 1, 350, 2)
+        box = maxprotocol.CHARGEBOX.pack(60, 120, 0, 0, 1000, 1000, 1000, 30)
+        with self.assertRaisesRegex(ValueError, "2 ChargeBoxes"):
+            maxprotocol.decode(frame(header + box))  # one box missing
+        with self.assertRaisesRegex(ValueError, "2 ChargeBoxes"):
+            maxprotocol.decode(frame(header + box * 2 + b"\x00"))
+        with self.assertRaisesRegex(ValueError, "too short"):
+            maxprotocol.decode(frame(header[:-1]))
+        with self.assertRaises(ValueError):  # not hexadecimal
+            payload = b"A08069ZZ"
+            maxprotocol.decode(payload + maxprotocol.checksum(payload))
+
+    def test_too_many_boxes(self):
+        count = maxprotocol.MAX_CHARGEBOXES + 1
+        box = maxprotocol.CHARGEBOX.pack(60, 120, 0, 0, 1000, 1000, 1000, 30)
+        with self.assertRaisesRegex(ValueError, "21 ChargeBoxes"):
+            maxprotocol.decode(frame(maxprotocol.HEADER.pack(0xA0, 0x80, 0x69, 1, 350, count) + box * count))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+# Site view over several meters : roles combined, late meters, smoothing from the statistics of each meter
+import unittest
+import numpy
+from Libraries import meters
+from Libraries import valuesparser
+from Libraries import windowstats
+from Libraries import SmartPi
+
+NOW = 1700000000
+
+
+def meter(name, channels, currents, seconds=60, end=NOW, spans=None):
+    """Meter whose buffer has 'seconds' measures up to 'end', with the constant values 'currents' (channel -> A)"""
+    measure = SmartPi.SmartPi(5, 600, spans=spans)
+    measures = numpy.zeros(seconds, dtype=valuesparser.DTYPE)
+    measures['timestamp'] = numpy.arange(end - seconds + 1, end + 1)
+    for channel, current in currents.items():
+        measures[channel] = current
+    measure.store(measures)
+    return meters.Meter(name, measure, channels)
+
+
+class SiteTest(unittest.TestCase):
+
+    def test_roles(self):
+        site = meters.Site([meter("main", None, {'I1': 2, 'I2': -5, 'I3': 10}),
+                            meter("garage", {'I1': 'iConso', 'I2': '-iBatt'}, {'I1': 4, 'I2': 1}),
+                            meter("annex", {'F1': 'iConso'}, {'F1': 6})])
+        timestamp, iBatt, iPV, iConso = site.measures(30)
+        self.assertEqual(timestamp, SmartPi.todatetime(NOW))
+        self.assertEqual(iBatt, 2 - 1)  # signed, the garage clamp is in the other direction
+        self.assertEqual(iPV, 5)  # absolute value
+        self.assertEqual(iConso, 10 + 4 + 6)
+        self.assertEqual(site.measures(30, combine={'iConso': 'max'})[3], 10)
+        self.assertAlmostEqual(site.measures(30, combine={'iConso': 'mean'})[3], 20 / 3.0)
+
+    def test_late_meter(self):
+        site = meters.Site([meter("main", {'I3': 'iConso'}, {'I3': 10}),
+                            meter("late", {'I3': 'iConso'}, {'I3': 4}, end=NOW - 100)])
+        # the late meter does not hold the view back beyond max_skew, its last window is used meanwhile
+        self.assertEqual(site.aligned(30), NOW - 30)
+        self.assertEqual(site.measures(10, max_skew=30)[3], 14)
+        self.assertIsNone(meters.Site([]).measures(10))
+
+    def test_smoothing(self):
+        # the statistics follow fewer channels than the buffer has : the roles are read in their own columns
+        main = meter("main", {'I3': 'iConso', 'F1': 'iPV'}, {'I3': 10, 'F1': 3}, spans=(30,))
+        site = meters.Site([main])
+        self.assertIsNone(main.followed)  # F1 is not followed : the mean of the buffer is used
+        self.assertEqual(site.measures(30, smoothing=30)[2:], (3, 10))
+        measure = SmartPi.SmartPi(5, 600)
+        measure.stats = windowstats.WindowStats(measure.items[1:], (30,), channels=("I2", "I3"))
+        smoothed = meters.Meter("smoothed", measure, {'I3': 'iConso', 'I2': 'iPV'})
+        self.assertEqual(smoothed.followed, [1, 0])
+        for timestamp in range(NOW - 59, NOW + 1):
+            values = [0.0] * (len(measure.items) - 1)
+            values[1], values[2] = 2.0, 7.0
+            measure.stats.add(timestamp, values)
+            measure.buffer.append(timestamp, values)
+            measure.last_measure = timestamp
+        self.assertEqual(meters.Site([smoothed]).measures(30, smoothing=30)[2:], (2, 7))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+# Metrics in the Prometheus text format, rendered while other threads create new children
+import threading
+import unittest
+from Libraries import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_render(self):
+        counter = self.registry.register(metrics.Counter('test_total', 'Test "counter"', ['mode']))
+        counter.labels('Peak-shaving').inc(2)
+        gauge = self.registry.register(metrics.Gauge('test_gauge', 'Test gauge'))
+        gauge.set(1.5)
+        self.assertIs(self.registry.register(metrics.Counter('test_total', 'again', ['mode'])), counter)
+        text = self.registry.render()
+        self.assertIn('# TYPE test_total counter\n', text)
+        self.assertIn('test_total{mode="Peak-shaving"} 2', text)
+        self.assertIn('test_gauge 1.5', text)
+        self.assertLess(text.index('test_gauge'), text.index('test_total'))
+
+    def test_concurrent_labels(self):
+        counter = self.registry.register(metrics.Counter('test_labels_total', 'Test counter', ['index']))
+        errors = []
+
+        def create():
+            for index in range(5000):
+                counter.labels(index).inc()
+
+        def render():
+            try:
+                while thread.is_alive():
+                    self.registry.render()
+            except RuntimeError as error:  # dictionary changed size during iteration
+                errors.append(error)
+        thread = threading.Thread(target=create)
+        thread.start()
+        render()
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(counter.children), 5000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+# Mode switch : the mode follows the GPIO edges once the contacts stopped bouncing
+import time
+import unittest
+from Libraries import fakegpio
+from Libraries import modeswitch
+
+PINS = (23, 24)
+MODES = {(0, 1): "PV_High-priority", (1, 0): "PV_Low-priority", (0, 0): "Peak-shaving"}
+
+
+class ModeSwitchTest(unittest.TestCase):
+
+    def setUp(self):
+        fakegpio.cleanup()
+        fakegpio.setup(list(PINS), fakegpio.IN, pull_up_down=fakegpio.PUD_UP)
+        fakegpio.set_input(PINS[0], 0)  # (0, 1)
+        self.changes = []
+        self.switch = modeswitch.ModeSwitch(fakegpio, PINS, MODES, "Peak-shaving",
+                                            lambda old, new: self.changes.append((old, new)), settle=0.05)
+
+    def tearDown(self):
+        self.switch.close()
+        fakegpio.cleanup()
+
+    def wait(self, count, timeout=2):
+        end = time.monotonic() + timeout
+        while len(self.changes) < count and time.monotonic() < end:
+            time.sleep(0.01)
+
+    def test_initial(self):
+        self.assertEqual(self.switch.mode, "PV_High-priority")  # read at startup
+        self.assertEqual(self.changes, [("Peak-shaving", "PV_High-priority")])
+        self.assertTrue(self.switch.edges)
+
+    def test_debounce(self):
+        # the contact bounces before settling in the Low-priority position
+        for level in (1, 0, 1, 0, 1):
+            fakegpio.set_input(PINS[0], level)
+        fakegpio.set_input(PINS[1], 0)
+        self.assertEqual(self.switch.mode, "PV_High-priority")  # not before the settle delay
+        self.wait(2)
+        self.assertEqual(self.switch.mode, "PV_Low-priority")
+        time.sleep(0.1)
+        self.assertEqual(self.changes[1:], [("PV_High-priority", "PV_Low-priority")])  # published once
+
+    def test_undefined(self):
+        # both pins high between two positions : the last mode stays
+        fakegpio.set_input(PINS[0], 1)
+        time.sleep(0.15)
+        self.assertEqual(self.switch.mode, "PV_High-priority")
+        self.assertEqual(self.switch.position, (1, 1))
+        self.assertEqual(len(self.changes), 1)
+
+    def test_without_edges(self):
+        def unavailable(channel, edge, callback=None):
+            raise RuntimeError("Failed to add edge detection")
+        add_event_detect, fakegpio.add_event_detect = fakegpio.add_event_detect, unavailable
+        try:
+            switch = modeswitch.ModeSwitch(fakegpio, PINS, MODES, "Peak-shaving")
+        finally:
+            fakegpio.add_event_detect = add_event_detect
+        self.assertFalse(switch.edges)
+        fakegpio.set_input(PINS[1], 0)
+        self.assertEqual(switch.refresh(), "Peak-shaving")  # read on demand
+        switch.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
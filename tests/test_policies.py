@@ -0,0 +1,44 @@
+# Control laws : same orders for floats and arrays, and the own current of the stations removed from iConso
+import unittest
+import numpy
+from Libraries import policies
+from Libraries import maxprotocol
+
+
+def response(*boxes):
+    """StationResponse of a modem whose ChargeBoxes draw (L1, L2, L3) A with a power factor of 0.9"""
+    return maxprotocol.StationResponse(0x80, maxprotocol.MANAGER, maxprotocol.SETMAXCURRENT, 5, 32,
+                                       [maxprotocol.ChargeBox((60, l1 * 10, l2 * 10, l3 * 10, 900, 900, 900, 0))
+                                        for l1, l2, l3 in boxes])
+
+
+class PoliciesTest(unittest.TestCase):
+
+    def test_laws(self):
+        # iBatt, iPV, iConso, iStation, iMaxHouse
+        self.assertEqual(policies.order("PV_High-priority", 0, 10, 12, 0, 40), 10)
+        self.assertEqual(policies.order("PV_Low-priority", 5, 20, 12, 6, 40), 14)  # a discharge is not PV
+        self.assertEqual(policies.order("PV_Low-priority", -3, 20, 12, 6, 40), 11)  # a charge has priority
+        self.assertEqual(policies.order("Peak-shaving", 0, 0, 30, 10, 32), 12)
+        self.assertEqual(policies.order("Peak-shaving", 0, 0, 40, 0, 32), 0)  # never below 0
+        self.assertEqual(policies.order("unknown", 0, 0, 30, 10, 32), 12)  # taken as Peak-shaving
+        self.assertIsInstance(policies.order("Peak-shaving", 0, 0, 30, 10, 32), float)
+
+    def test_arrays(self):
+        iBatt, iPV, iConso = numpy.array([5, -3, 0]), numpy.array([20, 20, 0]), numpy.array([12, 12, 50])
+        for mode in policies.POLICIES:
+            orders = policies.order(mode, iBatt, iPV, iConso, 1.0, 40)
+            expected = [policies.order(mode, b, p, c, 1.0, 40) for b, p, c in zip(iBatt, iPV, iConso)]
+            numpy.testing.assert_allclose(orders, expected)
+
+    def test_station_current(self):
+        # a three-phase car at 10 A and a single-phase one at 16 A on L1 : the clamp on L1 sees 26 A
+        responses = [response((10, 10, 10), (16, 0, 0)), response((0, 0, 0))]
+        self.assertAlmostEqual(policies.station_current(responses), 26)
+        self.assertAlmostEqual(policies.station_current(responses, phase=1), 10)
+        self.assertAlmostEqual(policies.station_current([response((0, 0, 7))], phase=2), 7)
+        self.assertEqual(policies.station_current([]), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
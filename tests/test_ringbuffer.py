@@ -0,0 +1,91 @@
+# RingBuffer : circular storage, moving means from the cumulative sums and their rebase
+import unittest
+import numpy
+from Libraries.ringbuffer import RingBuffer
+
+
+def samples(count, start=1000):
+    timestamps = numpy.arange(start, start + count, dtype=numpy.int64)
+    values = numpy.stack((numpy.arange(count, dtype=numpy.float64), numpy.sin(numpy.arange(count))), axis=1)
+    return timestamps, values
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_empty(self):
+        buffer = RingBuffer(4, 2)
+        self.assertEqual(len(buffer), 0)
+        self.assertIsNone(buffer.last())
+        self.assertIsNone(buffer.mean())
+        self.assertIsNone(buffer.mean_between(0, 10))
+
+    def test_wrap(self):
+        # more samples than the size : only the newest ones are kept, in chronological order
+        buffer = RingBuffer(5, 2)
+        timestamps, values = samples(13)
+        for timestamp, value in zip(timestamps, values):
+            buffer.append(timestamp, value)
+        self.assertEqual(len(buffer), 5)
+        kept, data = buffer.get()
+        numpy.testing.assert_array_equal(kept, timestamps[-5:])
+        numpy.testing.assert_array_equal(data, values[-5:])
+        self.assertEqual(buffer.last()[0], timestamps[-1])
+        first, last, means = buffer.mean(3)
+        self.assertEqual((first, last), (timestamps[-3], timestamps[-1]))
+        numpy.testing.assert_allclose(means, values[-3:].mean(axis=0))
+        self.assertIsNone(buffer.mean(6))
+
+    def test_extend_like_append(self):
+        timestamps, values = samples(23)
+        one, many = RingBuffer(7, 2), RingBuffer(7, 2)
+        for timestamp, value in zip(timestamps, values):
+            one.append(timestamp, value)
+        for part in numpy.split(numpy.arange(23), [3, 10, 11]):
+            many.extend(timestamps[part], values[part])
+        for result, expected in zip(many.get(), one.get()):
+            numpy.testing.assert_array_equal(result, expected)
+        numpy.testing.assert_allclose(many.mean(7)[2], one.mean(7)[2])
+        # a block longer than the buffer
+        many.extend(*samples(30, 5000))
+        numpy.testing.assert_array_equal(many.get()[0], numpy.arange(5023, 5030))
+
+    def test_rebase(self):
+        # large values over many turns of the buffer : the means stay exact once the sums are brought back
+        buffer = RingBuffer(10, 1)
+        for i in range(100000):
+            buffer.append(i, [1e9 + i % 7])
+        expected = numpy.array([1e9 + i % 7 for i in range(99990, 100000)])
+        numpy.testing.assert_allclose(buffer.mean()[2], [expected.mean()], rtol=0, atol=1e-6)
+        self.assertLess(abs(buffer._cum).max(), 1e12)
+
+    def test_non_finite(self):
+        # a NaN would stay in the cumulative sums, through every rebase : it is not stored
+        buffer = RingBuffer(4, 2)
+        self.assertTrue(buffer.append(1, [1, 2]))
+        self.assertFalse(buffer.append(2, [numpy.nan, 2]))
+        self.assertFalse(buffer.append(3, [1, numpy.inf]))
+        timestamps, values = samples(10, 4)
+        values[[2, 5], 1] = [numpy.nan, -numpy.inf]
+        buffer.extend(timestamps, values)
+        kept = numpy.delete(numpy.arange(10), [2, 5])
+        numpy.testing.assert_array_equal(buffer.get()[0], timestamps[kept][-4:])
+        numpy.testing.assert_allclose(buffer.mean()[2], values[kept][-4:].mean(axis=0))
+        for i in range(20):
+            buffer.append(100 + i, [i, i])
+        self.assertTrue(numpy.isfinite(buffer._cum).all())
+        self.assertEqual(buffer.mean(2)[2].tolist(), [18.5, 18.5])
+
+    def test_mean_between(self):
+        buffer = RingBuffer(6, 2)
+        timestamps, values = samples(9)
+        buffer.extend(timestamps, values)
+        first, last, means = buffer.mean_between(timestamps[4], timestamps[6])
+        self.assertEqual((first, last), (timestamps[4], timestamps[6]))
+        numpy.testing.assert_allclose(means, values[4:7].mean(axis=0))
+        self.assertIsNone(buffer.mean_between(timestamps[0], timestamps[2]))  # overwritten
+        first, last, means = buffer.mean_since(timestamps[7])
+        numpy.testing.assert_allclose(means, values[7:].mean(axis=0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+# RS485 session : a port that cannot be opened or disappears is retried with a doubling backoff
+import os
+import time
+import tempfile
+import unittest
+import serial
+from Libraries import rs485
+
+
+def settings(port):
+    return {'port': port, 'baudrate': 38400, 'bytesize': 8, 'parity': 'N', 'stopbits': 1, 'timeout': 0.1,
+            'writeTimeout': 0.1}
+
+
+class SerialSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        # pseudo-terminal standing for the USB adapter
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        os.close(slave)
+        self.session = rs485.SerialSession(settings("/dev/td2c-missing"), min_backoff=0.05, max_backoff=0.15)
+
+    def tearDown(self):
+        self.session.close()
+        os.close(self.master)
+
+    def test_backoff(self):
+        session = self.session
+        with session as port:
+            self.assertIsNone(port)
+        self.assertEqual(session.failures, 1)
+        self.assertEqual(session.backoff, 0.1)
+        with session as port:
+            self.assertIsNone(port)  # no new attempt before the backoff
+        self.assertEqual(session.failures, 1)
+        for failures, backoff in ((2, 0.15), (3, 0.15)):  # doubled up to max_backoff
+            time.sleep(session.next_attempt - time.monotonic() + 0.01)
+            self.assertIsNone(session.acquire())
+            self.assertEqual((session.failures, session.backoff), (failures, backoff))
+
+    def test_recovery(self):
+        session = self.session
+        self.assertIsNone(session.acquire())
+        session.reconfigure(settings(self.port))  # no wait after new settings
+        with session as port:
+            self.assertIsNotNone(port)
+            self.assertTrue(port.is_open)
+        self.assertEqual(session.backoff, 0.05)
+        with session as same:
+            self.assertIs(same, port)  # kept open between the commands
+        with self.assertRaises(serial.SerialException):
+            with session as port:
+                raise serial.SerialException("write failed")
+        # the error is not swallowed, but the port is closed and reopened after the backoff
+        self.assertIsNone(session.serial)
+        self.assertFalse(port.is_open)
+        self.assertEqual(session.failures, 2)
+        self.assertIsNone(session.acquire())
+        time.sleep(session.next_attempt - time.monotonic() + 0.01)
+        self.assertIsNotNone(session.acquire())
+
+    def test_device_gone(self):
+        # the adapter re-enumerated : its device file disappeared while the port was open
+        link = os.path.join(tempfile.mkdtemp(), "ttyUSB0")
+        os.symlink(self.port, link)
+        session = rs485.SerialSession(settings(link), min_backoff=0.05)
+        port = session.acquire()
+        self.assertTrue(port.is_open)
+        os.remove(link)
+        self.assertIsNone(session.acquire())
+        self.assertFalse(port.is_open)
+        self.assertEqual(session.failures, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# ControlRuntime driving main.py against the EV-Box emulator on a pseudo terminal
+import os
+import time
+import asyncio
+import tempfile
+import unittest
+from Libraries import harness
+from Libraries import emulator
+from Libraries import runtime as controlruntime
+
+
+class Idle:
+
+    """No measure source : the cycles only come from the triggers and the deadlines"""
+
+    async def ingest(self):
+        await asyncio.Event().wait()
+
+
+class ControlRuntimeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        self.station = emulator.EVBoxEmulator(1, (0x80,), min_interval=0)
+        self.station.start()
+        self.main = harness.load_main(self.workdir, self.station.port)
+        self.cycles = 0
+        self.before = self.counts()
+
+    def tearDown(self):
+        self.station.close()
+        self.main.bus.close()
+        self.main.writer.close()
+        os.chdir(self.cwd)
+
+    def control(self):
+        self.cycles += 1
+        return self.main.control()
+
+    def run_for(self, seconds):
+        main = self.main
+        runtime = controlruntime.ControlRuntime(Idle(), self.control, main.sendto_stations, main.handle_response,
+                                                main.next_deadline, main.min_interval)
+        main.runtime = runtime
+
+        async def scenario():
+            task = asyncio.ensure_future(runtime.run())
+            await asyncio.sleep(0.2)
+            runtime.trigger()
+            await asyncio.sleep(seconds)
+            runtime.stop()
+            await task
+
+        asyncio.run(asyncio.wait_for(scenario(), seconds + 10))
+
+    def counts(self):
+        return dict((labels, child.value) for labels, child in self.main.decisions.children.items())
+
+    def decisions(self, reason):
+        # the counters are kept by the metrics registry across the imports of main
+        key = ('80', reason)
+        return self.counts().get(key, 0) - self.before.get(key, 0)
+
+    def test_exchange(self):
+        self.run_for(1)
+        self.assertEqual(self.decisions('new'), 1)
+        self.assertIn(0x80, self.main.stations)
+        self.assertGreater(self.station.received, 0)
+
+    def test_keepalive(self):
+        # timeout 3 s, repeated 1 s before : a keep-alive about every 2 s, and no busy loop in between
+        self.main.settings.current.EVBox.timeout = 3
+        self.main.commands.margin = 1
+        started = time.monotonic()
+        self.run_for(6.5)
+        self.assertGreaterEqual(self.decisions('keepalive'), 2)
+        self.assertLess(self.cycles, 20)
+        self.assertLess(time.monotonic() - started, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# Warm restart snapshot : round trip, and the files refused (other version, corrupted, too old)
+import os
+import zlib
+import struct
+import tempfile
+import unittest
+import numpy
+from Libraries import maxprotocol
+from Libraries import snapshot
+
+# Answer of a modem with 2 ChargeBoxes
+ANSWER = b"\x02A080690001015E02007800000000000003E803E803E800000028007800000000000003E803E803E80000001EC47A\x03"
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "snapshot.bin")
+        self.timestamps = numpy.arange(1700000000, 1700000010)
+        self.data = numpy.arange(10 * 17, dtype=numpy.float64).reshape(10, 17)
+
+    def save(self):
+        snapshot.save(self.path, [(self.timestamps, self.data, 1700000009)], {0x80: maxprotocol.decode(ANSWER)},
+                      4.5, 16)
+
+    def test_round_trip(self):
+        self.save()
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        state = snapshot.load(self.path, 60)
+        buffer, = state['buffers']
+        numpy.testing.assert_array_equal(buffer['timestamps'], self.timestamps)
+        numpy.testing.assert_array_equal(buffer['data'], self.data)
+        self.assertEqual(buffer['last_measure'], 1700000009)
+        self.assertEqual(maxprotocol.encode_response(state['responses'][0x80]), ANSWER)
+        self.assertEqual((state['iStation'], state['order']), (4.5, 16))
+
+    def test_missing_or_old(self):
+        self.assertIsNone(snapshot.load(self.path, 60))
+        self.save()
+        self.assertIsNone(snapshot.load(self.path, -1))  # saved before the maximum age
+
+    def test_version(self):
+        self.save()
+        with open(self.path, 'rb') as f:
+            content = bytearray(f.read())
+        # a file of the previous version, with a valid CRC
+        struct.pack_into('<H', content, 8, snapshot.VERSION - 1)
+        content[-4:] = struct.pack('<I', zlib.crc32(bytes(content[:-4])))
+        with open(self.path, 'wb') as f:
+            f.write(content)
+        with self.assertRaisesRegex(ValueError, "version"):
+            snapshot.load(self.path, 60)
+
+    def test_corrupted(self):
+        self.save()
+        with open(self.path, 'r+b') as f:
+            f.seek(100)
+            f.write(b'\xff')
+        with self.assertRaisesRegex(ValueError, "corrupted"):
+            snapshot.load(self.path, 60)
+        with open(self.path, 'wb') as f:
+            f.write(b'TD2C')
+        with self.assertRaisesRegex(ValueError, "corrupted"):
+            snapshot.load(self.path, 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
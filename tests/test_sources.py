@@ -0,0 +1,112 @@
+# Sources of measures : lines pushed on a socket, registers of a Modbus-TCP meter, reconnection after errors
+import os
+import socket
+import asyncio
+import tempfile
+import unittest
+from Libraries import modbus
+from Libraries import sources
+from Libraries import SmartPi
+
+LINE = "2019-03-29 10:20:{:02d};1.5;2.25;3.75;0.5;230.1;229.8;231.2;345.1;517.6;862.3;0.98;0.97;0.99;50.0;50.0;50.0;0;\n"
+
+
+class SourcesTest(unittest.TestCase):
+
+    def setUp(self):
+        sources.debug = False
+        self.measure = SmartPi.SmartPi(5, 60)
+
+    def tearDown(self):
+        sources.debug = True
+
+    def run_source(self, source, action, timeout=5):
+        """Run the source until 'action' (a coroutine function) returns, then stop it"""
+        async def scenario():
+            task = asyncio.ensure_future(source.run(self.measure))
+            await asyncio.sleep(0.1)
+            try:
+                await action()
+            finally:
+                source.stop()
+                await asyncio.wait([task], timeout=timeout)
+            self.assertTrue(task.done())
+        asyncio.run(asyncio.wait_for(scenario(), timeout * 2))
+
+    async def received(self, count, timeout=3):
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        while len(self.measure.buffer) < count and loop.time() < end:
+            await asyncio.sleep(0.02)
+
+    def test_url(self):
+        with self.assertRaises(ValueError):
+            sources.StreamSource("http://localhost:80")
+        with self.assertRaises(ValueError):
+            sources.StreamSource("/var/tmp/smartpi/values")
+
+    def test_tcp(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        server.close()
+        source = sources.StreamSource("tcp://127.0.0.1:{}".format(port))
+
+        async def send():
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            text = LINE.format(5) + LINE.format(10)
+            writer.write(text[:30].encode())  # a line split in two segments
+            await writer.drain()
+            await asyncio.sleep(0.05)
+            writer.write(text[30:].encode() + b"not a measure\n")
+            await writer.drain()
+            await self.received(2)
+            writer.close()
+        self.run_source(source, send)
+        self.assertEqual(len(self.measure.buffer), 2)
+        self.assertEqual(self.measure.buffer.last()[1][0], 1.5)  # I1
+
+    def test_unix(self):
+        path = os.path.join(tempfile.mkdtemp(), "values.sock")
+        source = sources.StreamSource("unix://" + path)
+
+        async def send():
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(LINE.format(5).encode())
+            await writer.drain()
+            await self.received(1)
+            writer.close()
+        self.run_source(source, send)
+        self.assertEqual(len(self.measure.buffer), 1)
+
+    def test_modbus(self):
+        meter = modbus.ModbusServer()
+        meter.start()
+        try:
+            meter.set(sources.REGISTERS['I1'][0], 3.5)
+            meter.set(sources.REGISTERS['I3'][0], -7.25)
+            source = sources.ModbusSource('127.0.0.1', meter.port, interval=1)
+            self.run_source(source, lambda: self.received(1))
+        finally:
+            meter.close()
+        self.assertGreaterEqual(len(self.measure.buffer), 1)
+        timestamp, values = self.measure.buffer.last()
+        self.assertEqual((values[0], values[2]), (3.5, -7.25))  # I1, I3
+        self.assertEqual(source.errors, 0)
+
+    def test_modbus_unreachable(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        server.close()
+        source = sources.ModbusSource('127.0.0.1', port, timeout=0.2, backoff=0.1)
+
+        async def wait():
+            await asyncio.sleep(0.35)
+        self.run_source(source, wait)
+        self.assertGreaterEqual(source.errors, 2)  # connection refused, then tried again after the backoff
+        self.assertEqual(len(self.measure.buffer), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+# Cycles triggered by a move of the order, and the RefreshF cycles between them
+import os
+import tempfile
+import unittest
+import numpy
+from Libraries import harness
+from Libraries import emulator
+from Libraries import meters
+from Libraries import valuesparser
+from Libraries import SmartPi
+
+
+class Runtime:
+
+    """Stand-in of the ControlRuntime, only counts the triggers"""
+
+    def __init__(self):
+        self.triggers = 0
+
+    def trigger(self):
+        self.triggers += 1
+
+
+class TriggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        self.station = emulator.EVBoxEmulator(1, (0x80,), min_interval=0)
+        self.station.start()
+        self.main = harness.load_main(self.workdir, self.station.port, "Peak-shaving")
+        self.measure = SmartPi.SmartPi(5, 600)
+        self.main.site = meters.Site([meters.Meter("main", self.measure)])
+        self.main.runtime = Runtime()
+        self.now = 1700000000
+        self.feed(300, 12)  # the house takes 12 A of the 40 A allowed
+
+    def tearDown(self):
+        self.station.close()
+        self.main.bus.close()
+        self.main.writer.close()
+        os.chdir(self.cwd)
+
+    def feed(self, seconds, iConso):
+        measures = numpy.zeros(seconds, dtype=valuesparser.DTYPE)
+        measures['timestamp'] = numpy.arange(self.now + 1, self.now + seconds + 1)
+        measures['I3'] = iConso
+        self.now += seconds
+        self.measure.store(measures)
+
+    def test_step_then_boundary(self):
+        main = self.main
+        main.settings.current.SinaB.triggerThreshold = 2
+        self.assertEqual(main.control()['order'], 28)
+        # a load of 18 A starts : the order is cut at once...
+        self.feed(40, 30)
+        main.on_measure(40)
+        self.assertEqual(main.runtime.triggers, 1)
+        self.assertEqual(main.control()['order'], 10)
+        # ...and the next RefreshF cycle keeps it, though the mean of the minute is still below 30 A
+        self.feed(5, 30)
+        self.assertEqual(main.control()['order'], 10)
+        main.on_measure(5)
+        self.assertEqual(main.runtime.triggers, 1)
+
+    def test_without_trigger(self):
+        # the RefreshF cycles keep the mean of the RefreshF minutes : 20 s at 12 A and 40 s at 30 A
+        main = self.main
+        self.feed(40, 30)
+        main.on_measure(40)
+        self.assertEqual(main.runtime.triggers, 0)
+        self.assertAlmostEqual(main.control()['order'], 16)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# Columnar store : range queries on the raw rows, rollups per bucket (and per connector), reopening
+import tempfile
+import unittest
+from Libraries import tsstore
+
+EPOCH = 1699999200  # a multiple of 3600
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = tsstore.TimeSeriesStore(self.path, resolutions=(60, 3600))
+
+    def fill(self, store, seconds=150):
+        for t in range(seconds):
+            store.append('measures', EPOCH + t, [1, t, 10])
+
+    def test_range(self):
+        self.fill(self.store)
+        rows = self.store.query('measures', EPOCH + 10, EPOCH + 20)
+        self.assertEqual(rows['timestamp'].tolist(), list(range(EPOCH + 10, EPOCH + 20)))
+        self.assertEqual(rows['iPV'].tolist(), list(range(10, 20)))
+        self.assertEqual(len(self.store.query('measures')['timestamp']), 150)
+        self.assertEqual(len(self.store.query('measures', EPOCH + 200)['timestamp']), 0)
+        with self.assertRaises(ValueError):
+            self.store.append('measures', EPOCH, [0, 0, 0])  # older than the last row
+
+    def test_rollup(self):
+        self.fill(self.store)
+        minutes = self.store.query('measures', resolution=60)
+        self.assertEqual(minutes['timestamp'].tolist(), [EPOCH, EPOCH + 60, EPOCH + 120])
+        self.assertEqual(minutes['count'].tolist(), [60, 60, 30])  # the last bucket is still being filled
+        self.assertEqual(minutes['iPV'].tolist(), [29.5, 89.5, 134.5])
+        self.assertEqual(minutes['iPV_min'].tolist(), [0, 60, 120])
+        self.assertEqual(minutes['iPV_max'].tolist(), [59, 119, 149])
+        self.assertEqual(self.store.query('measures', EPOCH + 60, EPOCH + 120, 60)['count'].tolist(), [60])
+        hour = self.store.query('measures', resolution=3600)
+        self.assertEqual(hour['count'].tolist(), [150])
+        self.assertEqual(hour['iConso'].tolist(), [10])
+
+    def test_reopen(self):
+        self.fill(self.store)
+        self.store.flush()
+        store = tsstore.TimeSeriesStore(self.path, resolutions=(60, 3600))
+        # the bucket being filled is rebuilt from the raw rows
+        self.assertEqual(store.query('measures', resolution=60)['count'].tolist(), [60, 60, 30])
+        store.append('measures', EPOCH + 150, [1, 150, 10])
+        self.assertEqual(store.query('measures', resolution=60)['count'].tolist(), [60, 60, 31])
+
+    def test_connectors(self):
+        # 2 modems, the second one with 2 ChargeBoxes drawing different currents, their counters growing
+        for t in range(0, 120, 10):
+            for connector, current in ((8000, 6), (8100, 16), (8101, 32)):
+                self.store.append('connectors', EPOCH + t, [connector, 6, current, 0, 0, 1, 1, 1, connector + t])
+        minutes = self.store.query('connectors', resolution=60)
+        self.assertEqual(minutes['timestamp'].tolist(), [EPOCH] * 3 + [EPOCH + 60] * 3)
+        self.assertEqual(minutes['connector'].tolist(), [8000, 8100, 8101] * 2)
+        self.assertEqual(minutes['l1'].tolist(), [6, 16, 32] * 2)  # not the mean of the 3 connectors
+        self.assertEqual(minutes['count'].tolist(), [6] * 6)
+        self.assertEqual(minutes['wh'].tolist(), [8050, 8150, 8151, 8110, 8210, 8211])  # last reading
+        self.assertEqual(minutes['wh_min'].tolist(), [8000, 8100, 8101, 8060, 8160, 8161])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+# valuesparser : vectorized conversion of the SmartPi values file and its count of malformed lines
+import os
+import calendar
+import tempfile
+import unittest
+from Libraries import valuesparser
+
+
+def line(stamp, i1=1.5, i2=-2.0, i3=3.25):
+    values = [i1, i2, i3] + list(range(4, 18))
+    return stamp + ';' + ''.join('{};'.format(value) for value in values) + '\n'
+
+
+class ValuesParserTest(unittest.TestCase):
+
+    def test_valid(self):
+        text = line("2024-02-29 23:59:59") + line("2024-03-01 00:00:00", 4, 5, 6)
+        result, report = valuesparser.parse(text)
+        self.assertEqual(report['lines'], 2)
+        self.assertEqual(report['parsed'], 2)
+        self.assertEqual(sum(report['malformed'].values()), 0)
+        self.assertEqual(result['timestamp'][0], calendar.timegm((2024, 2, 29, 23, 59, 59)))
+        self.assertEqual(result['timestamp'][1] - result['timestamp'][0], 1)
+        self.assertEqual((result['I1'][0], result['I2'][0], result['I3'][0]), (1.5, -2.0, 3.25))
+        self.assertEqual(result['Balanced'][1], 17)
+
+    def test_malformed(self):
+        text = (line("2024-01-01 10:00:00") +
+                "2024-01-01 10:00:01;1;2;3;\n" +                     # field count
+                line("2024-01-01 10:00:02")[:-2] + "\n" +             # last ';' missing
+                line("2023-02-29 10:00:03") +                         # not a leap year
+                line("2024-01-01 25:00:04") +                         # hour
+                line("2024/01/01 10:00:05") +                         # separator
+                line("2024-01-01 10:00:06", i2="abc") +               # value
+                "\n" +                                                # blank, not a line
+                line("2024-01-01 10:00:07").replace('\n', '\r\n'))  # CRLF is accepted
+        result, report = valuesparser.parse(text)
+        self.assertEqual(report['lines'], 8)
+        self.assertEqual(report['parsed'], 2)
+        self.assertEqual(report['malformed'], {'field count': 2, 'timestamp': 3, 'value': 1})
+        self.assertEqual(list(result['timestamp'] % 60), [0, 7])
+
+    def test_non_finite(self):
+        # accepted by float(), but a NaN or an infinite value is not a measure
+        text = (line("2024-01-01 10:00:00") + line("2024-01-01 10:00:01", i1="nan") +
+                line("2024-01-01 10:00:02", i3="inf") + line("2024-01-01 10:00:03", i2="-Infinity") +
+                line("2024-01-01 10:00:04", i2="bad") + line("2024-01-01 10:00:05", i1="NaN"))
+        result, report = valuesparser.parse(text)
+        self.assertEqual(report['malformed'], {'field count': 0, 'timestamp': 0, 'value': 5})
+        self.assertEqual(list(result['timestamp'] % 60), [0])
+
+    def test_report_accumulates(self):
+        report = valuesparser.new_report()
+        valuesparser.parse(line("2024-01-01 10:00:00"), report)
+        valuesparser.parse("garbage\n", report)
+        self.assertEqual((report['lines'], report['parsed'], report['malformed']['field count']), (2, 1, 1))
+
+    def test_file_by_chunks(self):
+        # a chunk boundary inside a line : the line is completed with the next chunk
+        lines = [line("2024-01-01 10:{:02d}:{:02d}".format(i // 60, i % 60), i) for i in range(200)]
+        path = os.path.join(tempfile.mkdtemp(), "values")
+        with open(path, "w") as f:
+            f.write(''.join(lines) + "bad line without newline")
+        result, report = valuesparser.parse_file(path, chunk_size=1000)
+        self.assertEqual(report['parsed'], 200)
+        self.assertEqual(report['malformed']['field count'], 1)
+        self.assertEqual(list(result['I1']), list(range(200)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+# WindowStats : statistics of the measures over several sliding windows
+import math
+import random
+import unittest
+import numpy
+from Libraries.windowstats import WindowStats
+from Libraries.valuesparser import ITEMS
+
+NAMES = ("I1", "I2", "Cos1")
+
+
+class WindowStatsTest(unittest.TestCase):
+
+    def test_statistics(self):
+        stats = WindowStats(NAMES, spans=(10, 100), channels=("I1", "I2"))
+        for t in range(50):
+            stats.add(1000 + t, [t, -t, 1])
+        # the samples of the last 10 s : 40..49
+        self.assertEqual(stats.get('mean', 10, "I1"), 44.5)
+        self.assertEqual(stats.get('min', 10, "I1"), 40)
+        self.assertEqual(stats.get('max', 10, "I2"), -40)
+        self.assertEqual(stats.get('quantile', 10, "I1", q=0.5), 45)
+        self.assertEqual(stats.get('mean', 100, "I1"), 24.5)
+        self.assertLess(stats.get('ewma', 10, "I1"), 49)
+        self.assertIsNone(WindowStats(ITEMS[1:]).get('mean', 30))
+
+    def test_against_brute_force(self):
+        generator = random.Random(2)
+        stats = WindowStats(NAMES, spans=(30,), channels=NAMES)
+        samples = []
+        t = 0
+        for i in range(500):
+            t += generator.choice((1, 1, 2, 7))
+            values = [generator.uniform(-20, 20), generator.choice((0.0, 5.0, 10.0)), generator.random()]
+            stats.add(t, values)
+            samples.append((t, values))
+            inside = numpy.array([v for s, v in samples if s > t - 30])
+            numpy.testing.assert_allclose(stats.get('mean', 30), inside.mean(axis=0))
+            numpy.testing.assert_array_equal(stats.get('min', 30), inside.min(axis=0))
+            numpy.testing.assert_array_equal(stats.get('max', 30), inside.max(axis=0))
+
+    def test_non_finite(self):
+        # a NaN or an infinite value is ignored : it must neither break the sorted values nor stay in the sums
+        stats = WindowStats(NAMES, spans=(30, 120, 600), channels=NAMES)
+        generator = random.Random(3)
+        kept = []
+        for t in range(2000):
+            values = [generator.uniform(0, 10), 5.0, 0.9]
+            if generator.random() < 0.3:
+                values[2] = generator.choice((math.nan, math.inf, -math.inf))
+                self.assertFalse(stats.add(t, values))
+            else:
+                self.assertTrue(stats.add(t, values))
+                kept.append((t, values))
+        inside = numpy.array([v for s, v in kept if s > kept[-1][0] - 30])
+        for span in (30, 120, 600):
+            self.assertTrue(numpy.isfinite(stats.get('ewma', span)).all())
+            self.assertTrue(numpy.isfinite(stats.get('quantile', span, q=0.95)).all())
+        numpy.testing.assert_allclose(stats.get('mean', 30), inside.mean(axis=0))
+
+    def test_extend_non_finite(self):
+        stats = WindowStats(NAMES, spans=(30,), channels=NAMES)
+        values = numpy.array([[1, 2, 0.5], [numpy.nan, 2, 0.5], [3, numpy.inf, 0.5], [5, 2, 0.5]])
+        stats.extend(numpy.arange(100, 104), values)
+        self.assertEqual(len(stats.windows[30]), 2)
+        self.assertEqual(stats.get('mean', 30, "I1"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()